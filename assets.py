@@ -0,0 +1,112 @@
+import os
+from collections import OrderedDict
+import pygame
+
+FONT_PATH = os.path.join("assets", "font.ttf")
+
+# how many entries each cache keeps before dropping the least recently used one
+MAX_CACHED_IMAGES = 32
+MAX_CACHED_SCALED = 64
+MAX_CACHED_FONTS = 32
+
+
+class LRUCache:
+    def __init__(self, max_entries: int) -> None:
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, build):
+        # return the cached value for key, building (and maybe evicting) on a miss
+        if key in self.entries:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return self.entries[key]
+        self.misses += 1
+        value = build()
+        self.entries[key] = value
+        if len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        return value
+
+    def clear(self) -> None:
+        self.entries.clear()
+
+
+_images = LRUCache(MAX_CACHED_IMAGES)
+_scaled = LRUCache(MAX_CACHED_SCALED)
+_fonts = LRUCache(MAX_CACHED_FONTS)
+_quit_hooked = False
+
+
+def _on_quit():
+    global _quit_hooked
+    _quit_hooked = False
+    clear()
+
+
+def _hook_quit():
+    # fonts die with pygame.quit(), so nothing cached may outlive it. pygame forgets
+    # its quit callbacks once they have run, so the hook is registered again after each quit
+    global _quit_hooked
+    if not _quit_hooked:
+        pygame.register_quit(_on_quit)
+        _quit_hooked = True
+
+
+def _read(path, convert):
+    # convert is None (keep the file's format), "alpha" (convert_alpha) or "opaque" (convert)
+    image = pygame.image.load(path)
+    if convert == "alpha":
+        return image.convert_alpha()
+    if convert == "opaque":
+        return image.convert()
+    return image
+
+
+def load_image(path: str, convert: str = None) -> pygame.Surface:
+    # cached images are shared: blit them, don't draw on them
+    _hook_quit()
+    return _images.get((os.path.abspath(path), convert), lambda: _read(path, convert))
+
+
+def load_scaled(path: str, size, convert: str = None) -> pygame.Surface:
+    # a scaled copy of an image; the full-size original is only kept if it was cached already
+    def build():
+        image = _images.entries.get((os.path.abspath(path), convert))
+        if image is None:
+            image = _read(path, convert)
+        return pygame.transform.scale(image, size)
+    _hook_quit()
+    return _scaled.get((os.path.abspath(path), tuple(size), convert), build)
+
+
+def get_font(size: int, path: str = FONT_PATH) -> pygame.font.Font:
+    _hook_quit()
+    return _fonts.get(("file", path, size), lambda: pygame.font.Font(path, size))
+
+
+def get_sys_font(name: str, size: int, bold: bool = False, italic: bool = False) -> pygame.font.Font:
+    _hook_quit()
+    return _fonts.get(("sys", name.lower(), size, bold, italic),
+                      lambda: pygame.font.SysFont(name, size, bold=bold, italic=italic))
+
+
+def forget(path: str) -> None:
+    # drop every cached copy of a file that was rewritten or deleted
+    path = os.path.abspath(path)
+    for cache in (_images, _scaled):
+        for key in [key for key in cache.entries if key[0] == path]:
+            del cache.entries[key]
+
+
+def clear() -> None:
+    _images.clear()
+    _scaled.clear()
+    _fonts.clear()
+
+
+def stats() -> dict:
+    return {name: {"hits": cache.hits, "misses": cache.misses, "entries": len(cache.entries)}
+            for name, cache in (("images", _images), ("scaled", _scaled), ("fonts", _fonts))}
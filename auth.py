@@ -2,6 +2,7 @@
 
 import pygame
 import sys
+from assets import get_sys_font
 
 SCREEN_WIDTH = 1500
 SCREEN_HEIGHT = 800
@@ -36,7 +37,7 @@ def entry_screen(screen, font):
     guest_btn = pygame.Rect(SCREEN_WIDTH // 2 - 70, SCREEN_HEIGHT // 2 + 40, 140, 45)  # New Guest button
     clock = pygame.time.Clock()
 
-    button_font = pygame.font.SysFont("arial", 28, bold=True)
+    button_font = get_sys_font("arial", 28, bold=True)
 
     while True:
         screen.fill((30, 30, 30))
@@ -76,8 +77,8 @@ def get_user_login(screen, font, background, bg_x, bg_y):
     import pygame
     from db import get_user, get_top_scores
 
-    field_font = pygame.font.SysFont("arial", 28, bold=True)
-    title_font = pygame.font.SysFont("arial", 48, bold=True)
+    field_font = get_sys_font("arial", 28, bold=True)
+    title_font = get_sys_font("arial", 48, bold=True)
 
     username_box = pygame.Rect(300, 280, 220, 40)
     password_box = pygame.Rect(300, 340, 220, 40)
@@ -95,8 +96,8 @@ def get_user_login(screen, font, background, bg_x, bg_y):
 
     show_forgot_password = False
 
-    register_font = pygame.font.SysFont("arial", 24, bold=False)
-    forgot_font = pygame.font.SysFont("arial", 22, bold=True)
+    register_font = get_sys_font("arial", 24, bold=False)
+    forgot_font = get_sys_font("arial", 22, bold=True)
 
     while True:
         screen.blit(background, (bg_x, bg_y))
@@ -220,10 +221,10 @@ def register_user(screen, font, background, bg_x, bg_y):
     gap = 60
     left_x = 300
 
-    field_font = pygame.font.SysFont("arial", 28, bold=True)
-    title_font = pygame.font.SysFont("arial", 48, bold=True)
+    field_font = get_sys_font("arial", 28, bold=True)
+    title_font = get_sys_font("arial", 48, bold=True)
 
-    link_font = pygame.font.SysFont("arial", 24, bold=False)
+    link_font = get_sys_font("arial", 24, bold=False)
     back_to_login_text = link_font.render("Back to Login", True, (0, 0, 255))
     back_to_login_rect = back_to_login_text.get_rect()
     back_to_login_rect.topleft = (250, 550)
@@ -402,9 +403,9 @@ def handle_forgot_password(screen, font, background, bg_x, bg_y):
     SCREEN_WIDTH = 1500
     SCREEN_HEIGHT = 800
 
-    field_font = pygame.font.SysFont("arial", 28, bold=True)
-    title_font = pygame.font.SysFont("arial", 48, bold=True)
-    link_font = pygame.font.SysFont("arial", 24, bold=False)
+    field_font = get_sys_font("arial", 28, bold=True)
+    title_font = get_sys_font("arial", 48, bold=True)
+    link_font = get_sys_font("arial", 24, bold=False)
 
     username = ""
     answer = ""
@@ -0,0 +1,188 @@
+import os
+# no window is ever opened; the dummy driver keeps SDL happy on servers without a display
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+
+import sys
+import glob
+import time
+import random
+import argparse
+import numpy as np
+import pygame
+import car
+from car import Car, RADAR_BACKENDS, footprint_on_track
+from carbatch import CarBatch
+from mapbundle import load_map_bundle
+from assets import load_scaled
+from trackfield import TILE_MIXED, get_track_grid, get_distance_field, get_occupancy_pyramid
+
+DEFAULT_SAMPLES = 2000
+DEFAULT_POPULATION = 50
+
+
+def sample_poses(collision_mask, count, rng):
+    # random on-track centers with random headings, the same for every backend
+    xs, ys = np.nonzero(get_track_grid(collision_mask))
+    picks = [rng.randrange(len(xs)) for _ in range(count)]
+    return [(int(xs[i]), int(ys[i]), rng.uniform(0, 360)) for i in picks]
+
+
+def time_car(collision_mask, surface, poses):
+    # seconds per Car.update and the radars it produced, one car placed at every pose in turn
+    test_car = Car([0.0, 0.0], surface)
+    half_w, half_h = surface.get_width() / 2, surface.get_height() / 2
+    # the first update builds the backend's arrays for this map; keep that out of the timing
+    test_car.update(None, collision_mask)
+    radars = []
+    elapsed = 0.0
+    for x, y, angle in poses:
+        test_car.pos = [x - half_w, y - half_h]
+        test_car.angle = angle
+        start = time.perf_counter()
+        test_car.update(None, collision_mask)
+        elapsed += time.perf_counter() - start
+        # Car reuses its radar entries every update, so keep a copy of this one's
+        radars.append([(tuple(point), distance) for point, distance in test_car.radars])
+    return elapsed / len(poses), radars
+
+
+class FlatMask:
+    # rays walked one pixel at a time with get_at, as check_radar originally did
+    def __init__(self, collision_mask):
+        self.mask = collision_mask
+        self.width, self.height = collision_mask.get_size()
+
+    def march(self, cx, cy, cos, sin, max_length):
+        ray_length = 0
+        x = int(cx + cos * ray_length)
+        y = int(cy + sin * ray_length)
+        while ray_length < max_length:
+            if x < 0 or x >= self.width or y < 0 or y >= self.height or self.mask.get_at((x, y)) == 0:
+                break
+            ray_length += 1
+            x = int(cx + cos * ray_length)
+            y = int(cy + sin * ray_length)
+        return x, y
+
+
+def time_rays(tracer, poses):
+    # seconds to cast the seven radar rays of a car, and where they ended
+    ends = []
+    start = time.perf_counter()
+    for x, y, angle in poses:
+        heading = car.heading_index(angle)
+        for degree in car.RADAR_DEGREES:
+            direction = (heading + degree * car.TRIG_STEPS_PER_DEGREE) % car.TRIG_TABLE_SIZE
+            ends.append(tracer.march(x, y, car.COS_TABLE[direction], car.SIN_TABLE[direction], car.RADAR_MAX_LENGTH))
+    return (time.perf_counter() - start) / len(poses), ends
+
+
+def time_collisions(collision_mask, surface, poses):
+    # seconds per car to test for a crash: the four corners on the flat mask and on the occupancy
+    # pyramid, and one footprint overlap; returns the two corner results too, which must agree
+    corners = []
+    for x, y, angle in poses:
+        for degree in car.CORNER_DEGREES:
+            heading = car.heading_index(angle + degree)
+            corners.append((int(x + car.COS_TABLE[heading] * car.OFFSET_COLLISION),
+                            int(y + car.SIN_TABLE[heading] * car.OFFSET_COLLISION)))
+    width, height = collision_mask.get_size()
+    pyramid = get_occupancy_pyramid(collision_mask)
+    footprint_on_track(collision_mask, surface, 0, poses[0][0], poses[0][1])
+
+    start = time.perf_counter()
+    flat = [0 <= x < width and 0 <= y < height and collision_mask.get_at((x, y)) == 1 for x, y in corners]
+    flat_time = time.perf_counter() - start
+    start = time.perf_counter()
+    tiled = [pyramid.on_track(x, y) for x, y in corners]
+    pyramid_time = time.perf_counter() - start
+    start = time.perf_counter()
+    footprints = [footprint_on_track(collision_mask, surface, angle, x, y) for x, y, angle in poses]
+    footprint_time = time.perf_counter() - start
+
+    corner_alive = [all(flat[i:i + len(car.CORNER_DEGREES)]) for i in range(0, len(flat), len(car.CORNER_DEGREES))]
+    crashes = (corner_alive.count(False), footprints.count(False))
+    return [elapsed / len(poses) for elapsed in (flat_time, pyramid_time, footprint_time)], flat == tiled, crashes
+
+
+def time_batch(collision_mask, surface, poses, population):
+    # seconds per CarBatch.update of a whole population, and the radars of every step
+    batch = CarBatch(population, [0.0, 0.0], surface)
+    radars = []
+    elapsed = 0.0
+    steps = 0
+    for first in range(0, len(poses) - population + 1, population):
+        chunk = np.array(poses[first:first + population])
+        batch.pos[:] = chunk[:, :2] - batch.half_size
+        batch.angle[:] = chunk[:, 2]
+        start = time.perf_counter()
+        batch.update(collision_mask)
+        elapsed += time.perf_counter() - start
+        steps += 1
+        radars.append(batch.radar_points.copy())
+    return elapsed / max(steps, 1), radars
+
+
+def benchmark_map(map_path, backends, samples, population, seed):
+    collision_mask = load_map_bundle(map_path).collision_mask
+    surface = load_scaled(os.path.join("cars", "car4.png"), (75, 75))
+    poses = sample_poses(collision_mask, samples, random.Random(seed))
+    results = {}
+    for backend in backends:
+        car.set_radar_backend(backend)
+        results[backend] = time_car(collision_mask, surface, poses) + time_batch(collision_mask, surface, poses, population)
+    car.set_radar_backend(backends[0])
+
+    reference = results[backends[0]]
+    print(f"{map_path} ({collision_mask.get_size()[0]}x{collision_mask.get_size()[1]}, {samples} poses)")
+    (flat_time, pyramid_time, footprint_time), same, crashes = time_collisions(collision_mask, surface, poses)
+    pyramid = get_occupancy_pyramid(collision_mask)
+    tiles = pyramid.levels[-1]
+    print(f"  collision per car: corners on flat mask {flat_time * 1e9:6.0f} ns   "
+          f"on pyramid {pyramid_time * 1e9:6.0f} ns{'' if same else ' (DIFFER)'}   "
+          f"footprint overlap {footprint_time * 1e9:6.0f} ns   "
+          f"crashes found: {crashes[0]} by corners, {crashes[1]} by footprint")
+    print(f"  pyramid: {(tiles != TILE_MIXED).mean():.0%} of {1 << pyramid.top}px tiles uniform")
+    flat_rays, flat_ends = time_rays(FlatMask(collision_mask), poses)
+    line = f"  7 radar rays: flat mask {flat_rays * 1e6:6.1f} us"
+    for name, tracer in (("field", get_distance_field(collision_mask)), ("pyramid", pyramid)):
+        ray_time, ends = time_rays(tracer, poses)
+        line += f"   {name} {ray_time * 1e6:6.1f} us" + ("" if ends == flat_ends else " (DIFFER)")
+    print(line)
+    for backend, (car_time, car_radars, batch_time, batch_radars) in results.items():
+        same = car_radars == reference[1] and all(
+            np.array_equal(a, b) for a, b in zip(batch_radars, reference[3]))
+        print(f"  {backend:<8} Car.update {car_time * 1e6:8.1f} us   "
+              f"CarBatch.update x{population} {batch_time * 1e3:7.2f} ms   "
+              f"{'same radars' if same else 'RADARS DIFFER'}")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time the radar and collision backends against each other on each map")
+    parser.add_argument('--maps', nargs='+', default=None, help="Map images (default: every map in maps/)")
+    parser.add_argument('--backends', nargs='+', default=list(RADAR_BACKENDS), help="Radar backends to compare")
+    parser.add_argument('--samples', type=int, default=DEFAULT_SAMPLES, help="Car poses timed per map")
+    parser.add_argument('--population', type=int, default=DEFAULT_POPULATION, help="Cars per CarBatch update")
+    parser.add_argument('--seed', type=int, default=0, help="Seed for the sampled poses")
+    args = parser.parse_args()
+
+    for backend in args.backends:
+        if backend not in RADAR_BACKENDS:
+            print(f"Error: unknown radar backend '{backend}' (choose from {', '.join(RADAR_BACKENDS)})")
+            sys.exit(1)
+    if args.samples < 1 or args.population < 1:
+        print("Error: --samples and --population must be positive")
+        sys.exit(1)
+
+    pygame.init()
+    maps = args.maps or sorted(glob.glob(os.path.join("maps", "*.png")))
+    for map_path in maps:
+        if not os.path.exists(map_path):
+            print(f"Error: {map_path} not found")
+            sys.exit(1)
+        benchmark_map(map_path, args.backends, args.samples, args.population, args.seed)
+
+
+if __name__ == "__main__":
+    main()
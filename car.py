@@ -1,15 +1,152 @@
 import pygame
 import math
 import os
+from functools import lru_cache
 from typing import List, Tuple
+import numpy as np
+from trackfield import get_distance_field, get_packed_track, get_occupancy_pyramid, get_offtrack_mask
+from sprites import rotation_atlas, car_footprints
+from assets import load_scaled
 
 SCREEN_WIDTH = 1500
 SCREEN_HEIGHT = 800
 
 RADAR_MAX_LENGTH = 300
 OFFSET_COLLISION = 30
+RADAR_DEGREES = range(-90, 91, 30)
+CORNER_DEGREES = (30, 150, 210, 330)
+
+# how rays are cast: "field" sphere-traces the distance field, "bits" walks every pixel
+# step over the bit-packed track, "pyramid" skips whole on-track tiles of the occupancy
+# pyramid (and tests the collision corners through it too).
+# all give the same radars and collisions; pick one with RADAR_BACKEND=bits
+RADAR_BACKENDS = ("field", "bits", "pyramid")
+radar_backend = "field"
+
+# how crashes are found: "corners" tests the four points at OFFSET_COLLISION, "footprint"
+# overlaps the car's rotated sprite mask with the off-track area (every pixel of the car
+# counts, so it catches a wall between the corners, at about the same cost per tick).
+# pick one with COLLISION_CHECK=footprint
+COLLISION_CHECKS = ("corners", "footprint")
+collision_check = "corners"
+
+# headings are looked up in sine/cosine tables instead of calling math every tick.
+# entry i holds the direction of a car at angle i / TRIG_STEPS_PER_DEGREE, in screen terms
+# (cos/sin of 360 - angle, as the physics has always used)
+TRIG_STEPS_PER_DEGREE = 10
+TRIG_TABLE_SIZE = 360 * TRIG_STEPS_PER_DEGREE
+COS_TABLE = [math.cos(math.radians(360 - i / TRIG_STEPS_PER_DEGREE)) for i in range(TRIG_TABLE_SIZE)]
+SIN_TABLE = [math.sin(math.radians(360 - i / TRIG_STEPS_PER_DEGREE)) for i in range(TRIG_TABLE_SIZE)]
+_CORNER_STEPS = [degree * TRIG_STEPS_PER_DEGREE for degree in CORNER_DEGREES]
+_RADAR_STEPS = [degree * TRIG_STEPS_PER_DEGREE for degree in RADAR_DEGREES]
+
+# pixel step k of every ray, as floats so offsets are computed exactly like cos * k
+_RAY_STEPS = np.arange(RADAR_MAX_LENGTH + 1, dtype=np.float64)
+
+
+def heading_index(angle: float) -> int:
+    # the trig table entry of an angle in degrees
+    return round(angle * TRIG_STEPS_PER_DEGREE) % TRIG_TABLE_SIZE
+
+
+def set_radar_backend(name: str) -> None:
+    global radar_backend
+    if name not in RADAR_BACKENDS:
+        raise ValueError(f"unknown radar backend {name!r}, expected one of {', '.join(RADAR_BACKENDS)}")
+    radar_backend = name
+
+
+def get_radar_backend() -> str:
+    return radar_backend
+
+
+def set_collision_check(name: str) -> None:
+    global collision_check
+    if name not in COLLISION_CHECKS:
+        raise ValueError(f"unknown collision check {name!r}, expected one of {', '.join(COLLISION_CHECKS)}")
+    collision_check = name
+
+
+def get_collision_check() -> str:
+    return collision_check
+
+
+def footprint_on_track(collision_mask, surface, angle, cx, cy) -> bool:
+    # True while every pixel of the sprite, turned to angle and centered on (cx, cy), is on the track
+    footprint, dx, dy, width, height, _ = car_footprints.get(surface, angle)
+    left, top = cx + dx, cy + dy
+    if left < 0 or top < 0:
+        return False
+    offtrack = get_offtrack_mask(collision_mask)
+    mask_width, mask_height = offtrack.get_size()
+    if left + width > mask_width or top + height > mask_height:
+        return False
+    return offtrack.overlap(footprint, (left, top)) is None
+
+
+def corners_on_track(collision_mask, heading, cx, cy) -> bool:
+    # the four-point check for a car centered on (cx, cy) at a heading index
+    mask_width, mask_height = collision_mask.get_size()
+    for step in _CORNER_STEPS:
+        direction = (heading + step) % TRIG_TABLE_SIZE
+        x = int(cx + COS_TABLE[direction] * OFFSET_COLLISION)
+        y = int(cy + SIN_TABLE[direction] * OFFSET_COLLISION)
+        if x < 0 or x >= mask_width or y < 0 or y >= mask_height or collision_mask.get_at((x, y)) == 0:
+            return False
+    return True
+
+
+def first_contact(collision_mask, surface, angle, start_x, start_y, end_x, end_y):
+    # swept collision: slide the car (by its top-left position) from start to end at most one pixel
+    # per step and return the first position in between where it is off the track, or None.
+    # neither end is tested; update() checks where the car lands, and it started where it last landed.
+    # steps whose center is further inside the track than the car reaches are skipped using the
+    # distance field, so a car in the middle of a wide road costs next to nothing
+    steps = math.ceil(max(abs(end_x - start_x), abs(end_y - start_y)))
+    if steps < 2:
+        return None
+    if collision_check == "footprint":
+        reach = car_footprints.get(surface, angle)[5]
+    else:
+        reach = OFFSET_COLLISION
+        heading = heading_index(angle)
+    field = get_distance_field(collision_mask)
+    half_width, half_height = surface.get_width() / 2, surface.get_height() / 2
+    step_x, step_y = (end_x - start_x) / steps, (end_y - start_y) / steps
+    k = 1
+    while k < steps:
+        x, y = start_x + step_x * k, start_y + step_y * k
+        cx, cy = int(x + half_width), int(y + half_height)
+        # every pixel closer than the field value is on track, and the center moves a pixel per step at most
+        clearance = field.at(cx, cy) - 1 - reach
+        if clearance >= 0:
+            k += clearance + 1
+            continue
+        if collision_check == "footprint":
+            on_track = footprint_on_track(collision_mask, surface, angle, cx, cy)
+        else:
+            on_track = corners_on_track(collision_mask, heading, cx, cy)
+        if not on_track:
+            return x, y
+        k += 1
+    return None
+
+
+@lru_cache(maxsize=256)
+def ray_step_table(heading: int) -> Tuple[np.ndarray, np.ndarray]:
+    # x/y offset of every pixel step of the radar rays of a car at a heading index, one row per ray.
+    # a car driving straight keeps its heading, so the table is reused tick after tick
+    directions = [(heading + step) % TRIG_TABLE_SIZE for step in _RADAR_STEPS]
+    step_x = np.outer([COS_TABLE[d] for d in directions], _RAY_STEPS)
+    step_y = np.outer([SIN_TABLE[d] for d in directions], _RAY_STEPS)
+    return step_x, step_y
+
 
 class Car:
+    # per-tick state lives in fixed slots and preallocated lists that update() rewrites in place
+    __slots__ = ("pos", "surface", "rotate_surface", "angle", "speed", "center", "four_points",
+                 "radars", "_radar_buffer", "is_alive", "distance", "time_spent")
+
     def __init__(self, initial_pos: List[float] = None, surface: pygame.Surface = None) -> None:
         # set starting position
         if initial_pos is None:
@@ -20,8 +157,7 @@ class Car:
         if surface:
             self.surface = surface
         else:
-            self.surface = pygame.image.load(os.path.join("cars", "car4.png"))
-            self.surface = pygame.transform.scale(self.surface, (75, 75))
+            self.surface = load_scaled(os.path.join("cars", "car4.png"), (75, 75))
 
         self.rotate_surface = self.surface
         self.angle = 0.0
@@ -32,30 +168,52 @@ class Car:
             int(self.pos[0] + self.surface.get_width() / 2),
             int(self.pos[1] + self.surface.get_height() / 2)
         ]
+        self.four_points = [[0.0, 0.0] for _ in CORNER_DEGREES]
 
+        # radars stay empty until the first update, then always show the buffer's ((x, y), distance) entries.
+        # the buffer is overwritten in place by every update, so copy the entries to keep them past the next one
         self.radars = []
+        self._radar_buffer = [[[0, 0], 0] for _ in RADAR_DEGREES]
         self.is_alive = True
         self.distance = 0.0
         self.time_spent = 0
-        self.rotated_cache = {}
 
-    def draw(self, screen, font=None, offset=(0, 0), draw_radars=True):
-        # draw car
-        center_offset = (self.center[0] - offset[0], self.center[1] - offset[1])
-        rotated_rect = self.rotate_surface.get_rect(center=center_offset)
-        screen.blit(self.rotate_surface, rotated_rect.topleft)
+    def draw(self, screen, font=None, offset=(0, 0), draw_radars=True, pose=None):
+        # draw car, at pose (center x, center y, angle) instead of where it is when given,
+        # e.g. between two physics ticks; the radars move along with it
+        if pose is None:
+            center_x, center_y = self.center
+            rotate_surface = self.rotate_surface
+        else:
+            center_x, center_y = round(pose[0]), round(pose[1])
+            rotate_surface = rotation_atlas.get(self.surface, pose[2])
+        center_offset = (center_x - offset[0], center_y - offset[1])
+        rotated_rect = rotate_surface.get_rect(center=center_offset)
+        screen.blit(rotate_surface, rotated_rect.topleft)
 
         # draw radars
         if draw_radars:
+            shift_x = offset[0] + self.center[0] - center_x
+            shift_y = offset[1] + self.center[1] - center_y
             for radar in self.radars:
                 radar_pos, _ = radar
-                radar_pos = (radar_pos[0] - offset[0], radar_pos[1] - offset[1])
+                radar_pos = (radar_pos[0] - shift_x, radar_pos[1] - shift_y)
                 pygame.draw.line(screen, (255, 0, 0), center_offset, radar_pos, 1)
                 pygame.draw.circle(screen, (255, 0, 0), radar_pos, 5)
 
     def check_collision(self, collision_mask):
         # check if car is on track
+        if collision_check == "footprint":
+            self.is_alive = footprint_on_track(collision_mask, self.surface, self.angle, self.center[0], self.center[1])
+            return
         self.is_alive = True
+        if radar_backend == "pyramid":
+            pyramid = get_occupancy_pyramid(collision_mask)
+            for point in self.four_points:
+                if not pyramid.on_track(int(point[0]), int(point[1])):
+                    self.is_alive = False
+                    break
+            return
         mask_width, mask_height = collision_mask.get_size()
 
         for point in self.four_points:
@@ -67,75 +225,78 @@ class Car:
                 self.is_alive = False
                 break
 
-    def check_radar(self, degree, collision_mask):
-        # draw radar lines
-        ray_length = 0
-        mask_width, mask_height = collision_mask.get_size()
+    def check_radar(self, radar, direction, tracer):
+        # cast radar line, jumping ahead by the distance field (or occupancy pyramid) instead of one
+        # pixel at a time; direction is the ray's trig table entry and the result is written into radar
+        cx, cy = self.center
+        x, y = tracer.march(cx, cy, COS_TABLE[direction], SIN_TABLE[direction], RADAR_MAX_LENGTH)
 
-        x = int(self.center[0] + math.cos(math.radians(360 - (self.angle + degree))) * ray_length)
-        y = int(self.center[1] + math.sin(math.radians(360 - (self.angle + degree))) * ray_length)
+        point = radar[0]
+        point[0] = x
+        point[1] = y
+        radar[1] = int(math.sqrt((x - cx) ** 2 + (y - cy) ** 2))
 
-        while ray_length < RADAR_MAX_LENGTH:
-            if x < 0 or x >= mask_width or y < 0 or y >= mask_height:
-                break
-            if collision_mask.get_at((x, y)) == 0:
-                break
-            ray_length += 1
-            x = int(self.center[0] + math.cos(math.radians(360 - (self.angle + degree))) * ray_length)
-            y = int(self.center[1] + math.sin(math.radians(360 - (self.angle + degree))) * ray_length)
-
-        distance = int(math.sqrt((x - self.center[0]) ** 2 + (y - self.center[1]) ** 2))
-        self.radars.append(((x, y), distance))
-
-    def update(self, game_map, collision_mask):
-        # update car rotation
-        angle_key = int(round(self.angle)) % 360
-        if angle_key in self.rotated_cache:
-            self.rotate_surface = self.rotated_cache[angle_key]
-        else:
-            self.rotate_surface = self.rot_center(self.surface, self.angle)
-            self.rotated_cache[angle_key] = self.rotate_surface
+    def check_radars_packed(self, heading, collision_mask):
+        # cast every radar line at once over the bit-packed track, no trig or get_at per pixel
+        step_x, step_y = ray_step_table(heading)
+        cx, cy = self.center
+        xs, ys = get_packed_track(collision_mask).march(cx, cy, step_x, step_y)
+        for radar, x, y in zip(self._radar_buffer, xs.tolist(), ys.tolist()):
+            point = radar[0]
+            point[0] = x
+            point[1] = y
+            radar[1] = int(math.sqrt((x - cx) ** 2 + (y - cy) ** 2))
 
-        # move car
-        self.pos[0] += math.cos(math.radians(360 - self.angle)) * self.speed
-        self.pos[1] += math.sin(math.radians(360 - self.angle)) * self.speed
+    def place(self, heading):
+        # center and collision corners for the current position
+        pos, center = self.pos, self.center
+        cx = center[0] = int(pos[0] + self.surface.get_width() / 2)
+        cy = center[1] = int(pos[1] + self.surface.get_height() / 2)
+        for point, step in zip(self.four_points, _CORNER_STEPS):
+            direction = (heading + step) % TRIG_TABLE_SIZE
+            point[0] = cx + COS_TABLE[direction] * OFFSET_COLLISION
+            point[1] = cy + SIN_TABLE[direction] * OFFSET_COLLISION
 
-        self.distance += self.speed
-        self.time_spent += 1
+    def update(self, game_map, collision_mask, dt=1):
+        # advance the car by dt ticks (speed is in pixels per tick)
+        heading = heading_index(self.angle)
 
-        # update center
-        self.center = [
-            int(self.pos[0] + self.surface.get_width() / 2),
-            int(self.pos[1] + self.surface.get_height() / 2)
-        ]
+        # update car rotation (rotated sprites are shared by every car)
+        self.rotate_surface = rotation_atlas.get(self.surface, self.angle)
 
-        # get 4 corner points for collision
-        offset = OFFSET_COLLISION
-        left_top = [
-            self.center[0] + math.cos(math.radians(360 - (self.angle + 30))) * offset,
-            self.center[1] + math.sin(math.radians(360 - (self.angle + 30))) * offset
-        ]
-        right_top = [
-            self.center[0] + math.cos(math.radians(360 - (self.angle + 150))) * offset,
-            self.center[1] + math.sin(math.radians(360 - (self.angle + 150))) * offset
-        ]
-        left_bottom = [
-            self.center[0] + math.cos(math.radians(360 - (self.angle + 210))) * offset,
-            self.center[1] + math.sin(math.radians(360 - (self.angle + 210))) * offset
-        ]
-        right_bottom = [
-            self.center[0] + math.cos(math.radians(360 - (self.angle + 330))) * offset,
-            self.center[1] + math.sin(math.radians(360 - (self.angle + 330))) * offset
-        ]
-        self.four_points = [left_top, right_top, left_bottom, right_bottom]
+        # move car
+        pos = self.pos
+        start_x, start_y = pos
+        step = self.speed * dt
+        pos[0] += COS_TABLE[heading] * step
+        pos[1] += SIN_TABLE[heading] * step
 
-        # check if car hits anything
+        self.distance += step
+        self.time_spent += dt
+
+        # update center and get 4 corner points for collision
+        self.place(heading)
+
+        # check if car hits anything, where it landed and on the way there
         self.check_collision(collision_mask)
+        if self.is_alive:
+            contact = first_contact(collision_mask, self.surface, self.angle, start_x, start_y, pos[0], pos[1])
+            if contact is not None:
+                self.is_alive = False
+                pos[0], pos[1] = contact
+                self.place(heading)
 
         # check all radar sensors
-        self.radars.clear()
-        for degree in range(-90, 91, 30):
-            self.check_radar(degree, collision_mask)
+        if radar_backend == "bits":
+            self.check_radars_packed(heading, collision_mask)
+        else:
+            if radar_backend == "pyramid":
+                tracer = get_occupancy_pyramid(collision_mask)
+            else:
+                tracer = get_distance_field(collision_mask)
+            for radar, step in zip(self._radar_buffer, _RADAR_STEPS):
+                self.check_radar(radar, (heading + step) % TRIG_TABLE_SIZE, tracer)
+        self.radars = self._radar_buffer
 
     def get_data(self):
         # return radar values
@@ -158,7 +319,16 @@ class Car:
 
         return base_reward + 0.5 * time_reward + 1.0 * safety_reward
 
-    def rot_center(self, image, angle):
-        # rotate image with center
-        rotated_image = pygame.transform.rotate(image, angle)
-        return rotated_image
+
+# a bad value in the environment keeps the default rather than stopping whatever imports car
+if os.environ.get("RADAR_BACKEND"):
+    try:
+        set_radar_backend(os.environ["RADAR_BACKEND"])
+    except ValueError as e:
+        print(f"Warning: RADAR_BACKEND: {e}; using {radar_backend}")
+
+if os.environ.get("COLLISION_CHECK"):
+    try:
+        set_collision_check(os.environ["COLLISION_CHECK"])
+    except ValueError as e:
+        print(f"Warning: COLLISION_CHECK: {e}; using {collision_check}")
@@ -0,0 +1,345 @@
+import os
+import numpy as np
+import pygame
+from car import (Car, RADAR_MAX_LENGTH, OFFSET_COLLISION, TRIG_STEPS_PER_DEGREE, TRIG_TABLE_SIZE,
+                 COS_TABLE, SIN_TABLE, get_radar_backend, get_collision_check, footprint_on_track)
+from trackfield import get_track_grid, get_distance_field, get_packed_track, get_occupancy_pyramid
+from sprites import rotation_atlas, car_footprints
+from assets import load_scaled
+
+# same sensor and corner layout as Car.update
+RADAR_DEGREES = np.arange(-90, 91, 30)
+CORNER_DEGREES = np.array([30, 150, 210, 330])
+
+# Car's sine/cosine tables, so both compute headings the same way
+COS = np.array(COS_TABLE)
+SIN = np.array(SIN_TABLE)
+
+
+class CarBatch:
+    # structure-of-arrays version of Car: one row per car, every row stepped in one numpy pass
+    def __init__(self, count: int, initial_pos, surface: pygame.Surface = None) -> None:
+        # load car image once for the whole batch
+        if surface:
+            self.surface = surface
+        else:
+            self.surface = load_scaled(os.path.join("cars", "car4.png"), (75, 75))
+        self.half_size = np.array([self.surface.get_width() / 2, self.surface.get_height() / 2])
+
+        self.count = count
+        self.pos = np.tile(np.asarray(initial_pos, dtype=np.float64), (count, 1))
+        self.angle = np.zeros(count)
+        self.speed = np.zeros(count)
+        self.angular_velocity = np.zeros(count)
+        self.distance = np.zeros(count)
+        self.time_spent = np.zeros(count)
+        self.alive = np.ones(count, dtype=bool)
+        self.center = np.trunc(self.pos + self.half_size).astype(np.int64)
+        self.four_points = np.zeros((count, len(CORNER_DEGREES), 2))
+        # footprint reach of the sprite at every whole degree, built on first footprint check
+        self._reaches = None
+
+        # radars stay empty until the first update, like Car.radars
+        self.has_radars = False
+        self.radar_points = np.zeros((count, len(RADAR_DEGREES), 2), dtype=np.int64)
+        self.radar_lengths = np.zeros((count, len(RADAR_DEGREES)), dtype=np.int64)
+
+        self.cars = [BatchCar(self, i) for i in range(count)]
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        return iter(self.cars)
+
+    def __getitem__(self, index):
+        return self.cars[index]
+
+    def update(self, collision_mask, rows=None, dt=1):
+        # step the selected rows (all of them by default) by dt ticks: move, collide, sense
+        if rows is None:
+            rows = np.arange(self.count)
+        elif rows.dtype == bool:
+            rows = np.flatnonzero(rows)
+        if rows.size == 0:
+            return
+        backend = get_radar_backend()
+
+        # move car
+        heading = np.rint(self.angle[rows] * TRIG_STEPS_PER_DEGREE).astype(np.int64) % TRIG_TABLE_SIZE
+        start = self.pos[rows]
+        step = self.speed[rows] * dt
+        self.pos[rows, 0] += COS[heading] * step
+        self.pos[rows, 1] += SIN[heading] * step
+        self.distance[rows] += step
+        self.time_spent[rows] += dt
+
+        # update center and get 4 corner points for collision
+        center, points = self._place(rows, heading)
+
+        # check if cars hit anything, where they landed and on the way there
+        pixels = np.trunc(points).astype(np.int64)
+        field = get_distance_field(collision_mask)
+        if backend == "pyramid":
+            pyramid = get_occupancy_pyramid(collision_mask)
+        footprint = get_collision_check() == "footprint"
+        reach = self._reach(rows) if footprint else np.full(rows.size, OFFSET_COLLISION)
+        if footprint:
+            # a center further inside the track than the sprite reaches needs no overlap test
+            alive = field.at_many(center[:, 0], center[:, 1]) > reach
+            for i in np.flatnonzero(~alive).tolist():
+                alive[i] = footprint_on_track(collision_mask, self.surface, float(self.angle[rows[i]]),
+                                              int(center[i, 0]), int(center[i, 1]))
+            self.alive[rows] = alive
+        elif backend == "pyramid":
+            self.alive[rows] = pyramid.on_track_many(pixels[..., 0], pixels[..., 1]).all(axis=1)
+        else:
+            self.alive[rows] = self._on_track(get_track_grid(collision_mask), pixels).all(axis=1)
+        # a move no longer than the clearance at either end can't touch a wall (first_contact
+        # skips such steps too), so only the rows passing close to one are swept
+        start_center = np.trunc(start + self.half_size).astype(np.int64)
+        steps = np.ceil(np.abs(self.pos[rows] - start).max(axis=1)).astype(np.int64)
+        clearance = np.maximum(field.at_many(start_center[:, 0], start_center[:, 1]),
+                               field.at_many(center[:, 0], center[:, 1])) - 1 - reach
+        near_wall = np.flatnonzero(self.alive[rows] & (steps >= 2) & (clearance < steps))
+        crashed = []
+        if near_wall.size:
+            hit, contacts = self._first_contacts(collision_mask, field, rows[near_wall], start[near_wall],
+                                                 steps[near_wall], heading[near_wall], reach[near_wall], footprint)
+            crashed = near_wall[hit]
+            self.pos[rows[crashed]] = contacts
+        if len(crashed):
+            self.alive[rows[crashed]] = False
+            self._place(rows[crashed], heading[crashed])
+            center = self.center[rows]
+
+        # check all radar sensors
+        if backend == "bits":
+            self._check_radars_packed(get_packed_track(collision_mask), rows, center, heading)
+        elif backend == "pyramid":
+            direction = self._ray_directions(heading)
+            hit_x, hit_y = pyramid.march_many(np.repeat(center[:, 0], len(RADAR_DEGREES)).astype(np.float64),
+                                              np.repeat(center[:, 1], len(RADAR_DEGREES)).astype(np.float64),
+                                              COS[direction], SIN[direction], RADAR_MAX_LENGTH)
+            self._store_radars(rows, center, hit_x, hit_y)
+        else:
+            self._check_radars(field.field, rows, center, heading)
+        self.has_radars = True
+
+    def _place(self, rows, heading):
+        # center and collision corners of the selected rows for their current positions
+        center = np.trunc(self.pos[rows] + self.half_size).astype(np.int64)
+        self.center[rows] = center
+        corner = (heading[:, None] + CORNER_DEGREES * TRIG_STEPS_PER_DEGREE) % TRIG_TABLE_SIZE
+        points = np.empty((rows.size, len(CORNER_DEGREES), 2))
+        points[:, :, 0] = center[:, 0, None] + COS[corner] * OFFSET_COLLISION
+        points[:, :, 1] = center[:, 1, None] + SIN[corner] * OFFSET_COLLISION
+        self.four_points[rows] = points
+        return center, points
+
+    def _first_contacts(self, collision_mask, field, rows, start, steps, heading, reach, footprint):
+        # first_contact for the selected rows at once: every in-between pose of every row is placed
+        # and checked against the distance field together, and only poses close enough to a wall
+        # get the real check. returns which of the rows hit something and where, as first_contact would
+        end = self.pos[rows]
+        k = np.arange(1, steps.max())
+        step = (end - start) / steps[:, None]
+        x = start[:, 0, None] + step[:, 0, None] * k
+        y = start[:, 1, None] + step[:, 1, None] * k
+        cx = np.trunc(x + self.half_size[0]).astype(np.int64)
+        cy = np.trunc(y + self.half_size[1]).astype(np.int64)
+        close = (k < steps[:, None]) & (field.at_many(cx, cy) - 1 - reach[:, None] < 0)
+
+        if footprint:
+            off = np.zeros(close.shape, dtype=bool)
+            for i in np.flatnonzero(close.any(axis=1)).tolist():
+                angle = float(self.angle[rows[i]])
+                for j in np.flatnonzero(close[i]).tolist():
+                    if not footprint_on_track(collision_mask, self.surface, angle, int(cx[i, j]), int(cy[i, j])):
+                        off[i, j] = True
+                        break
+        else:
+            # the four corners of every pose, placed like corners_on_track does
+            corner = (heading[:, None, None] + CORNER_DEGREES * TRIG_STEPS_PER_DEGREE) % TRIG_TABLE_SIZE
+            pixels = np.empty(close.shape + (len(CORNER_DEGREES), 2), dtype=np.int64)
+            pixels[..., 0] = np.trunc(cx[..., None] + COS[corner] * OFFSET_COLLISION)
+            pixels[..., 1] = np.trunc(cy[..., None] + SIN[corner] * OFFSET_COLLISION)
+            off = close & ~self._on_track(get_track_grid(collision_mask), pixels).all(axis=2)
+
+        hit = off.any(axis=1)
+        first = off[hit].argmax(axis=1)
+        return np.flatnonzero(hit), np.column_stack((x[hit, first], y[hit, first]))
+
+    def _reach(self, rows):
+        # footprint reach of the selected rows at their angles, rounded like FootprintAtlas.get
+        if self._reaches is None:
+            self._reaches = np.array(car_footprints.reaches(self.surface))
+        return self._reaches[np.rint(self.angle[rows]).astype(np.int64) % 360]
+
+    @staticmethod
+    def _on_track(grid, pixels):
+        # pixels is (..., 2) integer x/y; anything off the map counts as off track
+        width, height = grid.shape
+        x, y = pixels[..., 0], pixels[..., 1]
+        inside = (x >= 0) & (x < width) & (y >= 0) & (y < height)
+        result = np.zeros(inside.shape, dtype=bool)
+        result[inside] = grid[x[inside], y[inside]]
+        return result
+
+    @staticmethod
+    def _ray_directions(heading):
+        # trig table entry of every ray of every selected car, flattened car by car
+        return ((heading[:, None] + RADAR_DEGREES * TRIG_STEPS_PER_DEGREE) % TRIG_TABLE_SIZE).ravel()
+
+    def _check_radars(self, field, rows, center, heading):
+        # sphere-trace every ray of every selected car against the distance field, dropping rays as they hit
+        direction = self._ray_directions(heading)
+        cos, sin = COS[direction], SIN[direction]
+        cx = np.repeat(center[:, 0], len(RADAR_DEGREES)).astype(np.float64)
+        cy = np.repeat(center[:, 1], len(RADAR_DEGREES)).astype(np.float64)
+        width, height = field.shape
+
+        hit_x = np.empty(direction.size, dtype=np.int64)
+        hit_y = np.empty(direction.size, dtype=np.int64)
+        ray_length = np.zeros(direction.size, dtype=np.int64)
+        active = np.arange(direction.size)
+        while active.size:
+            length = ray_length[active]
+            x = np.trunc(cx[active] + cos[active] * length).astype(np.int64)
+            y = np.trunc(cy[active] + sin[active] * length).astype(np.int64)
+            # rays at full length stop without another check
+            stopped = length >= RADAR_MAX_LENGTH
+            inside = (x >= 0) & (x < width) & (y >= 0) & (y < height) & ~stopped
+            distance = np.zeros(active.size, dtype=np.int64)
+            distance[inside] = field[x[inside], y[inside]]
+            stopped |= distance == 0
+            hit_x[active[stopped]] = x[stopped]
+            hit_y[active[stopped]] = y[stopped]
+
+            moving = ~stopped
+            active = active[moving]
+            ray_length[active] = np.minimum(length[moving] + np.maximum(distance[moving] - 1, 1), RADAR_MAX_LENGTH)
+
+        self._store_radars(rows, center, hit_x, hit_y)
+
+    def _check_radars_packed(self, packed, rows, center, heading):
+        # walk every ray of every selected car pixel by pixel over the bit-packed track
+        direction = self._ray_directions(heading)
+        steps = np.arange(RADAR_MAX_LENGTH + 1, dtype=np.float64)
+        cx = np.repeat(center[:, 0], len(RADAR_DEGREES)).astype(np.float64)
+        cy = np.repeat(center[:, 1], len(RADAR_DEGREES)).astype(np.float64)
+        hit_x, hit_y = packed.march(cx[:, None], cy[:, None], COS[direction, None] * steps,
+                                    SIN[direction, None] * steps)
+        self._store_radars(rows, center, hit_x, hit_y)
+
+    def _store_radars(self, rows, center, hit_x, hit_y):
+        shape = (rows.size, len(RADAR_DEGREES))
+        hit_x, hit_y = hit_x.reshape(shape), hit_y.reshape(shape)
+        self.radar_points[rows, :, 0] = hit_x
+        self.radar_points[rows, :, 1] = hit_y
+        self.radar_lengths[rows] = np.sqrt(
+            (hit_x - center[:, 0, None]) ** 2 + (hit_y - center[:, 1, None]) ** 2
+        ).astype(np.int64)
+
+    def get_data(self):
+        # radar values for every car, one row each, with the bias input appended
+        sensors = self.radar_lengths / RADAR_MAX_LENGTH
+        return np.hstack((sensors, np.ones((self.count, 1))))
+
+    def get_rewards(self):
+        # same formula as Car.get_reward, for every car at once
+        base_reward = self.distance / 50.0
+        time_reward = self.time_spent / 100.0
+        if self.has_radars:
+            min_distance = self.radar_lengths.min(axis=1)
+        else:
+            min_distance = np.zeros(self.count, dtype=np.int64)
+        safety_reward = min_distance / RADAR_MAX_LENGTH
+        crashed = base_reward + time_reward + safety_reward - 50.0
+        driving = base_reward + 0.5 * time_reward + 1.0 * safety_reward
+        return np.where(self.alive, driving, crashed)
+
+    def poses(self):
+        # timestep.car_pose of every car at once: unrounded center x, center y and angle per row
+        return np.column_stack((self.pos + self.half_size, self.angle))
+
+    def rotated_surface(self, angle):
+        return rotation_atlas.get(self.surface, angle)
+
+
+class BatchCar:
+    # a Car-shaped view over one row of a CarBatch
+    def __init__(self, batch: CarBatch, index: int) -> None:
+        self.batch = batch
+        self.index = index
+
+    @property
+    def surface(self):
+        return self.batch.surface
+
+    @property
+    def rotate_surface(self):
+        return self.batch.rotated_surface(self.batch.angle[self.index])
+
+    @property
+    def pos(self):
+        return self.batch.pos[self.index]
+
+    @property
+    def center(self):
+        cx, cy = self.batch.center[self.index]
+        return int(cx), int(cy)
+
+    @property
+    def four_points(self):
+        return self.batch.four_points[self.index].tolist()
+
+    @property
+    def radars(self):
+        if not self.batch.has_radars:
+            return []
+        points = self.batch.radar_points[self.index].tolist()
+        lengths = self.batch.radar_lengths[self.index].tolist()
+        return [(tuple(p), d) for p, d in zip(points, lengths)]
+
+    @property
+    def is_alive(self):
+        return bool(self.batch.alive[self.index])
+
+    @property
+    def distance(self):
+        return float(self.batch.distance[self.index])
+
+    @property
+    def time_spent(self):
+        return float(self.batch.time_spent[self.index])
+
+    @property
+    def angle(self):
+        return float(self.batch.angle[self.index])
+
+    @angle.setter
+    def angle(self, value):
+        self.batch.angle[self.index] = value
+
+    @property
+    def speed(self):
+        return float(self.batch.speed[self.index])
+
+    @speed.setter
+    def speed(self, value):
+        self.batch.speed[self.index] = value
+
+    @property
+    def angular_velocity(self):
+        return float(self.batch.angular_velocity[self.index])
+
+    @angular_velocity.setter
+    def angular_velocity(self, value):
+        self.batch.angular_velocity[self.index] = value
+
+    # drawing and scoring read the properties above, so Car's versions work unchanged
+    draw = Car.draw
+    get_data = Car.get_data
+    get_alive = Car.get_alive
+    get_reward = Car.get_reward
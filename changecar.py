@@ -1,6 +1,6 @@
 import os
-import pygame
 from car import Car
+from assets import load_scaled
 
 # size for each car image
 car_scales = {
@@ -28,9 +28,8 @@ def load_car(car_images, car_index, starting_position, car_scales):
     car_image_path = os.path.join("cars", car_image_name)
 
     new_car = Car(initial_pos=starting_position.copy())
-    car_image = pygame.image.load(car_image_path).convert_alpha()
     scale_size = car_scales.get(car_image_name, (75, 75))
-    new_car.surface = pygame.transform.scale(car_image, scale_size)
+    new_car.surface = load_scaled(car_image_path, scale_size, convert="alpha")
     new_car.rotate_surface = new_car.surface
     new_car.speed = 0
     new_car.angle = 0
@@ -1,170 +1,607 @@
+import os
+import sys
+import time
+import queue
+import atexit
+import itertools
+import string
 import sqlite3
 import hashlib
+import posixpath
+import threading
+from contextlib import contextmanager
+from dbprofile import QueryProfiler, InstrumentedConnection, DEFAULT_SLOW_MS, DEFAULT_SLOW_LOG
 
 DB_PATH = "scores.db"
 
-def init_db():
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
+# bumped whenever init_db learns a new migration
+SCHEMA_VERSION = 5
+
+# several game instances share one scores.db, so writers wait for each other instead of failing
+BUSY_TIMEOUT_MS = 5000
+# page cache per connection, in KiB
+CACHE_SIZE_KB = 8192
+# prepared statements kept per connection
+STATEMENT_CACHE_SIZE = 128
+
+# scores waiting for the background writer; submitting blocks only once this many are pending
+SCORE_QUEUE_SIZE = 256
+# most queued scores written in one transaction
+SCORE_BATCH_SIZE = 64
+
+# rows per transaction of the bulk import helpers
+BULK_CHUNK_SIZE = 20000
+# usernames per lookup query (SQLite caps the number of ? parameters)
+LOOKUP_CHUNK_SIZE = 500
+
+# rows per call of the paged leaderboard and personal stats readers
+LEADERBOARD_PAGE_SIZE = 20
+USER_PAGE_SIZE = 20
+# leaderboard reads remembered per leaderboard version
+MAX_CACHED_LEADERBOARD_READS = 64
+
+_local = threading.local()
+# set by enable_profiling; connections opened while it is set report to it
+_profiler = None
+
+# leaderboard reads by arguments, valid while the (database, leaderboard version) they were read at is current
+_leaderboard_cache = {"version": None, "rows": {}}
+
+
+def get_connection():
+    # one connection per thread, opened on first use and reused after that
+    conn = getattr(_local, "conn", None)
+    if conn is None or _local.path != DB_PATH or _local.profiler is not _profiler:
+        if conn is not None:
+            conn.close()
+        # autocommit; writes group their statements with transaction()
+        conn = sqlite3.connect(DB_PATH, timeout=BUSY_TIMEOUT_MS / 1000,
+                               isolation_level=None, cached_statements=STATEMENT_CACHE_SIZE)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+        conn.execute(f"PRAGMA cache_size=-{CACHE_SIZE_KB}")
+        conn.execute("PRAGMA foreign_keys=ON")
+        if _profiler is not None:
+            conn = InstrumentedConnection(conn, _profiler)
+        _local.conn = conn
+        _local.path = DB_PATH
+        _local.profiler = _profiler
+    return conn
+
+
+def enable_profiling(slow_ms=DEFAULT_SLOW_MS, slow_log=DEFAULT_SLOW_LOG, summary_on_exit=True):
+    # Time every query from here on: per-function latency histograms, queries slower than
+    # slow_ms appended to slow_log (None to skip), and a summary printed at exit.
+    # Also switched on for a whole run by setting DB_PROFILE=1 (DB_SLOW_QUERY_MS, DB_SLOW_QUERY_LOG)
+    global _profiler
+    _profiler = QueryProfiler(slow_ms, slow_log)
+    if summary_on_exit:
+        atexit.register(_profiler.print_summary)
+    return _profiler
+
+
+def close_connection():
+    # close this thread's connection; the next query opens a new one
+    conn = getattr(_local, "conn", None)
+    if conn is not None:
+        conn.close()
+        _local.conn = None
+
+
+@contextmanager
+def transaction():
+    # take the write lock up front so concurrent writers queue on busy_timeout
+    # instead of failing when a read lock can't be upgraded
+    conn = get_connection()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
+
+def canonical_map_path(map_name):
+    # one spelling per map: forward slashes, no "./" or doubled separators
+    return posixpath.normpath(map_name.replace("\\", "/"))
+
 
-    # Create users table
+def _create_score_tables(cursor):
+    # Table of maps; every score table refers to a map by id
     cursor.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            username TEXT UNIQUE NOT NULL,
-            password TEXT,
-            security_question TEXT,
-            security_answer TEXT
+        CREATE TABLE IF NOT EXISTS maps (
+            id INTEGER PRIMARY KEY,
+            path TEXT UNIQUE NOT NULL
         )
     ''')
 
     # Table for personal stats (accumulates all plays)
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS user_map_stats (
-            user_id INTEGER,
-            map_name TEXT,
+            user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+            map_id INTEGER NOT NULL REFERENCES maps(id) ON DELETE CASCADE,
             times_played INTEGER DEFAULT 0,
             total_collisions INTEGER DEFAULT 0,
             total_time REAL DEFAULT 0.0,
-            PRIMARY KEY (user_id, map_name),
-            FOREIGN KEY(user_id) REFERENCES users(id)
-        )
+            PRIMARY KEY (user_id, map_id)
+        ) WITHOUT ROWID
     ''')
 
     # Table for full score history
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS scores (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER,
-            map_name TEXT,
+            user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+            map_id INTEGER NOT NULL REFERENCES maps(id) ON DELETE CASCADE,
             time_taken REAL,
             collisions INTEGER,
-            checkpoints INTEGER,
-            FOREIGN KEY(user_id) REFERENCES users(id)
+            checkpoints INTEGER
         )
     ''')
 
     # Table for best score per user per map (used in complete leaderboard)
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS user_best_map_scores (
-            user_id INTEGER,
-            map_name TEXT,
+            user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+            map_id INTEGER NOT NULL REFERENCES maps(id) ON DELETE CASCADE,
             time_taken REAL,
-            PRIMARY KEY (user_id, map_name),
-            FOREIGN KEY(user_id) REFERENCES users(id)
+            PRIMARY KEY (user_id, map_id)
+        ) WITHOUT ROWID
+    ''')
+
+    # A user's runs fastest first, answered from the index alone
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_scores_user_time
+        ON scores (user_id, time_taken, map_id, collisions, checkpoints)
+    ''')
+    # Per-map lookups, and the cascades when a map is deleted
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_scores_map ON scores (map_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_stats_map ON user_map_stats (map_id)")
+    # Best times on a map, fastest first
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_best_map_time ON user_best_map_scores (map_id, time_taken)")
+
+
+def _migrate_map_names(cursor):
+    # Version 0 kept map_name as whatever path string the game passed in (both slash styles).
+    # Move the old tables aside, give every canonical path a map id and copy the rows over,
+    # merging rows that only differed in spelling.
+    for table in ("scores", "user_map_stats", "user_best_map_scores"):
+        cursor.execute(f"ALTER TABLE {table} RENAME TO legacy_{table}")
+    _create_score_tables(cursor)
+
+    cursor.execute('''
+        INSERT OR IGNORE INTO maps (path)
+        SELECT canonical_map_path(map_name) FROM legacy_scores WHERE map_name IS NOT NULL
+        UNION SELECT canonical_map_path(map_name) FROM legacy_user_map_stats WHERE map_name IS NOT NULL
+        UNION SELECT canonical_map_path(map_name) FROM legacy_user_best_map_scores WHERE map_name IS NOT NULL
+    ''')
+    cursor.execute('''
+        INSERT INTO scores (id, user_id, map_id, time_taken, collisions, checkpoints)
+        SELECT s.id, s.user_id, m.id, s.time_taken, s.collisions, s.checkpoints
+        FROM legacy_scores s
+        JOIN maps m ON m.path = canonical_map_path(s.map_name)
+        WHERE s.user_id IN (SELECT id FROM users)
+    ''')
+    cursor.execute('''
+        INSERT INTO user_map_stats (user_id, map_id, times_played, total_collisions, total_time)
+        SELECT s.user_id, m.id, SUM(s.times_played), SUM(s.total_collisions), SUM(s.total_time)
+        FROM legacy_user_map_stats s
+        JOIN maps m ON m.path = canonical_map_path(s.map_name)
+        WHERE s.user_id IN (SELECT id FROM users)
+        GROUP BY s.user_id, m.id
+    ''')
+    cursor.execute('''
+        INSERT INTO user_best_map_scores (user_id, map_id, time_taken)
+        SELECT b.user_id, m.id, MIN(b.time_taken)
+        FROM legacy_user_best_map_scores b
+        JOIN maps m ON m.path = canonical_map_path(b.map_name)
+        WHERE b.user_id IN (SELECT id FROM users)
+        GROUP BY b.user_id, m.id
+    ''')
+
+    for table in ("scores", "user_map_stats", "user_best_map_scores"):
+        cursor.execute(f"DROP TABLE legacy_{table}")
+
+
+def _migrate_race_stats(cursor):
+    # Older databases carry a user_race_stats table whose user_id refers to users with no ON DELETE
+    # action, so with foreign keys enforced it blocks deleting anyone who raced. Rebuild it to cascade.
+    has_race_stats = cursor.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'user_race_stats'"
+    ).fetchone()
+    if not has_race_stats:
+        return
+    cursor.execute("ALTER TABLE user_race_stats RENAME TO legacy_user_race_stats")
+    cursor.execute('''
+        CREATE TABLE user_race_stats (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
+            username TEXT NOT NULL,
+            map_name TEXT NOT NULL,
+            times_played INTEGER DEFAULT 0,
+            human_wins INTEGER DEFAULT 0,
+            ai_wins INTEGER DEFAULT 0
+        )
+    ''')
+    cursor.execute('''
+        INSERT INTO user_race_stats (id, user_id, username, map_name, times_played, human_wins, ai_wins)
+        SELECT id, user_id, username, map_name, times_played, human_wins, ai_wins
+        FROM legacy_user_race_stats
+        WHERE user_id IS NULL OR user_id IN (SELECT id FROM users)
+    ''')
+    cursor.execute("DROP TABLE legacy_user_race_stats")
+
+
+def _create_leaderboard(cursor):
+    # One row per user with a best time: how many maps they cleared and the sum of their best times.
+    # Triggers on user_best_map_scores keep it current and bump leaderboard_version, which tells
+    # every process's read cache that the standings changed.
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS leaderboard (
+            user_id INTEGER PRIMARY KEY,
+            maps_cleared INTEGER NOT NULL,
+            total_time REAL NOT NULL
+        )
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_leaderboard_rank
+        ON leaderboard (maps_cleared DESC, total_time, user_id)
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS leaderboard_version (
+            id INTEGER PRIMARY KEY CHECK (id = 0),
+            version INTEGER NOT NULL
         )
     ''')
+    cursor.execute("INSERT OR IGNORE INTO leaderboard_version (id, version) VALUES (0, 0)")
+
+    # Recompute one user's row from their best times (a handful of rows on the primary key).
+    # A user whose account is being deleted gets no row back.
+    refresh = '''
+        DELETE FROM leaderboard WHERE user_id = {row}.user_id;
+        INSERT INTO leaderboard (user_id, maps_cleared, total_time)
+        SELECT user_id, COUNT(*), SUM(time_taken)
+        FROM user_best_map_scores
+        WHERE user_id = {row}.user_id AND EXISTS (SELECT 1 FROM users WHERE id = {row}.user_id)
+        GROUP BY user_id;
+        UPDATE leaderboard_version SET version = version + 1;
+    '''
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS leaderboard_best_insert AFTER INSERT ON user_best_map_scores
+        BEGIN {refresh.format(row="NEW")} END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS leaderboard_best_update AFTER UPDATE OF time_taken ON user_best_map_scores
+        BEGIN {refresh.format(row="NEW")} END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS leaderboard_best_delete AFTER DELETE ON user_best_map_scores
+        BEGIN {refresh.format(row="OLD")} END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS leaderboard_user_delete AFTER DELETE ON users
+        BEGIN
+            DELETE FROM leaderboard WHERE user_id = OLD.id;
+            UPDATE leaderboard_version SET version = version + 1;
+        END
+    ''')
 
-    conn.commit()
-    conn.close()
+
+def rebuild_leaderboard(cursor):
+    # Fill the leaderboard from user_best_map_scores in one pass
+    cursor.execute("DELETE FROM leaderboard")
+    cursor.execute('''
+        INSERT INTO leaderboard (user_id, maps_cleared, total_time)
+        SELECT b.user_id, COUNT(*), SUM(b.time_taken)
+        FROM user_best_map_scores b
+        WHERE b.user_id IN (SELECT id FROM users)
+        GROUP BY b.user_id
+    ''')
+    cursor.execute("UPDATE leaderboard_version SET version = version + 1")
+
+
+def init_db():
+    conn = get_connection()
+    conn.create_function("canonical_map_path", 1, canonical_map_path, deterministic=True)
+    with transaction():
+        cursor = conn.cursor()
+        version = cursor.execute("PRAGMA user_version").fetchone()[0]
+        if version >= SCHEMA_VERSION:
+            return
+
+        # Create users table
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS users (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                username TEXT UNIQUE NOT NULL,
+                password TEXT,
+                security_question TEXT,
+                security_answer TEXT
+            )
+        ''')
+
+        if version < 1:
+            has_scores = cursor.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'scores'"
+            ).fetchone()
+            if has_scores:
+                _migrate_map_names(cursor)
+            else:
+                _create_score_tables(cursor)
+
+        if version < 2:
+            _create_leaderboard(cursor)
+            rebuild_leaderboard(cursor)
+
+        if version < 3:
+            # When each run was recorded, in Unix seconds (NULL for runs from before this column)
+            cursor.execute("ALTER TABLE scores ADD COLUMN played_at INTEGER")
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_scores_played_at ON scores (played_at)")
+
+        if version < 4:
+            # Case-insensitive username order, for prefix searches on the admin screen
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_users_username_nocase ON users (username COLLATE NOCASE)")
+
+        if version < 5:
+            _migrate_race_stats(cursor)
+
+        cursor.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
 
 def hash_text(text):
     return hashlib.sha256(text.encode()).hexdigest()
 
 
 def create_user(username, password=None, question=None, answer=None):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
     hashed_pw = hash_text(password) if password else None
     hashed_ans = hash_text(answer) if answer else None
     try:
-        cursor.execute(
-            "INSERT INTO users (username, password, security_question, security_answer) VALUES (?, ?, ?, ?)",
-            (username, hashed_pw, question, hashed_ans)
-        )
-        conn.commit()
-        user_id = cursor.lastrowid
+        with transaction() as conn:
+            cursor = conn.execute(
+                "INSERT INTO users (username, password, security_question, security_answer) VALUES (?, ?, ?, ?)",
+                (username, hashed_pw, question, hashed_ans)
+            )
+            user_id = cursor.lastrowid
     except sqlite3.IntegrityError:
         user_id = None
-    conn.close()
     return user_id
 
 
 
 def get_user(username, password=None):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
+    conn = get_connection()
     if password:
         hashed_pw = hash_text(password)  # Use the new general-purpose hasher
-        cursor.execute("SELECT id FROM users WHERE username = ? AND password = ?", (username, hashed_pw))
+        cursor = conn.execute("SELECT id FROM users WHERE username = ? AND password = ?", (username, hashed_pw))
     else:
-        cursor.execute("SELECT id FROM users WHERE username = ?", (username,))
+        cursor = conn.execute("SELECT id FROM users WHERE username = ?", (username,))
     result = cursor.fetchone()
-    conn.close()
     return result[0] if result else None
 
 
 def verify_security_answer(username, answer):
     hashed_ans = hash_text(answer)
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute(
+    cursor = get_connection().execute(
         "SELECT id FROM users WHERE username = ? AND security_answer = ?",
         (username, hashed_ans)
     )
     result = cursor.fetchone()
-    conn.close()
     return result[0] if result else None
 
 
 
+def get_map_id(cursor, map_name):
+    # id of a map, adding it to the maps table the first time it is seen
+    path = canonical_map_path(map_name)
+    cursor.execute("INSERT OR IGNORE INTO maps (path) VALUES (?)", (path,))
+    return cursor.execute("SELECT id FROM maps WHERE path = ?", (path,)).fetchone()[0]
+
+
 def insert_score(user_id, map_name, time_taken, collisions, checkpoints):
-    print(">>> INSERTING SCORE INTO DB")
+    with transaction() as conn:
+        _write_score(conn.cursor(), user_id, map_name, time_taken, collisions, checkpoints, int(time.time()))
+
 
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
+def _write_score(cursor, user_id, map_name, time_taken, collisions, checkpoints, played_at):
+    map_id = get_map_id(cursor, map_name)
 
     # Insert into scores table (all runs)
     cursor.execute('''
-        INSERT INTO scores (user_id, map_name, time_taken, collisions, checkpoints)
-        VALUES (?, ?, ?, ?, ?)
-    ''', (user_id, map_name, time_taken, collisions, checkpoints))
+        INSERT INTO scores (user_id, map_id, time_taken, collisions, checkpoints, played_at)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', (user_id, map_id, time_taken, collisions, checkpoints, played_at))
 
     # Update or insert into user_map_stats (for personal leaderboard)
     cursor.execute('''
-        INSERT INTO user_map_stats (user_id, map_name, times_played, total_collisions, total_time)
+        INSERT INTO user_map_stats (user_id, map_id, times_played, total_collisions, total_time)
         VALUES (?, ?, 1, ?, ?)
-        ON CONFLICT(user_id, map_name) DO UPDATE SET
+        ON CONFLICT(user_id, map_id) DO UPDATE SET
             times_played = times_played + 1,
             total_collisions = total_collisions + ?,
             total_time = total_time + ?
-    ''', (user_id, map_name, collisions, time_taken, collisions, time_taken))
+    ''', (user_id, map_id, collisions, time_taken, collisions, time_taken))
 
-    # Update or insert best score for complete leaderboard
+    # Insert the best score for the complete leaderboard, or lower it if this run was faster
     cursor.execute('''
-        SELECT time_taken FROM user_best_map_scores
-        WHERE user_id = ? AND map_name = ?
-    ''', (user_id, map_name))
-    existing = cursor.fetchone()
-
-    if existing is None:
-        # No entry yet → insert new best time
-        cursor.execute('''
-            INSERT INTO user_best_map_scores (user_id, map_name, time_taken)
-            VALUES (?, ?, ?)
-        ''', (user_id, map_name, time_taken))
-    elif time_taken < existing[0]:
-        # Better time → update
-        cursor.execute('''
-            UPDATE user_best_map_scores
-            SET time_taken = ?
-            WHERE user_id = ? AND map_name = ?
-        ''', (time_taken, user_id, map_name))
+        INSERT INTO user_best_map_scores (user_id, map_id, time_taken)
+        VALUES (?, ?, ?)
+        ON CONFLICT(user_id, map_id) DO UPDATE SET
+            time_taken = excluded.time_taken
+        WHERE excluded.time_taken < user_best_map_scores.time_taken
+    ''', (user_id, map_id, time_taken))
+
+
+class ScoreWriter:
+    # Writes queued scores on a background thread, a batch per transaction, so the
+    # game loop never waits on SQLite. flush() returns once everything queued is on disk.
+    def __init__(self, max_pending=SCORE_QUEUE_SIZE, batch_size=SCORE_BATCH_SIZE):
+        self.pending = queue.Queue(max_pending)
+        self.batch_size = batch_size
+        self.thread = threading.Thread(target=self._run, name="ScoreWriter", daemon=True)
+        self.thread.start()
+
+    def submit(self, user_id, map_name, time_taken, collisions, checkpoints):
+        # stamped now, not when the thread gets to it
+        self.pending.put((user_id, map_name, time_taken, collisions, checkpoints, int(time.time())))
+
+    def flush(self):
+        self.pending.join()
+
+    def busy(self):
+        # True until every score submitted so far is committed; never blocks
+        with self.pending.mutex:
+            return self.pending.unfinished_tasks > 0
+
+    def _run(self):
+        while True:
+            batch = [self.pending.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.pending.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._write(batch)
+            except Exception:
+                # one bad score (say, of a user deleted meanwhile) shouldn't cost the others theirs
+                for score in batch:
+                    try:
+                        self._write([score])
+                    except Exception as e:
+                        print(f"Error: could not save score {score}: {e}")
+            finally:
+                for _ in batch:
+                    self.pending.task_done()
+
+    def _write(self, batch):
+        with transaction() as conn:
+            cursor = conn.cursor()
+            for score in batch:
+                _write_score(cursor, *score)
+
+
+_score_writer = None
+_score_writer_lock = threading.Lock()
+
+
+def queue_score(user_id, map_name, time_taken, collisions, checkpoints):
+    # insert_score without waiting for the disk. readers that call flush_scores() first (get_top_scores,
+    # get_user_map_stats, get_user_scores and the deletes) see it straight away; the paged readers the
+    # game loop uses (get_leaderboard_page, get_user_rank, get_user_map_stats_page) don't wait, and
+    # show it only once it is written, i.e. when scores_pending() is False
+    global _score_writer
+    with _score_writer_lock:
+        if _score_writer is None:
+            _score_writer = ScoreWriter()
+            atexit.register(flush_scores)
+    _score_writer.submit(user_id, map_name, time_taken, collisions, checkpoints)
+
+
+def flush_scores():
+    # Wait until every queued score is written (call before handing scores.db to another process)
+    if _score_writer is not None:
+        _score_writer.flush()
+
+
+def scores_pending():
+    # Whether queued scores are still being written; poll it from the game loop instead of flushing
+    return _score_writer is not None and _score_writer.busy()
+
+
+def _chunks(rows, size):
+    rows = iter(rows)
+    while True:
+        chunk = list(itertools.islice(rows, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def bulk_create_users(users, chunk_size=BULK_CHUNK_SIZE):
+    # Add many (username, password, question, answer) rows at once; names already taken are left alone.
+    # Returns {username: id} for every username given
+    ids = {}
+    for chunk in _chunks(users, chunk_size):
+        rows = [(username, hash_text(password) if password else None, question,
+                 hash_text(answer) if answer else None)
+                for username, password, question, answer in chunk]
+        with transaction() as conn:
+            conn.executemany(
+                "INSERT OR IGNORE INTO users (username, password, security_question, security_answer) VALUES (?, ?, ?, ?)",
+                rows
+            )
+            for names in _chunks([row[0] for row in rows], LOOKUP_CHUNK_SIZE):
+                marks = ", ".join("?" * len(names))
+                ids.update((name, user_id) for user_id, name in conn.execute(
+                    f"SELECT id, username FROM users WHERE username IN ({marks})", names))
+    return ids
+
+
+def bulk_insert_scores(scores, chunk_size=BULK_CHUNK_SIZE):
+    # insert_score for many (user_id, map_name, time_taken, collisions, checkpoints[, played_at]) rows;
+    # played_at is in Unix seconds and defaults to now.
+    # Each chunk is one transaction: the raw rows go in with executemany, then the chunk's
+    # per-user, per-map stats and best times are merged in with one grouped query each.
+    # Returns how many scores were written
+    map_ids = {}
+    written = 0
+    for chunk in _chunks(scores, chunk_size):
+        with transaction() as conn:
+            cursor = conn.cursor()
+            rows = []
+            now = int(time.time())
+            for score in chunk:
+                map_id = map_ids.get(score[1])
+                if map_id is None:
+                    map_id = map_ids[score[1]] = get_map_id(cursor, score[1])
+                rows.append((score[0], map_id, score[2], score[3], score[4], score[5] if len(score) > 5 else now))
+
+            # the write lock is held, so everything past this id is this chunk
+            last_id = cursor.execute("SELECT COALESCE(MAX(id), 0) FROM scores").fetchone()[0]
+            cursor.executemany('''
+                INSERT INTO scores (user_id, map_id, time_taken, collisions, checkpoints, played_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', rows)
+            _merge_score_summaries(cursor, last_id)
+        written += len(chunk)
+    return written
+
+
+def _merge_score_summaries(cursor, last_id):
+    # Fold the scores with id > last_id into user_map_stats and user_best_map_scores
+    cursor.execute('''
+        INSERT INTO user_map_stats (user_id, map_id, times_played, total_collisions, total_time)
+        SELECT user_id, map_id, COUNT(*), SUM(collisions), SUM(time_taken)
+        FROM scores
+        WHERE id > ?
+        GROUP BY user_id, map_id
+        ON CONFLICT(user_id, map_id) DO UPDATE SET
+            times_played = times_played + excluded.times_played,
+            total_collisions = total_collisions + excluded.total_collisions,
+            total_time = total_time + excluded.total_time
+    ''', (last_id,))
+    cursor.execute('''
+        INSERT INTO user_best_map_scores (user_id, map_id, time_taken)
+        SELECT user_id, map_id, MIN(time_taken)
+        FROM scores
+        WHERE id > ?
+        GROUP BY user_id, map_id
+        ON CONFLICT(user_id, map_id) DO UPDATE SET
+            time_taken = excluded.time_taken
+        WHERE excluded.time_taken < user_best_map_scores.time_taken
+    ''', (last_id,))
 
-    conn.commit()
-    conn.close()
 
 def get_user_map_stats(user_id):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute('''
-        SELECT map_name, times_played, total_collisions, total_time
-        FROM user_map_stats
-        WHERE user_id = ?
-        ORDER BY total_time ASC
+    flush_scores()
+    cursor = get_connection().execute('''
+        SELECT m.path, s.times_played, s.total_collisions, s.total_time
+        FROM user_map_stats s
+        JOIN maps m ON m.id = s.map_id
+        WHERE s.user_id = ?
+        ORDER BY s.total_time ASC
     ''', (user_id,))
     rows = cursor.fetchall()
-    conn.close()
 
     return [{
         "map_name": row[0],
@@ -174,118 +611,244 @@ def get_user_map_stats(user_id):
     } for row in rows]
 
 
+# Rank order of the leaderboard, and the rows strictly before/after a given row in it.
+# Written out (rather than as a row value) so SQLite can walk idx_leaderboard_rank.
+_RANK_ORDER = "l.maps_cleared DESC, l.total_time ASC, l.user_id ASC"
+_REVERSE_RANK_ORDER = "l.maps_cleared ASC, l.total_time DESC, l.user_id DESC"
+_RANKED_AFTER = (
+    "(l.maps_cleared < :maps OR (l.maps_cleared = :maps AND "
+    "(l.total_time > :time OR (l.total_time = :time AND l.user_id > :user))))"
+)
+_RANKED_BEFORE = (
+    "(l.maps_cleared > :maps OR (l.maps_cleared = :maps AND "
+    "(l.total_time < :time OR (l.total_time = :time AND l.user_id < :user))))"
+)
+
+
+def _cached_leaderboard(key, load):
+    # Served from memory until some process records a better time
+    conn = get_connection()
+    version = (DB_PATH, conn.execute("SELECT version FROM leaderboard_version").fetchone()[0])
+    if _leaderboard_cache["version"] != version:
+        _leaderboard_cache["version"] = version
+        _leaderboard_cache["rows"] = {}
+    entries = _leaderboard_cache["rows"].get(key)
+    if entries is None:
+        entries = load(conn)
+        if len(_leaderboard_cache["rows"]) >= MAX_CACHED_LEADERBOARD_READS:
+            del _leaderboard_cache["rows"][next(iter(_leaderboard_cache["rows"]))]
+        _leaderboard_cache["rows"][key] = entries
+    return [dict(entry) for entry in entries]
+
+
+def _leaderboard_entry(rank, row):
+    # row is (user_id, username, maps_cleared, total_time). "cursor" is what the next or
+    # previous page is asked for with; it keeps the unrounded time so no row is skipped
+    return {
+        "rank": rank,
+        "username": row[1],
+        "maps_cleared": row[2],
+        "total_time": round(row[3], 2),
+        "cursor": (rank, row[2], row[3], row[0]),
+    }
+
+
+def get_leaderboard_page(after=None, before=None, limit=LEADERBOARD_PAGE_SIZE):
+    # Up to limit leaderboard rows in rank order: the first ones, the ones right after the
+    # row whose "cursor" is given as after, or the ones right before the cursor given as before.
+    # Only committed scores count: this is read from the game loop, which must not wait for the
+    # score writer, so results lag queue_score until scores_pending() is False. Callers that need
+    # their own score to show (manual.py after a finish) read again once it is
+    def load(conn):
+        if after is None and before is None:
+            rows = conn.execute(f'''
+                SELECT l.user_id, u.username, l.maps_cleared, l.total_time
+                FROM leaderboard l
+                JOIN users u ON u.id = l.user_id
+                ORDER BY {_RANK_ORDER}
+                LIMIT :limit
+            ''', {"limit": limit}).fetchall()
+            return [_leaderboard_entry(rank, row) for rank, row in enumerate(rows, start=1)]
+
+        rank, maps, time, user = after if after is not None else before
+        params = {"maps": maps, "time": time, "user": user, "limit": limit}
+        if after is not None:
+            rows = conn.execute(f'''
+                SELECT l.user_id, u.username, l.maps_cleared, l.total_time
+                FROM leaderboard l
+                JOIN users u ON u.id = l.user_id
+                WHERE {_RANKED_AFTER}
+                ORDER BY {_RANK_ORDER}
+                LIMIT :limit
+            ''', params).fetchall()
+            return [_leaderboard_entry(rank + i, row) for i, row in enumerate(rows, start=1)]
+
+        rows = conn.execute(f'''
+            SELECT l.user_id, u.username, l.maps_cleared, l.total_time
+            FROM leaderboard l
+            JOIN users u ON u.id = l.user_id
+            WHERE {_RANKED_BEFORE}
+            ORDER BY {_REVERSE_RANK_ORDER}
+            LIMIT :limit
+        ''', params).fetchall()
+        return [_leaderboard_entry(rank - i, row) for i, row in enumerate(rows, start=1)][::-1]
+
+    return _cached_leaderboard(("page", after, before, limit), load)
+
+
+def get_user_rank(user_id):
+    # The user's leaderboard row (with its rank), or None if they haven't cleared a map yet.
+    # Committed scores only, like get_leaderboard_page: it lags queue_score until scores_pending() is False
+    def load(conn):
+        row = conn.execute('''
+            SELECT l.user_id, u.username, l.maps_cleared, l.total_time
+            FROM leaderboard l
+            JOIN users u ON u.id = l.user_id
+            WHERE l.user_id = ?
+        ''', (user_id,)).fetchone()
+        if row is None:
+            return []
+        ahead = conn.execute(
+            f"SELECT COUNT(*) FROM leaderboard l WHERE {_RANKED_BEFORE}",
+            {"maps": row[2], "time": row[3], "user": row[0]}
+        ).fetchone()[0]
+        return [_leaderboard_entry(ahead + 1, row)]
+
+    entries = _cached_leaderboard(("rank", user_id), load)
+    return entries[0] if entries else None
+
+
 def get_top_scores(limit=100):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute('''
-        SELECT u.username, COUNT(b.map_name) AS maps_cleared, SUM(b.time_taken) AS total_time
-        FROM user_best_map_scores b
-        JOIN users u ON b.user_id = u.id
-        GROUP BY b.user_id
-        ORDER BY maps_cleared DESC, total_time ASC
+    flush_scores()
+    return get_leaderboard_page(limit=limit)
+
+
+def get_user_map_stats_page(user_id, after=None, limit=LEADERBOARD_PAGE_SIZE):
+    # Up to limit of the user's per-map stats ordered by map path, starting after the map_name given.
+    # Committed scores only, like get_leaderboard_page: it lags queue_score until scores_pending() is False
+    cursor = get_connection().execute('''
+        SELECT m.path, s.times_played, s.total_collisions, s.total_time
+        FROM user_map_stats s
+        JOIN maps m ON m.id = s.map_id
+        WHERE s.user_id = ? AND m.path > ?
+        ORDER BY m.path ASC
         LIMIT ?
-    ''', (limit,))
+    ''', (user_id, after if after is not None else "", limit))
     rows = cursor.fetchall()
-    conn.close()
-
-    # Return as list of dictionaries
-    leaderboard = []
-    for rank, row in enumerate(rows, start=1):
-        leaderboard.append({
-            "rank": rank,
-            "username": row[0],
-            "maps_cleared": row[1],
-            "total_time": round(row[2], 2)
-        })
-    return leaderboard
+
+    return [{
+        "map_name": row[0],
+        "times_played": row[1],
+        "total_collisions": row[2],
+        "total_time": round(row[3], 2)
+    } for row in rows]
 
 def get_user_scores(user_id):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute('''
-        SELECT map_name, time_taken, collisions, checkpoints
-        FROM scores
-        WHERE user_id = ?
-        ORDER BY time_taken ASC
+    flush_scores()
+    cursor = get_connection().execute('''
+        SELECT m.path, s.time_taken, s.collisions, s.checkpoints
+        FROM scores s
+        JOIN maps m ON m.id = s.map_id
+        WHERE s.user_id = ?
+        ORDER BY s.time_taken ASC
     ''', (user_id,))
-    results = cursor.fetchall()
-    conn.close()
-    return results
+    return cursor.fetchall()
 
 def get_user_question(username):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute("SELECT security_question FROM users WHERE username = ?", (username,))
+    cursor = get_connection().execute("SELECT security_question FROM users WHERE username = ?", (username,))
     row = cursor.fetchone()
-    conn.close()
     return row[0] if row else None
 
 def update_user_password(username, new_password):
     hashed_pw = hash_text(new_password)
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute("UPDATE users SET password = ? WHERE username = ?", (hashed_pw, username))
-    conn.commit()
-    conn.close()
+    with transaction() as conn:
+        conn.execute("UPDATE users SET password = ? WHERE username = ?", (hashed_pw, username))
 
 def get_all_users():
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute("SELECT username FROM users")
-    users = [row[0] for row in cursor.fetchall()]
-    conn.close()
-    return users
-
-def delete_map_from_db(map_name):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-
-    # Normalize both forward and backward slashes
-    map_variants = [map_name, map_name.replace("/", "\\"), map_name.replace("\\", "/")]
-
-    # Delete from scores
-    cursor.execute(
-        f"DELETE FROM scores WHERE map_name IN ({','.join(['?']*len(map_variants))})",
-        map_variants
-    )
-
-    # Delete from user_map_stats
-    cursor.execute(
-        f"DELETE FROM user_map_stats WHERE map_name IN ({','.join(['?']*len(map_variants))})",
-        map_variants
-    )
+    cursor = get_connection().execute("SELECT username FROM users")
+    return [row[0] for row in cursor.fetchall()]
+
+
+# NOCASE folds ASCII letters only; str.lower() would fold "É" too and miss "Émile"
+_NOCASE_FOLD = str.maketrans(string.ascii_uppercase, string.ascii_lowercase)
+
+
+def _prefix_range(prefix):
+    # usernames starting with prefix (ignoring ASCII case) are >= low and < high under NOCASE
+    low = prefix.translate(_NOCASE_FOLD)
+    return low, low[:-1] + chr(ord(low[-1]) + 1)
+
+
+def search_users(prefix="", after=None, limit=USER_PAGE_SIZE):
+    # Up to limit users whose name starts with prefix, in case-insensitive name order, starting
+    # after the row whose "cursor" is given. Each row carries the user's run and map counts
+    conditions, params = [], []
+    if prefix:
+        conditions.append("u.username COLLATE NOCASE >= ? AND u.username COLLATE NOCASE < ?")
+        params.extend(_prefix_range(prefix))
+    if after is not None:
+        conditions.append("(u.username COLLATE NOCASE > ? OR (u.username COLLATE NOCASE = ? AND u.id > ?))")
+        params.extend((after[0], after[0], after[1]))
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    cursor = get_connection().execute(f'''
+        SELECT u.id, u.username,
+            (SELECT COALESCE(SUM(s.times_played), 0) FROM user_map_stats s WHERE s.user_id = u.id),
+            COALESCE(l.maps_cleared, 0)
+        FROM users u
+        LEFT JOIN leaderboard l ON l.user_id = u.id
+        {where}
+        ORDER BY u.username COLLATE NOCASE, u.id
+        LIMIT ?
+    ''', params + [limit])
 
-    # Delete from user_best_map_scores
-    cursor.execute(
-        f"DELETE FROM user_best_map_scores WHERE map_name IN ({','.join(['?']*len(map_variants))})",
-        map_variants
-    )
+    return [{
+        "id": row[0],
+        "username": row[1],
+        "runs": row[2],
+        "maps_cleared": row[3],
+        "cursor": (row[1], row[0]),
+    } for row in cursor]
+
+
+def count_users(prefix=""):
+    if not prefix:
+        return get_connection().execute("SELECT COUNT(*) FROM users").fetchone()[0]
+    return get_connection().execute(
+        "SELECT COUNT(*) FROM users WHERE username COLLATE NOCASE >= ? AND username COLLATE NOCASE < ?",
+        _prefix_range(prefix)
+    ).fetchone()[0]
 
-    conn.commit()
-    conn.close()
+def delete_map_from_db(map_name):
+    # Scores, stats and best times go with the map through ON DELETE CASCADE
+    flush_scores()
+    with transaction() as conn:
+        conn.execute("DELETE FROM maps WHERE path = ?", (canonical_map_path(map_name),))
 
     print(f"Deleted map '{map_name}' from all tables.")
 
 
 
 def delete_user_by_username(username):
+    # True once the user is gone; False when they can't be deleted
     if username == "Yousuf":
         print("Cannot delete Admin user.")
-        return
-
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-
-    cursor.execute("SELECT id FROM users WHERE username=?", (username,))
-    result = cursor.fetchone()
+        return False
 
-    if result:
-        user_id = result[0]
-        cursor.execute("DELETE FROM scores WHERE user_id=?", (user_id,))
-        cursor.execute("DELETE FROM user_map_stats WHERE user_id=?", (user_id,))
-        cursor.execute("DELETE FROM user_best_map_scores WHERE user_id=?", (user_id,))
-        cursor.execute("DELETE FROM users WHERE id=?", (user_id,))
+    flush_scores()
+    # Scores, stats and best times go with the user through ON DELETE CASCADE, the leaderboard row by trigger
+    try:
+        with transaction() as conn:
+            conn.execute("DELETE FROM users WHERE username=?", (username,))
+    except sqlite3.Error as e:
+        print(f"Error: could not delete user '{username}': {e}")
+        return False
+    return True
 
-    conn.commit()
-    conn.close()
 
+if os.environ.get("DB_PROFILE"):
+    try:
+        enable_profiling(float(os.environ.get("DB_SLOW_QUERY_MS", DEFAULT_SLOW_MS)),
+                         os.environ.get("DB_SLOW_QUERY_LOG", DEFAULT_SLOW_LOG))
+    except ValueError:
+        print(f"Error: DB_SLOW_QUERY_MS must be a number of milliseconds, not {os.environ['DB_SLOW_QUERY_MS']!r}")
+        sys.exit(1)
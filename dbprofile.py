@@ -0,0 +1,193 @@
+import sys
+import time
+import bisect
+import threading
+
+# upper edges of the latency histogram buckets in milliseconds; the last bucket takes everything slower
+BUCKET_EDGES_MS = [0.1, 0.3, 1, 3, 10, 30, 100, 300, 1000]
+DEFAULT_SLOW_MS = 50.0
+DEFAULT_SLOW_LOG = "slow_queries.log"
+
+
+class FunctionStats:
+    # latency and row totals of every query issued from one function
+    def __init__(self) -> None:
+        self.calls = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.rows = 0
+        self.buckets = [0] * (len(BUCKET_EDGES_MS) + 1)
+
+    def add(self, seconds: float, rows: int) -> None:
+        self.calls += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        self.rows += rows
+        self.buckets[bisect.bisect_left(BUCKET_EDGES_MS, seconds * 1000)] += 1
+
+
+class QueryProfiler:
+    # collects the timings reported by instrumented connections, from any thread
+    def __init__(self, slow_ms: float = DEFAULT_SLOW_MS, slow_log: str = DEFAULT_SLOW_LOG) -> None:
+        self.slow_ms = slow_ms
+        self.slow_log = slow_log
+        self.functions = {}
+        self.lock = threading.Lock()
+
+    def record(self, function: str, sql: str, params, seconds: float, rows: int) -> None:
+        with self.lock:
+            stats = self.functions.get(function)
+            if stats is None:
+                stats = self.functions[function] = FunctionStats()
+            stats.add(seconds, rows)
+            if self.slow_log and seconds * 1000 >= self.slow_ms:
+                with open(self.slow_log, "a", encoding="utf-8") as f:
+                    f.write(f"{time.strftime('%Y-%m-%d %H:%M:%S')} {seconds * 1000:.1f}ms {function} "
+                            f"rows={rows} {' '.join(sql.split())} params={_short(params)}\n")
+
+    def summary(self) -> str:
+        # one line per function, slowest in total first
+        edges = [f"<{edge:g}" for edge in BUCKET_EDGES_MS] + [f">{BUCKET_EDGES_MS[-1]:g}"]
+        lines = [f"{'function':<40} {'calls':>7} {'total ms':>10} {'mean ms':>8} {'max ms':>8} {'rows':>9}  "
+                 + " ".join(f"{edge:>6}" for edge in edges)]
+        with self.lock:
+            ranked = sorted(self.functions.items(), key=lambda item: item[1].total, reverse=True)
+            for function, stats in ranked:
+                lines.append(
+                    f"{function:<40} {stats.calls:>7} {stats.total * 1000:>10.1f} "
+                    f"{stats.total * 1000 / stats.calls:>8.2f} {stats.max * 1000:>8.2f} {stats.rows:>9}  "
+                    + " ".join(f"{count:>6}" for count in stats.buckets)
+                )
+        return "\n".join(lines)
+
+    def print_summary(self) -> None:
+        if self.functions:
+            print("== SQL query profile (latency histogram buckets in ms) ==")
+            print(self.summary())
+
+
+def _short(params, limit=200):
+    text = repr(params)
+    return text if len(text) <= limit else text[:limit] + "..."
+
+
+_THIS_MODULE = __name__
+
+
+def _caller() -> str:
+    # "module.function" of the code that issued the query; nested helpers count as their enclosing function
+    frame = sys._getframe(1)
+    while frame is not None and frame.f_globals.get("__name__") == _THIS_MODULE:
+        frame = frame.f_back
+    if frame is None:
+        return "?"
+    code = frame.f_code
+    name = getattr(code, "co_qualname", code.co_name).split(".<locals>")[0]
+    return f"{frame.f_globals.get('__name__', '?')}.{name}"
+
+
+class InstrumentedCursor:
+    # sqlite3.Cursor stand-in that times each statement from execute until its last row is fetched
+    def __init__(self, cursor, profiler: QueryProfiler) -> None:
+        self._cursor = cursor
+        self._profiler = profiler
+        self._query = None
+
+    def _finish(self) -> None:
+        if self._query is not None:
+            function, sql, params, seconds, rows = self._query
+            self._query = None
+            self._profiler.record(function, sql, params, seconds, rows)
+
+    def _timed(self, fetch, *args):
+        start = time.perf_counter()
+        result = fetch(*args)
+        if self._query is not None:
+            self._query[3] += time.perf_counter() - start
+        return result
+
+    def execute(self, sql, params=()):
+        self._finish()
+        function = _caller()
+        start = time.perf_counter()
+        self._cursor.execute(sql, params)
+        self._query = [function, sql, params, time.perf_counter() - start, 0]
+        if self._cursor.description is None:
+            # not a query: nothing to fetch, rowcount says how many rows changed
+            self._query[4] = max(self._cursor.rowcount, 0)
+            self._finish()
+        return self
+
+    def executemany(self, sql, seq_of_params):
+        self._finish()
+        function = _caller()
+        start = time.perf_counter()
+        self._cursor.executemany(sql, seq_of_params)
+        self._query = [function, sql, "<many>", time.perf_counter() - start, max(self._cursor.rowcount, 0)]
+        self._finish()
+        return self
+
+    def fetchone(self):
+        row = self._timed(self._cursor.fetchone)
+        if row is None:
+            self._finish()
+        elif self._query is not None:
+            self._query[4] += 1
+        return row
+
+    def fetchmany(self, size=None):
+        rows = self._timed(self._cursor.fetchmany, self._cursor.arraysize if size is None else size)
+        if not rows:
+            self._finish()
+        elif self._query is not None:
+            self._query[4] += len(rows)
+        return rows
+
+    def fetchall(self):
+        rows = self._timed(self._cursor.fetchall)
+        if self._query is not None:
+            self._query[4] += len(rows)
+        self._finish()
+        return rows
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        row = self.fetchone()
+        if row is None:
+            raise StopIteration
+        return row
+
+    def close(self) -> None:
+        self._finish()
+        self._cursor.close()
+
+    def __del__(self):
+        # queries read only partly (fetchone on a lookup) are recorded when the cursor goes away
+        try:
+            self._finish()
+        except Exception:
+            pass  # interpreter shutdown
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class InstrumentedConnection:
+    # sqlite3.Connection stand-in whose statements all go through InstrumentedCursor
+    def __init__(self, conn, profiler: QueryProfiler) -> None:
+        self._conn = conn
+        self._profiler = profiler
+
+    def cursor(self) -> InstrumentedCursor:
+        return InstrumentedCursor(self._conn.cursor(), self._profiler)
+
+    def execute(self, sql, params=()) -> InstrumentedCursor:
+        return self.cursor().execute(sql, params)
+
+    def executemany(self, sql, seq_of_params) -> InstrumentedCursor:
+        return self.cursor().executemany(sql, seq_of_params)
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
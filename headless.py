@@ -0,0 +1,164 @@
+import os
+# no window is ever opened; the dummy driver keeps SDL happy on servers without a display
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+
+import sys
+import math
+import pickle
+import random
+import argparse
+import multiprocessing
+import neat
+import numpy as np
+from car import RADAR_BACKENDS, COLLISION_CHECKS, set_radar_backend, set_collision_check
+from carbatch import CarBatch
+from netbatch import NetworkCache
+from selfdriving import create_generation, step_generation, get_finish_rect, reached_finish
+from mapbundle import load_map_bundle
+from trackfield import get_track_grid
+
+DEFAULT_MAX_TICKS = 10000
+# how far from the editor's start point a starting pose that fits on the track is looked for, in pixels
+START_SEARCH_RADIUS = 200
+
+
+class HeadlessWorld:
+    # map data the simulation needs, read from the compiled map bundle (no image decoding, no window)
+    def __init__(self, map_path):
+        self.map_path = map_path
+        bundle = load_map_bundle(map_path)
+        self.collision_mask = bundle.collision_mask
+        self.metadata = bundle.metadata
+        self.finish_rect = get_finish_rect(self.metadata)
+
+
+def default_start(world):
+    # the editor stores the start as the first point of the road, right at its end, where a car
+    # doesn't fit. Slide forward along the heading cars start with (+x) to the first pose that is
+    # on the track, then try the poses nearest the point in any direction; None if none is in reach.
+    # cars are positioned by their top-left corner
+    if not world.metadata or "start" not in world.metadata:
+        return None
+    half = CarBatch(1, [0, 0]).half_size
+    sx, sy = world.metadata["start"][0] - float(half[0]), world.metadata["start"][1] - float(half[1])
+    for step in range(START_SEARCH_RADIUS + 1):
+        if is_valid_start(world, [sx + step, sy]):
+            return [sx + step, sy]
+
+    # only poses whose center is on the track are worth a probe
+    grid = get_track_grid(world.collision_mask)
+    offsets = np.mgrid[-START_SEARCH_RADIUS:START_SEARCH_RADIUS + 1, -START_SEARCH_RADIUS:START_SEARCH_RADIUS + 1]
+    offsets = offsets.reshape(2, -1).T
+    offsets = offsets[np.argsort(np.hypot(offsets[:, 0], offsets[:, 1]), kind="stable")]
+    for dx, dy in offsets.tolist():
+        x, y = sx + dx, sy + dy
+        cx, cy = int(x + half[0]), int(y + half[1])
+        if 0 <= cx < grid.shape[0] and 0 <= cy < grid.shape[1] and grid[cx, cy] and is_valid_start(world, [x, y]):
+            return [x, y]
+    return None
+
+
+def is_valid_start(world, start_pos):
+    probe = CarBatch(1, start_pos)
+    probe.update(world.collision_mask)
+    return bool(probe.alive[0])
+
+
+def run_generation(genomes, config, world, start_pos, max_ticks=DEFAULT_MAX_TICKS, networks=None, dt=1):
+    # same physics and fitness as run_auto_mode, without rendering, events or a frame cap.
+    # each step advances dt ticks; ends when every car crashed, a car reached the finish or
+    # max_ticks steps ran out; returns how many steps ran and whether it stopped at the finish
+    nets, cars = create_generation(genomes, config, start_pos, world.collision_mask, networks)
+    ticks = 0
+    while not max_ticks or ticks < max_ticks:
+        remaining_cars = step_generation(cars, nets, genomes, world.collision_mask, dt)
+        if remaining_cars == 0:
+            break
+        ticks += 1
+        if reached_finish(cars, world.finish_rect):
+            return ticks, True
+    return ticks, False
+
+
+def train(map_path, start_pos, generations, config_path, max_ticks=DEFAULT_MAX_TICKS, workers=1, dt=1):
+    config = neat.config.Config(
+        neat.DefaultGenome, neat.DefaultReproduction,
+        neat.DefaultSpeciesSet, neat.DefaultStagnation,
+        config_path
+    )
+    world = HeadlessWorld(map_path)
+    if start_pos is None:
+        start_pos = default_start(world)
+    if start_pos is None or not is_valid_start(world, start_pos):
+        print(f"Error: start position {start_pos} is not on the track of {map_path}")
+        sys.exit(1)
+
+    # max_ticks is simulated time; with longer steps fewer of them cover it
+    max_steps = math.ceil(max_ticks / dt)
+
+    population = neat.Population(config)
+    population.add_reporter(neat.StdOutReporter(True))
+    population.add_reporter(neat.StatisticsReporter())
+
+    if workers > 1:
+        from parallel import ParallelEvaluator
+        with ParallelEvaluator(workers, map_path, config_path, start_pos, max_steps, dt=dt) as evaluator:
+            return population.run(evaluator.evaluate, generations)
+
+    networks = NetworkCache()
+
+    def eval_genomes(genomes, config):
+        run_generation(genomes, config, world, start_pos, max_steps, networks, dt)
+
+    return population.run(eval_genomes, generations)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train self-driving cars without a window")
+    parser.add_argument('--map', required=True, help="Map image, e.g. maps/map1.png")
+    parser.add_argument('--start', type=float, nargs=2, metavar=("X", "Y"), default=None,
+                        help="Car start position (top-left, like drag and drop); defaults to the first pose that fits "
+                             "on the track at the map's start point")
+    parser.add_argument('--generations', type=int, default=100, help="Number of generations to run")
+    parser.add_argument('--config', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "config.txt"),
+                        help="NEAT config file")
+    parser.add_argument('--max-ticks', type=int, default=DEFAULT_MAX_TICKS,
+                        help="Cut a generation off after this many ticks (0 = never)")
+    parser.add_argument('--save', default=None, help="Pickle the best genome to this file")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="Worker processes evaluating genomes in parallel (0 = one per CPU)")
+    parser.add_argument('--seed', type=int, default=None, help="Seed NEAT's random numbers for repeatable runs")
+    parser.add_argument('--radar', choices=RADAR_BACKENDS, default=None,
+                        help="Radar backend (default: RADAR_BACKEND or field); all give the same radars")
+    parser.add_argument('--dt', type=float, default=1,
+                        help="Ticks simulated per physics step; larger steps train faster (swept collision "
+                             "still catches every wall contact)")
+    parser.add_argument('--collision', choices=COLLISION_CHECKS, default=None,
+                        help="Crash test (default: COLLISION_CHECK or corners); footprint tests every pixel of the car")
+    args = parser.parse_args()
+
+    if args.radar:
+        set_radar_backend(args.radar)
+    if args.collision:
+        set_collision_check(args.collision)
+
+    if args.seed is not None:
+        random.seed(args.seed)
+    workers = args.workers or multiprocessing.cpu_count()
+
+    if not os.path.exists(args.config):
+        print(f"Error: {args.config} not found")
+        sys.exit(1)
+    if args.dt <= 0:
+        print("Error: --dt must be positive")
+        sys.exit(1)
+
+    winner = train(args.map, args.start, args.generations, args.config, args.max_ticks, workers, args.dt)
+    if args.save:
+        with open(args.save, "wb") as f:
+            pickle.dump(winner, f)
+        print(f"Saved best genome to {args.save}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,38 +1,66 @@
+import sys
+import time
 import random
-from db import init_db, create_user, get_user, insert_score
+import argparse
+import db
+from db import init_db, bulk_create_users, bulk_insert_scores, BULK_CHUNK_SIZE
 
-# Step 1: Initialize the database
-init_db()
-
-# Step 2: Define dummy maps you want to use
-maps = [
+# Dummy maps the scores are spread over
+MAPS = [
     "maps/map.png", "maps/map1.png", "maps/map2.png", "maps/map3.png",
     "maps/map4.png"
 ]
 
-# Step 3: Create 30 users and insert random scores
-for i in range(1, 20):  # From DummyUser1 to DummyUser30
-    username = f"DummyUser{i}"
-    password = f"pass{i}"  # Simple passwords
-    question = "Pet's name?"
-    answer = f"Fluffy{i}"
 
-    # Create user
-    create_user(username, password, question, answer)
+def dummy_users(count):
+    for i in range(1, count + 1):
+        # DummyUser1, DummyUser2, ... with simple passwords
+        yield f"DummyUser{i}", f"pass{i}", "Pet's name?", f"Fluffy{i}"
+
+
+def dummy_scores(rng, user_ids, maps, count, days):
+    now = int(time.time())
+    for _ in range(count):
+        yield (
+            rng.choice(user_ids),
+            rng.choice(maps),
+            round(rng.uniform(5.0, 50.0), 3),  # Random time between 5 and 50 seconds
+            rng.randint(0, 10),  # Random collisions
+            rng.randint(0, 15),  # Random checkpoint use
+            now - rng.randint(0, days * 86400),  # Played some time in the last few days
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fill the scores database with random users and scores")
+    parser.add_argument('--users', type=int, default=30, help="Dummy users to create (or reuse)")
+    parser.add_argument('--scores', type=int, default=100, help="Scores to insert, e.g. 1000000 for a load test")
+    parser.add_argument('--maps', nargs='+', default=MAPS, help="Map paths the scores are spread over")
+    parser.add_argument('--days', type=int, default=30, help="Spread the scores over this many past days")
+    parser.add_argument('--seed', type=int, default=None, help="Seed for repeatable data")
+    parser.add_argument('--chunk-size', type=int, default=BULK_CHUNK_SIZE, help="Rows per transaction")
+    parser.add_argument('--db', default=db.DB_PATH, help="Database file")
+    args = parser.parse_args()
+
+    if args.users < 1 or args.scores < 0 or args.days < 0 or args.chunk_size < 1:
+        print("Error: --users and --chunk-size must be positive, --scores and --days not negative")
+        sys.exit(1)
 
-    # Get user ID
-    user_id = get_user(username, password)
+    db.DB_PATH = args.db
+    init_db()
+    rng = random.Random(args.seed)
 
-    if user_id:
-        # Each user plays 2 to 5 random maps
-        num_scores = random.randint(2, 5)
+    start = time.perf_counter()
+    user_ids = list(bulk_create_users(dummy_users(args.users), args.chunk_size).values())
+    elapsed = time.perf_counter() - start
+    print(f"{len(user_ids)} users in {elapsed:.2f}s")
 
-        for _ in range(num_scores):
-            map_name = random.choice(maps)
-            time_taken = round(random.uniform(5.0, 50.0), 3)  # Random time between 5 and 50 seconds
-            collisions = random.randint(0, 10)  # Random collisions between 0 and 3
-            checkpoints = random.randint(0, 15)  # Random checkpoint use between 0 and 2
+    start = time.perf_counter()
+    written = bulk_insert_scores(dummy_scores(rng, user_ids, args.maps, args.scores, args.days), args.chunk_size)
+    elapsed = time.perf_counter() - start
+    rate = written / elapsed if elapsed > 0 else float("inf")
+    print(f"{written} scores in {elapsed:.2f}s ({rate:,.0f} rows/s)")
 
-            insert_score(user_id, map_name, time_taken, collisions, checkpoints)
 
-print("✅ 30 Dummy users and their scores added successfully!")
+if __name__ == "__main__":
+    main()
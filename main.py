@@ -6,6 +6,8 @@ from manual import run_manual
 from race import run_race
 from selfdriving import run_selfdriving
 from db import init_db
+from assets import load_image, load_scaled, get_sys_font
+import assets
 import os
 # Screen size
 SCREEN_WIDTH = 1500
@@ -47,7 +49,7 @@ class Button:
 
 # Load font
 def get_font(size):
-    return pygame.font.Font("assets/font.ttf", size)
+    return assets.get_font(size)
 
 # Splash screen
 def splash_screen(screen, font):
@@ -67,7 +69,8 @@ def splash_screen(screen, font):
             elif event.type == pygame.QUIT:
                 pygame.quit()
                 sys.exit()
-from db import get_all_users, delete_user_by_username
+from db import search_users, count_users, delete_user_by_username
+from utils import PagedRows
 
 
 def delete_map(map_name):
@@ -77,6 +80,7 @@ def delete_map(map_name):
 
     if os.path.exists(map_path):
         os.remove(map_path)
+        assets.forget(map_path)
     if os.path.exists(metadata_path):
         os.remove(metadata_path)
 
@@ -94,18 +98,23 @@ def confirm_delete_map(screen, map_name):
 
 def manage_users_screen(screen):
     running = True
-    field_font = pygame.font.SysFont("arial", 28, bold=True)
-    title_font = pygame.font.SysFont("arial", 48, bold=True)
+    field_font = get_sys_font("arial", 28, bold=True)
+    title_font = get_sys_font("arial", 48, bold=True)
 
-    scroll_offset_users = 0
     scroll_offset_maps = 0
     max_visible = 5
     scroll_speed = 30  # How much to move per scroll
 
+    # users are searched and paged in the database; only the rows scrolled past are kept
+    search_text = ""
+    user_rows = PagedRows(lambda last: search_users(search_text, last["cursor"] if last else None))
+    user_total = count_users(search_text)
+    user_offset = 0
+
     while running:
         screen.fill((30, 30, 30))
 
-        users = get_all_users()
+        users = user_rows.window(user_offset, max_visible)
         maps = get_all_maps()
 
         user_y_start = 150
@@ -148,10 +157,12 @@ def manage_users_screen(screen):
         pygame.draw.rect(screen, header_color, header_rect)
         header_text = field_font.render("Username", True, (0, 0, 0))
         screen.blit(header_text, (header_rect.x + 20, header_rect.y + 10))
+        header_text = field_font.render("Runs / Maps", True, (0, 0, 0))
+        screen.blit(header_text, (header_rect.x + 300, header_rect.y + 10))
 
         user_buttons = []
-        start_user_index = scroll_offset_users // scroll_speed
-        for idx, username in enumerate(users[start_user_index:start_user_index + max_visible]):
+        for idx, user in enumerate(users[user_offset:user_offset + max_visible]):
+            username = user["username"]
             y_pos = user_y_start + idx * 60 + 50
             row_rect = pygame.Rect(50, y_pos, SCREEN_WIDTH // 2 - 100, 50)
 
@@ -164,12 +175,25 @@ def manage_users_screen(screen):
             username_text = field_font.render(username, True, (0, 0, 0))
             screen.blit(username_text, (row_rect.x + 20, row_rect.y + 10))
 
+            counts_text = field_font.render(f"{user['runs']} / {user['maps_cleared']}", True, (0, 0, 0))
+            screen.blit(counts_text, (row_rect.x + 300, row_rect.y + 10))
+
             remove_text = field_font.render("Remove", True, (255, 0, 0))
             remove_rect = remove_text.get_rect(center=(row_rect.right - 70, row_rect.centery))
             screen.blit(remove_text, remove_rect)
 
             user_buttons.append((remove_rect, username))
 
+        # Search box under the table: type to filter usernames by prefix
+        search_rect = pygame.Rect(50, 555, SCREEN_WIDTH // 2 - 100, 45)
+        pygame.draw.rect(screen, (255, 255, 255), search_rect)
+        pygame.draw.rect(screen, border_color, search_rect, width=2)
+        search_label = search_text if search_text else "Type to search users"
+        search_color = (0, 0, 0) if search_text else (150, 150, 150)
+        screen.blit(field_font.render(search_label, True, search_color), (search_rect.x + 20, search_rect.y + 7))
+        total_text = field_font.render(f"{user_total} users", True, (0, 0, 0))
+        screen.blit(total_text, (search_rect.right - total_text.get_width() - 20, search_rect.y + 7))
+
         # -------- MAPS SECTION (RIGHT) --------
         maps_title = title_font.render("Maps", True, (255, 255, 255))
         screen.blit(maps_title, (SCREEN_WIDTH * 3 // 4 - maps_title.get_width() // 2, 70))
@@ -220,6 +244,9 @@ def manage_users_screen(screen):
                     for remove_rect, username in user_buttons:
                         if remove_rect.collidepoint(mouse_pos):
                             confirm_delete_user(screen, username)
+                            user_rows.reset()
+                            user_total = count_users(search_text)
+                            user_offset = min(user_offset, max(0, user_total - max_visible))
                             break  # after deleting, break out
 
                     # Check if clicked any map delete button
@@ -231,23 +258,34 @@ def manage_users_screen(screen):
                 # Scroll users (mouse wheel)
                 if event.button == 4:  # Mouse wheel up
                     if mouse_pos[0] < SCREEN_WIDTH // 2:  # Left side (users)
-                        scroll_offset_users = max(scroll_offset_users - scroll_speed, 0)
+                        user_offset = max(user_offset - 1, 0)
                     else:  # Right side (maps)
                         scroll_offset_maps = max(scroll_offset_maps - scroll_speed, 0)
                 if event.button == 5:  # Mouse wheel down
                     if mouse_pos[0] < SCREEN_WIDTH // 2:  # Left side (users)
-                        if (scroll_offset_users // scroll_speed) + max_visible < len(users):
-                            scroll_offset_users += scroll_speed
+                        if user_offset + max_visible < len(user_rows.window(user_offset + 1, max_visible)):
+                            user_offset += 1
                     else:  # Right side (maps)
                         if (scroll_offset_maps // scroll_speed) + max_visible < len(maps):
                             scroll_offset_maps += scroll_speed
 
+            elif event.type == pygame.KEYDOWN:
+                if event.key == pygame.K_BACKSPACE:
+                    search_text = search_text[:-1]
+                elif event.unicode and event.unicode.isprintable():
+                    search_text += event.unicode
+                else:
+                    continue
+                user_rows.reset()
+                user_total = count_users(search_text)
+                user_offset = 0
+
         pygame.display.update()
 
 
 def confirm_delete_user(screen, username):
     clock = pygame.time.Clock()
-    font = pygame.font.SysFont("Arial", 30, bold=True)
+    font = get_sys_font("Arial", 30, bold=True)
     running = True
 
     yes_btn = pygame.Rect(SCREEN_WIDTH // 2 - 130, SCREEN_HEIGHT // 2 + 10, 100, 40)
@@ -285,8 +323,12 @@ def confirm_delete_user(screen, username):
 
             elif event.type == pygame.MOUSEBUTTONDOWN and event.button == 1:
                 if yes_btn.collidepoint(mouse_pos):
-                    from db import delete_user_by_username
-                    delete_user_by_username(username)
+                    if not delete_user_by_username(username):
+                        error_text = font.render(f"Could not delete '{username}'", True, (200, 0, 0))
+                        screen.blit(error_text, (confirm_box.centerx - error_text.get_width() // 2,
+                                                 confirm_box.bottom + 20))
+                        pygame.display.flip()
+                        pygame.time.wait(1500)
                     return
                 elif no_btn.collidepoint(mouse_pos):
                     return
@@ -302,8 +344,7 @@ def main_menu(user_id=None, username="Guest", is_admin=False):
     font = get_font(30)
 
     while True:
-        BG = pygame.image.load("assets/Background.png")
-        BG = pygame.transform.scale(BG, (SCREEN_WIDTH, SCREEN_HEIGHT))
+        BG = load_scaled("assets/Background.png", (SCREEN_WIDTH, SCREEN_HEIGHT))
         screen.blit(BG, (0, 0))
 
         mouse_pos = pygame.mouse.get_pos()
@@ -317,7 +358,7 @@ def main_menu(user_id=None, username="Guest", is_admin=False):
         screen.blit(hi_text, hi_rect)
 
         self_driving_button = Button(
-            image=pygame.image.load("assets/Simulate.png"),
+            image=load_image("assets/Simulate.png"),
             pos=(SCREEN_WIDTH//2 - 200, SCREEN_HEIGHT//2 - 100),
             text_input="Self Driving Mode",
             font=get_font(18),
@@ -325,7 +366,7 @@ def main_menu(user_id=None, username="Guest", is_admin=False):
             hovering_color="White"
         )
         manual_button = Button(
-            image=pygame.image.load("assets/Simulate.png"),
+            image=load_image("assets/Simulate.png"),
             pos=(SCREEN_WIDTH//2 + 200, SCREEN_HEIGHT//2 - 100),
             text_input="Manual Driving Mode",
             font=get_font(18),
@@ -334,7 +375,7 @@ def main_menu(user_id=None, username="Guest", is_admin=False):
         )
         if is_admin:
             map_editor_button = Button(
-                image=pygame.image.load("assets/Simulate.png"),
+                image=load_image("assets/Simulate.png"),
                 pos=(SCREEN_WIDTH // 2 + 200, SCREEN_HEIGHT // 2 + 50),  # same y, right of Race Mode
                 text_input="Map Editor",
                 font=get_font(18),
@@ -350,7 +391,7 @@ def main_menu(user_id=None, username="Guest", is_admin=False):
             race_button_x += 200  # Shift right by 100 pixels for normal users
 
         race_button = Button(
-            image=pygame.image.load("assets/Simulate.png"),
+            image=load_image("assets/Simulate.png"),
             pos=(race_button_x, race_button_y),
             text_input="Race Mode",
             font=get_font(18),
@@ -366,7 +407,7 @@ def main_menu(user_id=None, username="Guest", is_admin=False):
             quit_button_x -= 200  # Move 100 pixels more to the left for Admin users
 
         quit_button = Button(
-            image=pygame.image.load("assets/Quit.png"),
+            image=load_image("assets/Quit.png"),
             pos=(quit_button_x, quit_button_y),
             text_input="QUIT",
             font=get_font(18),
@@ -376,7 +417,7 @@ def main_menu(user_id=None, username="Guest", is_admin=False):
 
         if is_admin:
             users_button = Button(
-                image=pygame.image.load("assets/Simulate.png"),
+                image=load_image("assets/Simulate.png"),
                 pos=(SCREEN_WIDTH // 2 + 200, SCREEN_HEIGHT // 2 + 190),  # beside Quit button
                 text_input="Users",
                 font=get_font(18),
@@ -455,8 +496,7 @@ def main():
     pygame.display.set_caption("Self Driving Car Simulator")
     font = get_font(30)
 
-    background = pygame.image.load("assets/login.png").convert()
-    background = pygame.transform.scale(background, (SCREEN_WIDTH, SCREEN_HEIGHT))
+    background = load_scaled("assets/login.png", (SCREEN_WIDTH, SCREEN_HEIGHT), convert="opaque")
     bg_x, bg_y = 0, 0
 
     splash_screen(screen, font)
@@ -1,26 +1,30 @@
-from db import init_db, insert_score
+from db import init_db, queue_score, flush_scores, scores_pending
 import pygame
 import sys
 import os
 import argparse
 from car import Car, SCREEN_WIDTH, SCREEN_HEIGHT
 from utils import (
-    load_map_metadata,
     select_map,
     dropdown_map_selection,
     drag_and_drop_starting_position,
-    LightGreen, TRACK_WIDTH,
+    LightGreen, TRACK_WIDTH, PagedRows,
 )
 from changecar import change_car, get_car_images, car_scales
-from db import get_top_scores, get_user_map_stats
+from assets import load_scaled, get_sys_font
+from mapbundle import load_map_bundle
+from timestep import FixedTimestep, SIM_HZ, RENDER_FPS, car_pose, blend_pose
+from db import get_leaderboard_page, get_user_rank, get_user_map_stats_page
 
 
 car_images = get_car_images()
 car_index = 0
 
 def save_score(user_id, map_name, time_taken, collisions, checkpoints):
+    # written by db's background thread so the finish frame doesn't wait on the disk
     if user_id:
-        insert_score(user_id, map_name, time_taken, collisions, checkpoints)
+        queue_score(user_id, map_name, time_taken, collisions, checkpoints)
+
 
 def main(map_path=None, respawn_pos=None, user_id=None, username="Guest", is_admin=False):
     init_db()
@@ -32,12 +36,11 @@ def main(map_path=None, respawn_pos=None, user_id=None, username="Guest", is_adm
     admin_status = "Admin" if is_admin else "Not Admin"
     pygame.display.set_caption(f"Manual Car Control | User: {username} | {admin_status}")
 
-    background = pygame.image.load("assets/login.png").convert()
-    background = pygame.transform.scale(background, (SCREEN_WIDTH, SCREEN_HEIGHT))
+    background = load_scaled("assets/login.png", (SCREEN_WIDTH, SCREEN_HEIGHT), convert="opaque")
     bg_x, bg_y = 0, 0
 
     clock = pygame.time.Clock()
-    info_font = pygame.font.SysFont("Arial", 30)
+    info_font = get_sys_font("Arial", 30)
 
     if map_path:
         global_map_path = map_path
@@ -48,16 +51,14 @@ def main(map_path=None, respawn_pos=None, user_id=None, username="Guest", is_adm
         global_map_path = args.map_path if args.map_path else select_map(screen, info_font)
 
     display_map = pygame.image.load(global_map_path).convert_alpha()
-    collision_map = display_map.copy()
-    collision_map.set_colorkey(LightGreen)
-    collision_mask = pygame.mask.from_surface(collision_map)
-    metadata = load_map_metadata(global_map_path)
+    bundle = load_map_bundle(global_map_path)
+    collision_mask = bundle.collision_mask
+    metadata = bundle.metadata
     finish_point = metadata["finish"] if metadata and "finish" in metadata else None
 
     car_image_name = car_images[car_index]
     car_image_path = os.path.join("cars", car_image_name)
-    surface = pygame.image.load(car_image_path).convert_alpha()
-    surface = pygame.transform.scale(surface, car_scales.get(car_image_name, (75, 75)))
+    surface = load_scaled(car_image_path, car_scales.get(car_image_name, (75, 75)), convert="alpha")
     selected_surface = surface
 
     drag_car = Car(initial_pos=[SCREEN_WIDTH // 2, SCREEN_HEIGHT // 2], surface=selected_surface)
@@ -80,7 +81,10 @@ def main(map_path=None, respawn_pos=None, user_id=None, username="Guest", is_adm
     show_retry_button = False
     show_finish_message = False
     finish_msg_surface = None
-    start_time = pygame.time.get_ticks()
+    # lap time is counted in physics ticks, so it is the same on a fast or a slow machine
+    lap_ticks = 0
+    timestep = FixedTimestep(SIM_HZ)
+    previous_pose = None
 
     button_width, button_height = 160, 40
     spacing, top_margin = 20, 20
@@ -101,14 +105,51 @@ def main(map_path=None, respawn_pos=None, user_id=None, username="Guest", is_adm
     show_leaderboard_dropdown = False
     show_leaderboard = False
     leaderboard_mode = "complete"  # or "personal"
-    personal_scores = get_user_map_stats(user_id) if user_id else []
-
-    leaderboard_data = get_top_scores(limit=100)
-    if user_id:
-        personal_scores = get_user_map_stats(user_id)
+    # both tables are read from the db a page at a time as they are scrolled
+    leaderboard_rows = PagedRows(
+        lambda last: get_leaderboard_page(after=last["cursor"] if last else None),
+        lambda first: get_leaderboard_page(before=first["cursor"]),
+    )
+    personal_rows = PagedRows(
+        lambda last: get_user_map_stats_page(user_id, last["map_name"] if last else None) if user_id else []
+    )
+    own_rank = None
+    own_rank_stale = True
+    # set when a score is queued; the leaderboards reload once the writer has committed it
+    refresh_when_written = False
 
     scroll_offset = 0
 
+    def get_own_rank():
+        # read lazily, so recording a score doesn't wait for the writer to catch up
+        nonlocal own_rank, own_rank_stale
+        if own_rank_stale:
+            own_rank = get_user_rank(user_id) if user_id else None
+            own_rank_stale = False
+        return own_rank
+
+    def shown_rows():
+        return leaderboard_rows if leaderboard_mode == "complete" else personal_rows
+
+    def scroll_leaderboard(step):
+        nonlocal scroll_offset
+        rows = shown_rows()
+        if step < 0 and scroll_offset == 0:
+            scroll_offset += rows.load_previous()
+        scroll_offset = max(scroll_offset + step, 0)
+        rows.window(scroll_offset, 5)
+        scroll_offset = min(scroll_offset, max(0, len(rows.rows) - 5))
+
+    def jump_to_own_rank():
+        # start the list at the user's own row, with the rows above it loaded on demand
+        nonlocal scroll_offset
+        own_row = get_own_rank()
+        if own_row is None:
+            return
+        leaderboard_rows.reset([own_row], at_start=own_row["rank"] == 1)
+        scroll_offset = max(leaderboard_rows.load_previous() - 2, 0)
+        leaderboard_rows.window(scroll_offset, 5)
+
     def draw_button(rect, text, hover=False):
         color = (255, 255, 255) if hover else (200, 200, 200)
         pygame.draw.rect(screen, color, rect, border_radius=5)
@@ -120,7 +161,7 @@ def main(map_path=None, respawn_pos=None, user_id=None, username="Guest", is_adm
         color = (200, 0, 0) if hover else (150, 0, 0)
         pygame.draw.rect(screen, color, rect, border_radius=5)
         pygame.draw.rect(screen, (0, 0, 0), rect, 2, border_radius=5)
-        x_font = pygame.font.SysFont("Arial", 28, bold=True)
+        x_font = get_sys_font("Arial", 28, bold=True)
         label = x_font.render("X", True, (255, 255, 255))
         screen.blit(label, label.get_rect(center=rect.center))
 
@@ -154,6 +195,12 @@ def main(map_path=None, respawn_pos=None, user_id=None, username="Guest", is_adm
         title = info_font.render("Leaderboard", True, (0, 0, 0))
         screen.blit(title, (box.centerx - title.get_width() // 2, box.y + 10))
 
+        # Where the player stands, however far down that is (End jumps there, Home back to the top)
+        own_row = get_own_rank()
+        if own_row:
+            own_text = info_font.render(f"You: #{own_row['rank']}", True, (0, 102, 204))
+            screen.blit(own_text, (box.x + 20, box.y + 10))
+
         # Table headers
         headers = ["Rank", "Name", "Maps", "Time"]
         col_widths = [80, 200, 100, 100]
@@ -285,31 +332,22 @@ def main(map_path=None, respawn_pos=None, user_id=None, username="Guest", is_adm
 
             # Handle scrolling with keyboard arrows
             if event.type == pygame.KEYDOWN and show_leaderboard:
-                if leaderboard_mode == "complete":
-                    data_length = len(leaderboard_data)
-                elif leaderboard_mode == "personal":
-                    data_length = len(personal_scores)
-                else:
-                    data_length = 0
-
                 if event.key == pygame.K_UP:
-                    scroll_offset = max(scroll_offset - 1, 0)
+                    scroll_leaderboard(-1)
                 elif event.key == pygame.K_DOWN:
-                    scroll_offset = min(scroll_offset + 1, max(0, data_length - 5))
+                    scroll_leaderboard(1)
+                elif event.key == pygame.K_HOME:
+                    shown_rows().reset()
+                    scroll_offset = 0
+                elif event.key == pygame.K_END and leaderboard_mode == "complete":
+                    jump_to_own_rank()
 
             # Handle scrolling with mouse wheel
             if event.type == pygame.MOUSEWHEEL and show_leaderboard:
-                if leaderboard_mode == "complete":
-                    data_length = len(leaderboard_data)
-                elif leaderboard_mode == "personal":
-                    data_length = len(personal_scores)
-                else:
-                    data_length = 0
-
                 if event.y > 0:  # Scrolling up
-                    scroll_offset = max(scroll_offset - 1, 0)
+                    scroll_leaderboard(-1)
                 elif event.y < 0:  # Scrolling down
-                    scroll_offset = min(scroll_offset + 1, max(0, data_length - 5))
+                    scroll_leaderboard(1)
 
             # Handle button clicks
             if event.type == pygame.MOUSEBUTTONDOWN:
@@ -319,10 +357,9 @@ def main(map_path=None, respawn_pos=None, user_id=None, username="Guest", is_adm
                 if show_leaderboard:
                     if leaderboard_mode == "complete":
                         box_width = 600
-                        rows_visible = min(5, len(leaderboard_data))
                     elif leaderboard_mode == "personal":
                         box_width = 700
-                        rows_visible = min(5, len(personal_scores))
+                    rows_visible = min(5, len(shown_rows().rows))
                     spacing_y = 30
                     header_height = 90
                     box_height = header_height + rows_visible * spacing_y + 20
@@ -341,6 +378,7 @@ def main(map_path=None, respawn_pos=None, user_id=None, username="Guest", is_adm
                     no_rect = pygame.Rect(SCREEN_WIDTH // 2 + 30, SCREEN_HEIGHT // 2 + 10, 100, 40)
 
                     if yes_rect.collidepoint(mx, my):
+                        flush_scores()
                         pygame.quit()
                         os.system("python main.py")
                         return
@@ -367,10 +405,9 @@ def main(map_path=None, respawn_pos=None, user_id=None, username="Guest", is_adm
                         # Reload map
                         global_map_path = new_map
                         display_map = pygame.image.load(global_map_path).convert_alpha()
-                        collision_map = display_map.copy()
-                        collision_map.set_colorkey(LightGreen)
-                        collision_mask = pygame.mask.from_surface(collision_map)
-                        metadata = load_map_metadata(global_map_path)
+                        bundle = load_map_bundle(global_map_path)
+                        collision_mask = bundle.collision_mask
+                        metadata = bundle.metadata
                         finish_point = metadata["finish"] if metadata and "finish" in metadata else None
                         drag_car = Car(initial_pos=[SCREEN_WIDTH // 2, SCREEN_HEIGHT // 2], surface=selected_surface)
                         starting_position = drag_and_drop_starting_position(screen, info_font, collision_mask,
@@ -385,7 +422,9 @@ def main(map_path=None, respawn_pos=None, user_id=None, username="Guest", is_adm
                         show_retry_button = False
                         show_finish_message = False
                         finish_msg_surface = None
-                        start_time = pygame.time.get_ticks()
+                        lap_ticks = 0
+                        previous_pose = None
+                        timestep.reset()
 
                 elif quit_btn.collidepoint(mx, my):
                     pygame.quit()
@@ -399,7 +438,8 @@ def main(map_path=None, respawn_pos=None, user_id=None, username="Guest", is_adm
                     selected_surface = car.surface
                     angular_velocity = 0.0
                     collision_count = 0
-                    start_time = pygame.time.get_ticks()
+                    lap_ticks = 0
+                    previous_pose = None
 
                 elif add_checkpoint_btn.collidepoint(mx, my):
                     current_checkpoint = car.pos.copy()
@@ -409,7 +449,8 @@ def main(map_path=None, respawn_pos=None, user_id=None, username="Guest", is_adm
                     car = Car(initial_pos=initial_dragged_position.copy(), surface=selected_surface)
                     car.update(display_map, collision_mask)
                     current_checkpoint = initial_dragged_position.copy()
-                    start_time = pygame.time.get_ticks()
+                    lap_ticks = 0
+                    previous_pose = None
                     collision_count = 0
                     checkpoint_used_count = 0
                     car_finished = False
@@ -436,35 +477,51 @@ def main(map_path=None, respawn_pos=None, user_id=None, username="Guest", is_adm
                     for rect, label in dropdown_rects:
                         if rect.collidepoint(mx, my):
                             leaderboard_mode = label.lower()
+                            shown_rows().reset()
                             scroll_offset = 0  # Reset scroll
                             show_leaderboard = True
                             show_leaderboard_dropdown = False
 
-        if not car_finished:
-            keys = pygame.key.get_pressed()
-            if keys[pygame.K_w]:
-                car.speed = min(car.speed + 0.2, 15)
-            elif keys[pygame.K_s]:
-                car.speed = max(car.speed - 0.2, -10)
-            else:
-                car.speed -= 0.01 if car.speed > 0 else -0.01 if car.speed < 0 else 0
-
-            if keys[pygame.K_a]:
-                angular_velocity += 0.2
-            elif keys[pygame.K_d]:
-                angular_velocity -= 0.2
-            else:
-                angular_velocity = max(angular_velocity - 0.1, 0) if angular_velocity > 0 else min(
-                    angular_velocity + 0.1, 0)
+        finish_rect = None
+        if finish_point:
+            finish_rect = pygame.Rect(finish_point[0] - TRACK_WIDTH // 2, finish_point[1] - TRACK_WIDTH // 2,
+                                      TRACK_WIDTH, TRACK_WIDTH)
 
-            angular_velocity = max(-5, min(5, angular_velocity))
-            car.angle += angular_velocity
+        # as many fixed physics ticks as the time since the last frame holds, with the keys held now
+        keys = pygame.key.get_pressed()
+        for _ in range(timestep.advance()):
+            if not car_finished:
+                if keys[pygame.K_w]:
+                    car.speed = min(car.speed + 0.2, 15)
+                elif keys[pygame.K_s]:
+                    car.speed = max(car.speed - 0.2, -10)
+                else:
+                    car.speed -= 0.01 if car.speed > 0 else -0.01 if car.speed < 0 else 0
 
-        car.update(display_map, collision_mask)
-        offset_x = car.center[0] - SCREEN_WIDTH // 2
-        offset_y = car.center[1] - SCREEN_HEIGHT // 2
+                if keys[pygame.K_a]:
+                    angular_velocity += 0.2
+                elif keys[pygame.K_d]:
+                    angular_velocity -= 0.2
+                else:
+                    angular_velocity = max(angular_velocity - 0.1, 0) if angular_velocity > 0 else min(
+                        angular_velocity + 0.1, 0)
+
+                angular_velocity = max(-5, min(5, angular_velocity))
+                car.angle += angular_velocity
+                lap_ticks += 1
+
+            previous_pose = car_pose(car)
+            car.update(display_map, collision_mask)
+            # a crash or the finish line ends the frame's ticks; both are handled below
+            if not car.get_alive() or (finish_rect and not car_finished and finish_rect.collidepoint(car.center)):
+                break
+
+        # draw the car (and follow it) between its last two ticks
+        pose = blend_pose(previous_pose, car_pose(car), timestep.alpha)
+        offset_x = int(pose[0]) - SCREEN_WIDTH // 2
+        offset_y = int(pose[1]) - SCREEN_HEIGHT // 2
         screen.blit(display_map, (0, 0), pygame.Rect(offset_x, offset_y, SCREEN_WIDTH, SCREEN_HEIGHT))
-        car.draw(screen, info_font, offset=(offset_x, offset_y), draw_radars=False)
+        car.draw(screen, info_font, offset=(offset_x, offset_y), draw_radars=False, pose=pose)
 
 
         if not car.get_alive():
@@ -479,16 +536,18 @@ def main(map_path=None, respawn_pos=None, user_id=None, username="Guest", is_adm
                 car.angle = 0
                 angular_velocity = 0.0
                 car.update(display_map, collision_mask)
+                # the restart pause costs a second of lap time, as it did when laps were timed by the clock
+                lap_ticks += SIM_HZ
+                previous_pose = None
+                timestep.reset()
             else:
                 car.speed = 0
                 angular_velocity = 0
 
-        if finish_point:
-            finish_rect = pygame.Rect(finish_point[0] - TRACK_WIDTH // 2, finish_point[1] - TRACK_WIDTH // 2,
-                                      TRACK_WIDTH, TRACK_WIDTH)
+        if finish_rect:
             pygame.draw.rect(screen, (0, 0, 255), finish_rect.move(-offset_x, -offset_y), 2)
             if not car_finished and finish_rect.collidepoint(car.center):
-                total_time = (pygame.time.get_ticks() - start_time) / 1000.0
+                total_time = lap_ticks / SIM_HZ
                 car_finished = True
                 car.speed = 0
                 angular_velocity = 0
@@ -497,14 +556,20 @@ def main(map_path=None, respawn_pos=None, user_id=None, username="Guest", is_adm
                 print(">>> Saving score for user_id:", user_id)
                 save_score(user_id, global_map_path, total_time, collision_count, checkpoint_used_count)
 
-                # Refresh leaderboards
-                leaderboard_data = get_top_scores(limit=100)
-                if user_id:
-                    personal_scores = get_user_map_stats(user_id)  # ⭐ ADD THIS ⭐
+                # Refresh leaderboards once the score is in (see below)
+                refresh_when_written = True
 
                 msg = f"Finished in {total_time:.2f}s | Collisions: {collision_count} | Checkpoints: {checkpoint_used_count}"
                 finish_msg_surface = info_font.render(msg, True, (0, 0, 255))
 
+        # the tables keep showing what they had until the writer thread is done, never waiting on it
+        if refresh_when_written and not scores_pending():
+            leaderboard_rows.reset()
+            personal_rows.reset()
+            scroll_offset = 0
+            own_rank_stale = True
+            refresh_when_written = False
+
         draw_button(main_menu_btn, "Main Menu", main_menu_btn.collidepoint(*mouse_pos))
         draw_button(modes_btn, "Modes", modes_btn.collidepoint(*mouse_pos))
         draw_button(map_btn, "Map", map_btn.collidepoint(*mouse_pos))
@@ -560,13 +625,12 @@ def main(map_path=None, respawn_pos=None, user_id=None, username="Guest", is_adm
 
         if show_leaderboard:
             if leaderboard_mode == "complete":
-                draw_leaderboard(screen, leaderboard_data, scroll_offset)
+                draw_leaderboard(screen, leaderboard_rows.window(scroll_offset, 5), scroll_offset)
             elif leaderboard_mode == "personal":
-                personal_scores = sorted(personal_scores, key=lambda x: x["map_name"])  # ⭐ Sort here
-                draw_personal_leaderboard(screen, personal_scores, scroll_offset)
+                draw_personal_leaderboard(screen, personal_rows.window(scroll_offset, 5), scroll_offset)
 
         pygame.display.flip()
-        clock.tick(60)
+        clock.tick(RENDER_FPS)
 
     pygame.quit()
 
@@ -4,8 +4,9 @@ import math
 import json
 from pygame.locals import *
 from PIL import Image
+import assets
 def get_font(size):
-    return pygame.font.Font("assets/font.ttf", size)
+    return assets.get_font(size)
 
 def draw_button(screen, rect, text, font, hover=False):
     color = (255, 255, 255) if hover else (200, 200, 200)
@@ -212,6 +213,7 @@ def save_map(curve, left_trees, right_trees):
     file_name = "map.png" if next_number == 0 else f"map{next_number}.png"
     file_path = os.path.join(maps_dir, file_name)
     img.save(file_path)
+    assets.forget(file_path)
 
     print(f"✅ Map image saved at: {file_path}")
 
@@ -0,0 +1,225 @@
+import os
+import sys
+import json
+import shutil
+import hashlib
+import argparse
+import tempfile
+from collections import OrderedDict
+import numpy as np
+import pygame
+from trackfield import MAX_CACHED_MAPS, mask_to_array, build_distance_field, remember_map
+
+BUNDLE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "mapcache")
+METADATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "startfinish")
+
+# bump when the files inside a bundle change shape; older bundles are rebuilt
+BUNDLE_VERSION = 1
+
+# same size as the previews drawn by select_map and dropdown_map_selection
+PREVIEW_SIZE = (300, 200)
+
+# bundles already opened in this process, by absolute map path
+_bundles = {}
+# collision masks of the most recently used bundles, by content hash
+_masks = OrderedDict()
+
+
+def _file_stamp(path):
+    # cheap change detection: (modified time, size), or None when the file is missing
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return [st.st_mtime_ns, st.st_size]
+
+
+def _hash_file(path):
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _metadata_path(map_path):
+    base = os.path.splitext(os.path.basename(map_path))[0]
+    return os.path.join(METADATA_DIR, base + "_metadata.json")
+
+
+def read_metadata(map_path):
+    # the map's startfinish json straight from disk, or None
+    path = _metadata_path(map_path)
+    if os.path.exists(path):
+        with open(path, "r") as f:
+            return json.load(f)
+    return None
+
+
+def _write_json(path, data):
+    # write next to the target first so readers never see half a file
+    fd, tmp = tempfile.mkstemp(suffix=".json", dir=os.path.dirname(path))
+    with os.fdopen(fd, "w") as f:
+        json.dump(data, f)
+    os.replace(tmp, path)
+
+
+def grid_to_mask(grid: np.ndarray) -> pygame.mask.Mask:
+    # inverse of trackfield.mask_to_array: (width, height) bools back to a pygame mask
+    surface = pygame.surfarray.make_surface(grid.astype(np.uint8))
+    surface.set_colorkey((0, 0, 0))
+    return pygame.mask.from_surface(surface)
+
+
+def _write_field(path, grid):
+    fd, tmp = tempfile.mkstemp(suffix=".npy", dir=os.path.dirname(path))
+    with os.fdopen(fd, "wb") as f:
+        np.save(f, build_distance_field(grid))
+    os.replace(tmp, path)
+
+
+def compile_map(map_path: str, digest: str = None, with_field: bool = True) -> str:
+    # build the bundle for one map image and return its directory
+    from utils import LightGreen
+    map_path = os.path.abspath(map_path)
+    digest = digest or _hash_file(map_path)
+    base = os.path.splitext(os.path.basename(map_path))[0]
+    bundle_dir = os.path.join(BUNDLE_DIR, f"{base}-{digest[:16]}")
+
+    # same mask the modes build: the map with its LightGreen background keyed out
+    collision_map = pygame.image.load(map_path)
+    collision_map.set_colorkey(LightGreen)
+    grid = mask_to_array(pygame.mask.from_surface(collision_map))
+
+    os.makedirs(BUNDLE_DIR, exist_ok=True)
+    work_dir = tempfile.mkdtemp(prefix=f".{base}-", dir=BUNDLE_DIR)
+    try:
+        # one bit per pixel, packed down each column
+        np.save(os.path.join(work_dir, "track.npy"), np.packbits(grid, axis=1))
+        if with_field:
+            _write_field(os.path.join(work_dir, "field.npy"), grid)
+        preview = pygame.transform.scale(pygame.image.load(map_path), PREVIEW_SIZE)
+        pygame.image.save(preview, os.path.join(work_dir, "preview.png"))
+        manifest = {
+            "version": BUNDLE_VERSION,
+            "map": os.path.basename(map_path),
+            "hash": digest,
+            "size": list(grid.shape),
+            "metadata": read_metadata(map_path),
+            "metadata_stamp": _file_stamp(_metadata_path(map_path)),
+        }
+        _write_json(os.path.join(work_dir, "manifest.json"), manifest)
+
+        # swap the finished bundle in; another process may have won the race, which is fine
+        shutil.rmtree(bundle_dir, ignore_errors=True)
+        try:
+            os.rename(work_dir, bundle_dir)
+        except OSError:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    except BaseException:
+        shutil.rmtree(work_dir, ignore_errors=True)
+        raise
+
+    # bundles of older versions of this map are stale now
+    for name in os.listdir(BUNDLE_DIR):
+        if name.startswith(base + "-") and name != os.path.basename(bundle_dir) and len(name) == len(base) + 17:
+            shutil.rmtree(os.path.join(BUNDLE_DIR, name), ignore_errors=True)
+    return bundle_dir
+
+
+class MapBundle:
+    # a compiled map: collision bits, distance field, preview and start/finish metadata.
+    # the arrays are only read when first used. the distance field stays memory-mapped; the
+    # packed track is read whole, since the collision mask unpacks all of it anyway
+    def __init__(self, map_path: str, bundle_dir: str, stamp) -> None:
+        self.map_path = map_path
+        self.bundle_dir = bundle_dir
+        self.stamp = stamp
+        with open(os.path.join(bundle_dir, "manifest.json"), "r") as f:
+            self.manifest = json.load(f)
+        self.digest = self.manifest["hash"]
+        self.size = tuple(self.manifest["size"])
+        self.preview_path = os.path.join(bundle_dir, "preview.png")
+
+    @property
+    def metadata(self):
+        return self.manifest["metadata"]
+
+    def refresh_metadata(self) -> None:
+        # the editor rewrites startfinish files on its own, so check them on every load
+        stamp = _file_stamp(_metadata_path(self.map_path))
+        if stamp != self.manifest["metadata_stamp"]:
+            self.manifest["metadata"] = read_metadata(self.map_path)
+            self.manifest["metadata_stamp"] = stamp
+            _write_json(os.path.join(self.bundle_dir, "manifest.json"), self.manifest)
+
+    @property
+    def packed_track(self) -> np.ndarray:
+        return np.load(os.path.join(self.bundle_dir, "track.npy"))
+
+    @property
+    def track_grid(self) -> np.ndarray:
+        return np.unpackbits(self.packed_track, axis=1, count=self.size[1]).astype(bool)
+
+    @property
+    def distance_field(self) -> np.ndarray:
+        path = os.path.join(self.bundle_dir, "field.npy")
+        if not os.path.exists(path):
+            _write_field(path, self.track_grid)
+        return np.load(path, mmap_mode="r")
+
+    @property
+    def collision_mask(self) -> pygame.mask.Mask:
+        # one mask object per map, so the trackfield caches keyed on it keep hitting
+        mask = _masks.get(self.digest)
+        if mask is None:
+            packed = self.packed_track
+            grid = np.unpackbits(packed, axis=1, count=self.size[1]).astype(bool)
+            mask = grid_to_mask(grid)
+            remember_map(mask, grid, self.distance_field, packed)
+            if len(_masks) >= MAX_CACHED_MAPS:
+                _masks.popitem(last=False)
+            _masks[self.digest] = mask
+        else:
+            _masks.move_to_end(self.digest)
+        return mask
+
+
+def load_map_bundle(map_path: str) -> MapBundle:
+    # open the bundle for a map image, compiling it first if it is missing or stale
+    map_path = os.path.abspath(map_path)
+    stamp = _file_stamp(map_path)
+    bundle = _bundles.get(map_path)
+    if bundle is None or bundle.stamp != stamp or not os.path.isdir(bundle.bundle_dir):
+        digest = _hash_file(map_path)
+        base = os.path.splitext(os.path.basename(map_path))[0]
+        bundle_dir = os.path.join(BUNDLE_DIR, f"{base}-{digest[:16]}")
+        try:
+            bundle = MapBundle(map_path, bundle_dir, stamp)
+            if bundle.manifest.get("version") != BUNDLE_VERSION or bundle.digest != digest:
+                bundle = None
+        except (OSError, ValueError, KeyError):
+            bundle = None
+        if bundle is None:
+            bundle = MapBundle(map_path, compile_map(map_path, digest), stamp)
+        _bundles[map_path] = bundle
+    bundle.refresh_metadata()
+    return bundle
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compile map images into cached bundles")
+    parser.add_argument('maps', nargs='*', help="Map images (default: every map in maps/)")
+    parser.add_argument('--no-field', action='store_true', help="Skip the radar distance field")
+    args = parser.parse_args()
+
+    maps = args.maps or [os.path.join("maps", name) for name in sorted(os.listdir("maps")) if name.endswith(".png")]
+    for map_path in maps:
+        if not os.path.exists(map_path):
+            print(f"Error: {map_path} not found")
+            sys.exit(1)
+        print(f"{map_path} -> {compile_map(map_path, with_field=not args.no_field)}")
+
+
+if __name__ == "__main__":
+    main()
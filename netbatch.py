@@ -0,0 +1,131 @@
+import numpy as np
+from neat import activations
+from neat.graphs import feed_forward_layers
+
+
+class CompiledNetwork:
+    # a genome's feed-forward network flattened into layers of
+    # (value column, activation, bias, response, [(source column, weight), ...]).
+    # inputs take the first columns, outputs the next ones, hidden nodes follow in evaluation order
+    def __init__(self, genome, config) -> None:
+        genome_config = config.genome_config
+        # same connections, layers and link order as neat.nn.FeedForwardNetwork.create
+        connections = [cg.key for cg in genome.connections.values() if cg.enabled]
+        columns = {key: i for i, key in enumerate(genome_config.input_keys + genome_config.output_keys)}
+        self.layers = []
+        for layer in feed_forward_layers(genome_config.input_keys, genome_config.output_keys, connections):
+            nodes = []
+            for node in sorted(layer):
+                ng = genome.nodes[node]
+                if ng.aggregation != "sum":
+                    raise ValueError(f"Node {node} uses '{ng.aggregation}' aggregation; only 'sum' can be batched")
+                columns.setdefault(node, len(columns))
+                links = [(columns[inode], genome.connections[(inode, onode)].weight)
+                         for inode, onode in connections if onode == node]
+                activation = genome_config.activation_defs.get(ng.activation)
+                nodes.append((columns[node], activation, ng.bias, ng.response, links))
+            self.layers.append(nodes)
+        self.num_values = len(columns)
+
+
+def _tanh(z):
+    return np.tanh(np.clip(2.5 * z, -60.0, 60.0))
+
+
+def _sigmoid(z):
+    return 1.0 / (1.0 + np.exp(-np.clip(5.0 * z, -60.0, 60.0)))
+
+
+# array versions of neat's built-in activations. numpy's tanh and exp can differ from math's in the
+# last bit, so outputs match FeedForwardNetwork.activate to rounding (np.allclose), not bit for bit
+ARRAY_ACTIVATIONS = {
+    activations.tanh_activation: _tanh,
+    activations.sigmoid_activation: _sigmoid,
+    activations.relu_activation: lambda z: np.where(z > 0.0, z, 0.0),
+    activations.identity_activation: lambda z: z,
+    activations.clamped_activation: lambda z: np.clip(z, -1.0, 1.0),
+}
+
+
+class NetworkBatch:
+    # compiled networks packed into padded arrays, one row per genome, so a whole
+    # population is evaluated with one matrix product and one activation per layer
+    def __init__(self, networks, num_inputs: int, num_outputs: int) -> None:
+        self.count = len(networks)
+        self.num_inputs = num_inputs
+        self.num_outputs = num_outputs
+        # one extra scratch column that padding nodes write to
+        self.num_values = max([net.num_values for net in networks] + [num_inputs + num_outputs]) + 1
+        scratch = self.num_values - 1
+
+        self.layers = []
+        depth = max([len(net.layers) for net in networks] + [0])
+        for d in range(depth):
+            layer_nodes = [net.layers[d] if d < len(net.layers) else [] for net in networks]
+            width = max(len(nodes) for nodes in layer_nodes)
+
+            column = np.full((self.count, width), scratch, dtype=np.int64)
+            bias = np.zeros((self.count, width))
+            response = np.zeros((self.count, width))
+            # dense weights: weight[row, k, c] is the link from value column c into node k of the row
+            weight = np.zeros((self.count, width, self.num_values))
+            # which nodes use each activation; padding nodes use none and stay 0
+            groups = {}
+            for row, nodes in enumerate(layer_nodes):
+                for k, (node_column, act, node_bias, node_response, node_links) in enumerate(nodes):
+                    column[row, k] = node_column
+                    bias[row, k] = node_bias
+                    response[row, k] = node_response
+                    for link_source, link_weight in node_links:
+                        weight[row, k, link_source] += link_weight
+                    if act not in groups:
+                        groups[act] = np.zeros((self.count, width), dtype=bool)
+                    groups[act][row, k] = True
+            # a layer whose nodes all share one built-in activation is activated as a whole array
+            array_activation = ARRAY_ACTIVATIONS.get(next(iter(groups))) if len(groups) == 1 else None
+            self.layers.append((column, groups, array_activation, bias, response, weight))
+
+    def __len__(self):
+        return self.count
+
+    def activate(self, inputs, rows=None):
+        # inputs has one row per selected genome; returns their outputs the same way
+        if rows is None:
+            rows = np.arange(self.count)
+        values = np.zeros((rows.size, self.num_values))
+        values[:, :self.num_inputs] = inputs
+        line = np.arange(rows.size)[:, None]
+        for column, groups, array_activation, bias, response, weight in self.layers:
+            total = np.matmul(weight[rows], values[:, :, None])[:, :, 0]
+            z = bias[rows] + response[rows] * total
+            if array_activation is not None:
+                result = array_activation(z)
+            else:
+                # mixed activations: each built-in one on its nodes at once, custom ones node by node
+                result = np.zeros(z.shape)
+                for act, nodes in groups.items():
+                    nodes = nodes[rows]
+                    array_act = ARRAY_ACTIVATIONS.get(act)
+                    if array_act is not None:
+                        result[nodes] = array_act(z[nodes])
+                    else:
+                        result[nodes] = [act(v) for v in z[nodes].tolist()]
+            values[line, column[rows]] = result
+        return values[:, self.num_inputs:self.num_inputs + self.num_outputs]
+
+
+class NetworkCache:
+    # compiled networks of one population by genome key. elites carried into the next
+    # generation keep their network; genomes that dropped out are forgotten
+    def __init__(self) -> None:
+        self.networks = {}
+
+    def compile(self, genomes, config) -> NetworkBatch:
+        networks = {}
+        for _, genome in genomes:
+            network = self.networks.get(genome.key)
+            networks[genome.key] = network if network is not None else CompiledNetwork(genome, config)
+        self.networks = networks
+        genome_config = config.genome_config
+        return NetworkBatch([networks[genome.key] for _, genome in genomes],
+                            genome_config.num_inputs, genome_config.num_outputs)
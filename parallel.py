@@ -0,0 +1,78 @@
+import math
+import multiprocessing
+import neat
+from headless import HeadlessWorld, run_generation
+from car import get_radar_backend, set_radar_backend, get_collision_check, set_collision_check
+from netbatch import NetworkCache
+
+# per-worker state, filled in once by _init_worker and kept for every generation
+_world = None
+_config = None
+_networks = None
+
+
+def _init_worker(map_path, config_path, radar_backend, collision_check):
+    global _world, _config, _networks
+    set_radar_backend(radar_backend)
+    set_collision_check(collision_check)
+    _world = HeadlessWorld(map_path)
+    _networks = NetworkCache()
+    _config = neat.config.Config(
+        neat.DefaultGenome, neat.DefaultReproduction,
+        neat.DefaultSpeciesSet, neat.DefaultStagnation,
+        config_path
+    )
+
+
+def _evaluate_shard(task):
+    genomes, start_pos, max_ticks, dt = task
+    ticks, finished = run_generation(genomes, _config, _world, start_pos, max_ticks, _networks, dt)
+    return [genome.fitness for _, genome in genomes], ticks, finished
+
+
+class ParallelEvaluator:
+    # evaluates a generation across a process pool, in the spirit of neat.ParallelEvaluator.
+    # each shard is simulated with the same code as the serial headless run; because a serial
+    # generation stops for everyone when the first car finishes, shards that ran past the
+    # earliest finish are re-simulated up to that tick so fitness matches the serial run exactly
+    def __init__(self, num_workers, map_path, config_path, start_pos, max_ticks, timeout=None, dt=1):
+        self.num_workers = num_workers
+        self.start_pos = start_pos
+        self.max_ticks = max_ticks
+        self.dt = dt
+        self.timeout = timeout
+        self.pool = multiprocessing.Pool(num_workers, initializer=_init_worker,
+                                         initargs=(map_path, config_path, get_radar_backend(), get_collision_check()))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+
+    def _run(self, shards, max_ticks):
+        tasks = [(shard, self.start_pos, max_ticks, self.dt) for shard in shards]
+        return self.pool.map_async(_evaluate_shard, tasks).get(self.timeout)
+
+    def evaluate(self, genomes, config):
+        genomes = list(genomes)
+        size = math.ceil(len(genomes) / self.num_workers)
+        shards = [genomes[i:i + size] for i in range(0, len(genomes), size)]
+        results = self._run(shards, self.max_ticks)
+
+        # the serial run would have stopped at the earliest finish
+        finish_ticks = [ticks for _, ticks, finished in results if finished]
+        if finish_ticks:
+            stop_tick = min(finish_ticks)
+            rerun = [i for i, (_, ticks, _) in enumerate(results) if ticks > stop_tick]
+            if rerun:
+                for i, result in zip(rerun, self._run([shards[i] for i in rerun], stop_tick)):
+                    results[i] = result
+
+        for shard, (fitnesses, _, _) in zip(shards, results):
+            for (_, genome), fitness in zip(shard, fitnesses):
+                genome.fitness = fitness
@@ -2,7 +2,13 @@ import pygame
 import sys
 import os
 import neat
+import numpy as np
 from car import Car, SCREEN_WIDTH, SCREEN_HEIGHT
+from carbatch import CarBatch
+from netbatch import NetworkCache
+from assets import load_scaled, get_sys_font
+from mapbundle import load_map_bundle
+from timestep import FixedTimestep, SIM_HZ, RENDER_FPS, car_pose, blend_pose
 from utils import (
     LightGreen,
     CONSTANT_SPEED,
@@ -16,9 +22,7 @@ from utils import (
 
 def load_map_and_mask(map_path):
     map_surface = pygame.image.load(map_path).convert_alpha()
-    collision_surface = map_surface.copy()
-    collision_surface.set_colorkey(LightGreen)
-    collision_mask = pygame.mask.from_surface(collision_surface)
+    collision_mask = load_map_bundle(map_path).collision_mask
     return map_surface, collision_mask
 
 
@@ -29,16 +33,12 @@ def restart_manual_car(pos):
     return car
 
 
-def run_ai_generation(genomes, config, display_map, collision_mask, start_pos, ai_car_surface):
-    nets = []
-    cars = []
+def run_ai_generation(genomes, config, display_map, collision_mask, start_pos, ai_car_surface, networks):
+    nets = networks.compile(genomes, config)
     for _, genome in genomes:
-        net = neat.nn.FeedForwardNetwork.create(genome, config)
-        nets.append(net)
         genome.fitness = 0
-        cars.append(Car(initial_pos=start_pos.copy(), surface=ai_car_surface))
-    for car in cars:
-        car.update(display_map, collision_mask)
+    cars = CarBatch(len(genomes), start_pos, surface=ai_car_surface)
+    cars.update(collision_mask)
     return nets, cars
 
 
@@ -49,14 +49,11 @@ def race(user_id=None, username="Guest", is_admin=False):
     admin_status = "Admin" if is_admin else "Not Admin"
     pygame.display.set_caption(f"Race: Manual vs Evolving AI | User: {username} | {admin_status}")
 
-    ai_car_surface = pygame.image.load(os.path.join("cars", "car7.png")).convert_alpha()
-    ai_car_surface = pygame.transform.scale(ai_car_surface, (75, 75))
-
-    manual_car_surface = pygame.image.load(os.path.join("cars", "car.png")).convert_alpha()
-    manual_car_surface = pygame.transform.scale(manual_car_surface, (75, 75))
+    ai_car_surface = load_scaled(os.path.join("cars", "car7.png"), (75, 75), convert="alpha")
+    manual_car_surface = load_scaled(os.path.join("cars", "car.png"), (75, 75), convert="alpha")
 
     clock = pygame.time.Clock()
-    info_font = pygame.font.SysFont("Arial", 30)
+    info_font = get_sys_font("Arial", 30)
 
     # Button definitions
     button_width, button_height = 140, 40
@@ -94,6 +91,7 @@ def race(user_id=None, username="Guest", is_admin=False):
     population = neat.Population(config)
     population.add_reporter(neat.StdOutReporter(True))
     population.add_reporter(neat.StatisticsReporter())
+    networks = NetworkCache()
 
     # AI and race state variables
     genomes = []
@@ -105,6 +103,10 @@ def race(user_id=None, username="Guest", is_admin=False):
     final_popup_shown = False
     result_order = []
 
+    # both cars are drawn between their last two physics ticks
+    timestep = FixedTimestep(SIM_HZ)
+    manual_pose = None
+    ai_poses = None
     def draw_button(rect, text, hover=False):
         color = (255, 255, 255) if hover else (200, 200, 200)
         pygame.draw.rect(screen, color, rect, border_radius=5)
@@ -124,16 +126,18 @@ def race(user_id=None, username="Guest", is_admin=False):
         screen.blit(bg_surface, ((SCREEN_WIDTH - bg_width) // 2, 10))
 
     def start_new_generation():
-        nonlocal genomes, nets, cars, best_car_finished, best_index
+        nonlocal genomes, nets, cars, best_car_finished, best_index, ai_poses
         genomes = [(i, genome) for i, genome in enumerate(population.population.values())]
-        nets, cars = run_ai_generation(genomes, config, display_map, collision_mask, start_pos, ai_car_surface)
+        nets, cars = run_ai_generation(genomes, config, display_map, collision_mask, start_pos, ai_car_surface,
+                                       networks)
         best_car_finished = False
         best_index = -1
+        ai_poses = None
 
     start_new_generation()
 
     while True:
-        clock.tick(60)
+        clock.tick(RENDER_FPS)
         screen.fill(LightGreen)
         mouse_pos = pygame.mouse.get_pos()
         yes_btn = pygame.Rect(SCREEN_WIDTH // 2 - 130, SCREEN_HEIGHT // 2 + 10, 100, 40)
@@ -177,6 +181,8 @@ def race(user_id=None, username="Guest", is_admin=False):
                             manual_car = restart_manual_car(start_pos)
                             manual_angular_velocity = 0.0
                             manual_finished = False
+                            manual_pose = None
+                            timestep.reset()
                             first_finisher = None
                             finish_time = None
                             final_popup_shown = False
@@ -207,113 +213,119 @@ def race(user_id=None, username="Guest", is_admin=False):
                                 return  # ❗ Do not use sys.exit()
                         show_modes_dropdown = False
 
-        # Manual car controls
-        if not manual_finished:
-            keys = pygame.key.get_pressed()
-            accel = 0.2
-            friction = 0.01
-            max_speed = 15
-            max_reverse = -10
-            turn_accel = 0.2
-            turn_decel = 0.1
-            max_turn = 5
-
-            if keys[pygame.K_w]:
-                manual_car.speed = min(manual_car.speed + accel, max_speed)
-            elif keys[pygame.K_s]:
-                manual_car.speed = max(manual_car.speed - accel, max_reverse)
-            else:
-                if manual_car.speed > 0:
-                    manual_car.speed -= friction
-                elif manual_car.speed < 0:
-                    manual_car.speed += friction
-
-            if keys[pygame.K_a]:
-                manual_angular_velocity += turn_accel
-            elif keys[pygame.K_d]:
-                manual_angular_velocity -= turn_accel
-            else:
-                manual_angular_velocity = max(manual_angular_velocity - turn_decel,
-                                              0) if manual_angular_velocity > 0 else min(
-                    manual_angular_velocity + turn_decel, 0)
-
-            manual_angular_velocity = max(-max_turn, min(max_turn, manual_angular_velocity))
-            manual_car.angle += manual_angular_velocity
-            manual_car.update(display_map, collision_mask)
-
-            if not manual_car.get_alive():
-                manual_car = restart_manual_car(start_pos)
-                manual_angular_velocity = 0.0
-
-        # AI car logic
-        alive_count = 0
-        best_fitness = float('-inf')
-        for i, car in enumerate(cars):
-            if car.get_alive():
-                radar_data = car.get_data()
-                output = nets[i].activate(radar_data)
-                if not hasattr(car, "angular_velocity"):
-                    car.angular_velocity = 0
-                desired = output[0] * 15
-                car.angular_velocity += 0.1 * (desired - car.angular_velocity)
-                car.angle += car.angular_velocity
-                if not best_car_finished:
-                    car.speed = CONSTANT_SPEED
-                car.update(display_map, collision_mask)
-
-                reward = car.get_reward() + car.distance * 0.05
-                if radar_data[0] > 0.2:
-                    reward += 0.1
-                if abs(car.angular_velocity) < 3:
-                    reward += 0.2
-                genomes[i][1].fitness += reward
-
-                if genomes[i][1].fitness > best_fitness:
-                    best_fitness = genomes[i][1].fitness
-                    best_index = i
-
-                alive_count += 1
-
-        if alive_count == 0:
-            population.run(lambda g, c: None, 1)
-            start_new_generation()
+        finish_rect = None
+        if metadata and "finish" in metadata:
+            fx, fy = metadata["finish"]
+            finish_rect = pygame.Rect(fx - TRACK_WIDTH // 2, fy - TRACK_WIDTH // 2, TRACK_WIDTH, TRACK_WIDTH)
 
-        # Camera positioning
-        offset_x = manual_car.center[0] - SCREEN_WIDTH // 2
-        offset_y = manual_car.center[1] - SCREEN_HEIGHT // 2
+        # as many fixed physics ticks as the time since the last frame holds, with the keys held now
+        keys = pygame.key.get_pressed()
+        for _ in range(timestep.advance()):
+            # Manual car controls
+            if not manual_finished:
+                accel = 0.2
+                friction = 0.01
+                max_speed = 15
+                max_reverse = -10
+                turn_accel = 0.2
+                turn_decel = 0.1
+                max_turn = 5
+
+                if keys[pygame.K_w]:
+                    manual_car.speed = min(manual_car.speed + accel, max_speed)
+                elif keys[pygame.K_s]:
+                    manual_car.speed = max(manual_car.speed - accel, max_reverse)
+                else:
+                    if manual_car.speed > 0:
+                        manual_car.speed -= friction
+                    elif manual_car.speed < 0:
+                        manual_car.speed += friction
+
+                if keys[pygame.K_a]:
+                    manual_angular_velocity += turn_accel
+                elif keys[pygame.K_d]:
+                    manual_angular_velocity -= turn_accel
+                else:
+                    manual_angular_velocity = max(manual_angular_velocity - turn_decel,
+                                                  0) if manual_angular_velocity > 0 else min(
+                        manual_angular_velocity + turn_decel, 0)
+
+                manual_angular_velocity = max(-max_turn, min(max_turn, manual_angular_velocity))
+                manual_car.angle += manual_angular_velocity
+                manual_pose = car_pose(manual_car)
+                manual_car.update(display_map, collision_mask)
+
+                if not manual_car.get_alive():
+                    manual_car = restart_manual_car(start_pos)
+                    manual_angular_velocity = 0.0
+                    manual_pose = None
+
+            # AI car logic
+            ai_poses = cars.poses()
+            rows = np.flatnonzero(cars.alive)
+            alive_count = rows.size
+            if alive_count:
+                radar_data = cars.get_data()
+                output = nets.activate(radar_data[rows], rows)[:, 0]
+                desired = output * 15
+                cars.angular_velocity[rows] += 0.1 * (desired - cars.angular_velocity[rows])
+                cars.angle[rows] += cars.angular_velocity[rows]
+                if not best_car_finished:
+                    cars.speed[rows] = CONSTANT_SPEED
+                cars.update(collision_mask, rows)
+
+                reward = cars.get_rewards()[rows] + cars.distance[rows] * 0.05
+                reward += np.where(radar_data[rows, 0] > 0.2, 0.1, 0.0)
+                reward += np.where(np.abs(cars.angular_velocity[rows]) < 3, 0.2, 0.0)
+                for i, value in zip(rows.tolist(), reward.tolist()):
+                    genomes[i][1].fitness += value
+
+                # first car with the highest fitness this tick leads
+                fitness = np.array([genomes[i][1].fitness for i in rows])
+                best_index = int(rows[np.argmax(fitness)])
+
+            if alive_count == 0:
+                population.run(lambda g, c: None, 1)
+                start_new_generation()
+
+            # Finish line logic, every tick so a fast frame can't carry a car past it
+            if finish_rect:
+                if not manual_finished and finish_rect.collidepoint(manual_car.center):
+                    manual_finished = True
+                    manual_car.speed = 0
+                    manual_pose = None
+                    if "Manual Car" not in result_order:
+                        result_order.append("Manual Car")
+                        if not first_finisher:
+                            first_finisher = "Manual Car"
+                            finish_time = pygame.time.get_ticks()
+
+                best_car = cars[best_index] if best_index != -1 and cars[best_index].get_alive() else None
+                if best_car and not best_car_finished and finish_rect.collidepoint(best_car.center):
+                    best_car_finished = True
+                    best_car.speed = 0
+                    if "AI Car" not in result_order:
+                        result_order.append("AI Car")
+                        if not first_finisher:
+                            first_finisher = "AI Car"
+                            finish_time = pygame.time.get_ticks()
+
+        # Camera positioning, following the manual car between its last two ticks
+        pose = blend_pose(manual_pose, car_pose(manual_car), timestep.alpha)
+        offset_x = int(pose[0]) - SCREEN_WIDTH // 2
+        offset_y = int(pose[1]) - SCREEN_HEIGHT // 2
         screen.blit(display_map, (0, 0), pygame.Rect(offset_x, offset_y, SCREEN_WIDTH, SCREEN_HEIGHT))
 
         # Draw cars
-        manual_car.draw(screen, info_font, offset=(offset_x, offset_y), draw_radars=False)
-        best_car = None
+        manual_car.draw(screen, info_font, offset=(offset_x, offset_y), draw_radars=False, pose=pose)
         if best_index != -1 and cars[best_index].get_alive():
-            best_car = cars[best_index]
-            best_car.draw(screen, info_font, offset=(offset_x, offset_y), draw_radars=False)
+            previous = None if ai_poses is None else ai_poses[best_index]
+            best_pose = blend_pose(previous, cars.poses()[best_index], timestep.alpha)
+            cars[best_index].draw(screen, info_font, offset=(offset_x, offset_y), draw_radars=False, pose=best_pose)
 
-        # Finish line logic
-        if metadata and "finish" in metadata:
-            fx, fy = metadata["finish"]
-            finish_rect = pygame.Rect(fx - TRACK_WIDTH // 2, fy - TRACK_WIDTH // 2, TRACK_WIDTH, TRACK_WIDTH)
+        if finish_rect:
             pygame.draw.rect(screen, (0, 0, 255), finish_rect.move(-offset_x, -offset_y), 2)
 
-            if not manual_finished and finish_rect.collidepoint(manual_car.center):
-                manual_finished = True
-                manual_car.speed = 0
-                if "Manual Car" not in result_order:
-                    result_order.append("Manual Car")
-                    if not first_finisher:
-                        first_finisher = "Manual Car"
-                        finish_time = pygame.time.get_ticks()
-
-            if best_car and not best_car_finished and finish_rect.collidepoint(best_car.center):
-                best_car_finished = True
-                best_car.speed = 0
-                if "AI Car" not in result_order:
-                    result_order.append("AI Car")
-                    if not first_finisher:
-                        first_finisher = "AI Car"
-                        finish_time = pygame.time.get_ticks()
-
         # Race status popups
         if finish_time and not final_popup_shown and pygame.time.get_ticks() - finish_time < 2000:
             show_popup(f"{first_finisher} reached the finish line first!", screen, info_font)
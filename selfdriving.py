@@ -2,38 +2,144 @@ import pygame
 import sys
 import neat
 import os
-from car import Car, SCREEN_WIDTH, SCREEN_HEIGHT
+import numpy as np
+from car import SCREEN_WIDTH, SCREEN_HEIGHT
+from carbatch import CarBatch
+from netbatch import NetworkCache
+from assets import get_sys_font
+from mapbundle import load_map_bundle
+from timestep import FrameScheduler, SPEED_FACTORS, RENDER_FPS, blend_pose
 from utils import (
-    load_map_metadata,
     select_map,
     dropdown_map_selection,
     drag_and_drop_starting_position,
     LightGreen, CONSTANT_SPEED, TRACK_WIDTH
 )
 
+# simulation ticks per second while watching the training at 1x, whatever the display manages to draw
+TRAINING_HZ = 240
+# keys 1 to 4 pick a fast-forward speed directly, the Speed button cycles through them
+SPEED_KEYS = dict(zip((pygame.K_1, pygame.K_2, pygame.K_3, pygame.K_4), SPEED_FACTORS))
 
-def run_auto_mode(genomes, config, user_id=None, username="Guest", is_admin=False):
-    if not hasattr(run_auto_mode, "global_map_path"):
-        run_auto_mode.global_map_path = None
-    if not hasattr(run_auto_mode, "starting_position"):
-        run_auto_mode.starting_position = None
-    if not hasattr(run_auto_mode, "generation"):
-        run_auto_mode.generation = 0
-    if not hasattr(run_auto_mode, "last_gen_crashed"):
-        run_auto_mode.last_gen_crashed = False
-    if not hasattr(run_auto_mode, "switch_mode"):
-        run_auto_mode.switch_mode = None  # 🔥 Add this line
 
-    pygame.init()
-    screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
-
-    admin_status = "Admin" if is_admin else "Not Admin"
-    pygame.display.set_caption(f"Self-Driving Mode | User: {username} | {admin_status}")
-
-    clock = pygame.time.Clock()
-    info_font = pygame.font.SysFont("Arial", 30)
-
-    if run_auto_mode.last_gen_crashed:
+def create_generation(genomes, config, starting_position, collision_mask, networks=None):
+    # networks is the population's NetworkCache; without one every genome is compiled afresh
+    if networks is None:
+        networks = NetworkCache()
+    nets = networks.compile(genomes, config)
+    for _, genome in genomes:
+        genome.fitness = 0
+    cars = CarBatch(len(genomes), starting_position)
+    cars.update(collision_mask)
+    return nets, cars
+
+
+def step_generation(cars, nets, genomes, collision_mask, dt=1):
+    # advance every live car by dt ticks and add its fitness; returns how many cars were stepped
+    rows = np.flatnonzero(cars.alive)
+    if rows.size == 0:
+        return 0
+    radar_data = cars.get_data()
+    output = nets.activate(radar_data[rows], rows)[:, 0]
+
+    desired = output * 15
+    cars.angular_velocity[rows] += min(0.1 * dt, 1.0) * (desired - cars.angular_velocity[rows])
+    cars.angle[rows] += cars.angular_velocity[rows] * dt
+    cars.speed[rows] = CONSTANT_SPEED
+    cars.update(collision_mask, rows, dt)
+
+    fitness = cars.get_rewards()[rows] + cars.distance[rows] * 0.1
+    fitness += np.where(radar_data[rows, 0] > 50, 0.1, 0.0)
+    fitness += np.where(np.abs(cars.angular_velocity[rows]) < 3, 0.2, 0.0)
+    # fitness is earned per tick, so a longer step earns more of it
+    fitness *= dt
+    for i, value in zip(rows.tolist(), fitness.tolist()):
+        genomes[i][1].fitness += value
+    return rows.size
+
+
+def get_finish_rect(metadata):
+    if metadata and "finish" in metadata:
+        fx, fy = metadata["finish"]
+        return pygame.Rect(fx - TRACK_WIDTH // 2, fy - TRACK_WIDTH // 2, TRACK_WIDTH, TRACK_WIDTH)
+    return None
+
+
+def reached_finish(cars, finish_rect):
+    # True when any live car's center is inside the finish area (same test as Rect.collidepoint)
+    if finish_rect is None:
+        return False
+    x, y = cars.center[:, 0], cars.center[:, 1]
+    inside = (x >= finish_rect.left) & (x < finish_rect.right) & (y >= finish_rect.top) & (y < finish_rect.bottom)
+    return bool((inside & cars.alive).any())
+
+
+class TrainingSession:
+    # everything that should survive from one NEAT generation to the next:
+    # the window, fonts, loaded map, collision mask, metadata, chosen start and compiled networks
+    def __init__(self, user_id=None, username="Guest", is_admin=False):
+        self.user_id = user_id
+        self.username = username
+        self.is_admin = is_admin
+
+        self.screen = None
+        self.info_font = None
+        self.clock = None
+
+        self.map_path = None
+        self.display_map = None
+        self.collision_mask = None
+        self.metadata = None
+        self.starting_position = None
+        self.networks = NetworkCache()
+
+        self.generation = 0
+        self.last_gen_crashed = False
+        # kept across generations so the chosen speed and the measured rate carry on
+        self.scheduler = FrameScheduler(TRAINING_HZ)
+        self.running = True
+        self.switch_mode = None  # "auto", "manual", "race" or "menu" once the user leaves
+
+    def ensure_display(self):
+        # only (re)open the window and fonts when they are actually gone
+        if not pygame.get_init():
+            pygame.init()
+        screen = pygame.display.get_surface()
+        if screen is None or screen.get_size() != (SCREEN_WIDTH, SCREEN_HEIGHT):
+            screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
+            admin_status = "Admin" if self.is_admin else "Not Admin"
+            pygame.display.set_caption(f"Self-Driving Mode | User: {self.username} | {admin_status}")
+        self.screen = screen
+        if self.info_font is None or not pygame.font.get_init():
+            self.info_font = get_sys_font("Arial", 30)
+        if self.clock is None:
+            self.clock = pygame.time.Clock()
+
+    def load_map(self, map_path):
+        # rebuild the map surface and mask only when the map actually changes
+        if map_path == self.map_path and self.display_map is not None:
+            return
+        self.map_path = map_path
+        self.display_map = pygame.image.load(map_path).convert_alpha()
+        bundle = load_map_bundle(map_path)
+        self.collision_mask = bundle.collision_mask
+        self.metadata = bundle.metadata
+        self.starting_position = None
+
+    def leave(self, mode):
+        self.switch_mode = mode
+        self.running = False
+
+
+def run_auto_mode(genomes, config, session):
+    session.ensure_display()
+    screen = session.screen
+    info_font = session.info_font
+    clock = session.clock
+    scheduler = session.scheduler
+
+    # when fast-forwarding, generations follow each other without the pause
+    if session.last_gen_crashed and scheduler.speed == 1:
         overlay = pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT))
         overlay.set_alpha(180)
         overlay.fill(LightGreen)
@@ -42,7 +148,7 @@ def run_auto_mode(genomes, config, user_id=None, username="Guest", is_admin=Fals
         screen.blit(msg, (SCREEN_WIDTH // 2 - msg.get_width() // 2, SCREEN_HEIGHT // 2 - 20))
         pygame.display.flip()
         pygame.time.wait(1500)
-        run_auto_mode.last_gen_crashed = False
+    session.last_gen_crashed = False
 
     # Button definitions
     button_width, button_height = 140, 40
@@ -51,6 +157,7 @@ def run_auto_mode(genomes, config, user_id=None, username="Guest", is_admin=Fals
     main_menu_btn = pygame.Rect(spacing, top_margin, button_width, button_height)
     modes_btn = pygame.Rect(main_menu_btn.right + spacing, top_margin, button_width, button_height)
     map_btn = pygame.Rect(modes_btn.right + spacing, top_margin, button_width, button_height)
+    speed_btn = pygame.Rect(map_btn.right + spacing, top_margin, button_width, button_height)
     quit_btn = pygame.Rect(SCREEN_WIDTH - button_width - spacing, top_margin, button_width, button_height)
     logout_btn = pygame.Rect(quit_btn.left - button_width - spacing, top_margin, button_width, button_height)
 
@@ -59,37 +166,27 @@ def run_auto_mode(genomes, config, user_id=None, username="Guest", is_admin=Fals
     simulation_paused = False
     pause_reason = None  # ⭐ Add this
 
-    if run_auto_mode.global_map_path is None:
-        run_auto_mode.global_map_path = select_map(screen, info_font)
-
-    display_map = pygame.image.load(run_auto_mode.global_map_path).convert_alpha()
-    collision_map = display_map.copy()
-    collision_map.set_colorkey(LightGreen)
-    collision_mask = pygame.mask.from_surface(collision_map)
-    metadata = load_map_metadata(run_auto_mode.global_map_path)
+    if session.map_path is None:
+        session.load_map(select_map(screen, info_font))
+    display_map = session.display_map
+    collision_mask = session.collision_mask
+    metadata = session.metadata
 
-    if run_auto_mode.starting_position is None:
-        run_auto_mode.starting_position = drag_and_drop_starting_position(screen, info_font, collision_mask,
-                                                                          display_map)
+    if session.starting_position is None:
+        session.starting_position = drag_and_drop_starting_position(screen, info_font, collision_mask, display_map)
 
-    nets, cars = [], []
-    for _, genome in genomes:
-        net = neat.nn.FeedForwardNetwork.create(genome, config)
-        nets.append(net)
-        genome.fitness = 0
-        cars.append(Car(initial_pos=run_auto_mode.starting_position.copy()))
-
-    for car in cars:
-        car.update(display_map, collision_mask)
+    nets, cars = create_generation(genomes, config, session.starting_position, collision_mask, session.networks)
 
     screen.fill(LightGreen)
     screen.blit(display_map, (0, 0))
     pygame.display.flip()
 
-    run_auto_mode.generation += 1
-    print(f"Running Generation {run_auto_mode.generation}")
-    generation_start_time = pygame.time.get_ticks()
-    simulation_fps = 240
+    session.generation += 1
+    print(f"Running Generation {session.generation}")
+    # the finish time is in simulated seconds, so it doesn't depend on how fast the machine draws
+    generation_ticks = 0
+    scheduler.reset()
+    previous_poses = None
     offset_x, offset_y = 0, 0
 
     def draw_button(rect, text, hover=False):
@@ -111,21 +208,22 @@ def run_auto_mode(genomes, config, user_id=None, username="Guest", is_admin=Fals
             if event.type == pygame.QUIT:
                 pygame.quit();
                 sys.exit()
+            elif event.type == pygame.KEYDOWN and event.key in SPEED_KEYS:
+                scheduler.speed = SPEED_KEYS[event.key]
             elif event.type == pygame.MOUSEBUTTONDOWN:
                 mx, my = pygame.mouse.get_pos()
 
                 if show_logout_prompt:
                     if yes_btn.collidepoint(mx, my):
                         pygame.quit()
+                        session.leave(None)
                         os.system("python main.py")
                         return
                     elif no_btn.collidepoint(mx, my):
                         show_logout_prompt = False
                 else:
                     if main_menu_btn.collidepoint(mx, my):
-                        from main import main_menu
-                        pygame.display.quit()  # Only close the display window
-                        main_menu(user_id=user_id, username=username, is_admin=is_admin)
+                        session.leave("menu")
                         return
 
 
@@ -142,30 +240,25 @@ def run_auto_mode(genomes, config, user_id=None, username="Guest", is_admin=Fals
                     elif logout_btn.collidepoint(mx, my):
                         show_logout_prompt = True
 
+                    elif speed_btn.collidepoint(mx, my):
+                        scheduler.next_speed()
+
                     elif map_btn.collidepoint(mx, my):
                         new_map = dropdown_map_selection(screen, info_font)
                         if new_map:
-                            run_auto_mode.global_map_path = new_map
-                            display_map = pygame.image.load(new_map).convert_alpha()
-                            collision_map = display_map.copy()
-                            collision_map.set_colorkey(LightGreen)
-                            collision_mask = pygame.mask.from_surface(collision_map)
-                            metadata = load_map_metadata(new_map)
-                            run_auto_mode.starting_position = drag_and_drop_starting_position(screen, info_font,
-                                                                                              collision_mask,
-                                                                                              display_map)
-                            nets.clear()
-                            cars.clear()
-                            for _, genome in genomes:
-                                net = neat.nn.FeedForwardNetwork.create(genome, config)
-                                nets.append(net)
-                                genome.fitness = 0
-                                cars.append(Car(initial_pos=run_auto_mode.starting_position.copy()))
-                            for car in cars:
-                                car.update(display_map, collision_mask)
-                            run_auto_mode.generation = 0
+                            session.load_map(new_map)
+                            display_map = session.display_map
+                            collision_mask = session.collision_mask
+                            metadata = session.metadata
+                            session.starting_position = drag_and_drop_starting_position(screen, info_font,
+                                                                                        collision_mask, display_map)
+                            nets, cars = create_generation(genomes, config, session.starting_position,
+                                                           collision_mask, session.networks)
+                            session.generation = 0
                             simulation_paused = False
-                            generation_start_time = pygame.time.get_ticks()
+                            generation_ticks = 0
+                            previous_poses = None
+                            scheduler.reset()
 
                     elif quit_btn.collidepoint(mx, my):
                         pygame.quit();
@@ -186,77 +279,81 @@ def run_auto_mode(genomes, config, user_id=None, username="Guest", is_admin=Fals
 
                                 if label == "Self-Driving":
 
-                                    run_auto_mode.switch_mode = "auto"
+                                    session.leave("auto")
 
                                 elif label == "Manual":
 
-                                    run_auto_mode.switch_mode = "manual"
+                                    session.leave("manual")
 
                                 elif label == "Race":
 
-                                    run_auto_mode.switch_mode = "race"
+                                    session.leave("race")
 
                                 break  # just break inside this event
 
                         show_modes_dropdown = False
-        if run_auto_mode.switch_mode:
-            raise StopIteration("User requested mode switch")
-
-        if not simulation_paused:
-            remaining_cars = 0
-            for i, car in enumerate(cars):
-                if car.get_alive():
-                    radar_data = car.get_data()
-                    if len(radar_data) != 8:
-                        continue
-                    output = nets[i].activate(radar_data)
-                    if not hasattr(car, "angular_velocity"):
-                        car.angular_velocity = 0
-                    desired = output[0] * 15
-                    car.angular_velocity += 0.1 * (desired - car.angular_velocity)
-                    car.angle += car.angular_velocity
-                    car.speed = CONSTANT_SPEED
-                    car.update(display_map, collision_mask)
-
-                    fitness = car.get_reward() + car.distance * 0.1
-                    if radar_data[0] > 50:
-                        fitness += 0.1
-                    if abs(car.angular_velocity) < 3:
-                        fitness += 0.2
-                    genomes[i][1].fitness += fitness
-                    remaining_cars += 1
-
-            if metadata and "finish" in metadata:
-                fx, fy = metadata["finish"]
-                finish_rect = pygame.Rect(fx - TRACK_WIDTH // 2, fy - TRACK_WIDTH // 2, TRACK_WIDTH, TRACK_WIDTH)
-                for car in cars:
-                    if car.get_alive() and finish_rect.collidepoint(car.center):
-                        time_taken = (pygame.time.get_ticks() - generation_start_time) / 1000.0
-                        simulation_paused = True
-                        print(f"Finish reached in {time_taken:.2f} seconds.")
-                        break
-
-            if remaining_cars == 0:
+        if not session.running:
+            return
+
+        if simulation_paused:
+            # nothing is simulated while paused, and the pause isn't caught up on afterwards
+            scheduler.reset()
+            previous_poses = None
+        else:
+            # the ticks due at the chosen speed, for as long as the frame's budget lasts
+            finish_rect = get_finish_rect(metadata)
+            due = scheduler.begin_frame()
+            ticks = 0
+            all_crashed = False
+            while ticks < due:
+                previous_poses = cars.poses()
+                remaining_cars = step_generation(cars, nets, genomes, collision_mask)
+                ticks += 1
+                generation_ticks += 1
+
+                if remaining_cars == 0:
+                    all_crashed = True
+                    break
+
+                if reached_finish(cars, finish_rect):
+                    time_taken = generation_ticks / TRAINING_HZ
+                    simulation_paused = True
+                    print(f"Finish reached in {time_taken:.2f} seconds.")
+                    break
+
+                if not scheduler.within_budget(ticks):
+                    break
+            scheduler.end_frame(ticks)
+
+            if all_crashed:
                 print("All cars crashed. Moving to next generation...")
-                run_auto_mode.last_gen_crashed = True
-                break
+                session.last_gen_crashed = True
+                return
 
-        alive = [car for car in cars if car.get_alive()]
-        if alive:
-            avg_x = sum(car.center[0] for car in alive) / len(alive)
-            avg_y = sum(car.center[1] for car in alive) / len(alive)
-            offset_x = int(avg_x - SCREEN_WIDTH // 2)
-            offset_y = int(avg_y - SCREEN_HEIGHT // 2)
+        # cars are drawn between their last two ticks, and the camera follows their average
+        poses = blend_pose(previous_poses, cars.poses(), scheduler.alpha)
+        alive = np.flatnonzero(cars.alive)
+        if alive.size:
+            offset_x = int(poses[alive, 0].mean() - SCREEN_WIDTH // 2)
+            offset_y = int(poses[alive, 1].mean() - SCREEN_HEIGHT // 2)
 
         screen.blit(display_map, (0, 0), pygame.Rect(offset_x, offset_y, SCREEN_WIDTH, SCREEN_HEIGHT))
-        for car in cars:
-            if car.get_alive():
-                car.draw(screen, info_font, offset=(offset_x, offset_y), draw_radars=True)
+        for i in alive.tolist():
+            cars[i].draw(screen, info_font, offset=(offset_x, offset_y), draw_radars=True, pose=poses[i])
+
+        # Simulation rate, measured, against the chosen fast-forward speed
+        stats = info_font.render(f"{scheduler.ticks_per_second:,.0f} ticks/s | {scheduler.speedup:.1f}x real time "
+                                 f"(speed {scheduler.speed_label})", True, (255, 255, 255))
+        stats_bg = pygame.Surface((stats.get_width() + 20, stats.get_height() + 10), pygame.SRCALPHA)
+        stats_bg.fill((0, 0, 0, 180))
+        stats_bg.blit(stats, (10, 5))
+        screen.blit(stats_bg, (spacing, SCREEN_HEIGHT - stats_bg.get_height() - spacing))
 
         # Draw all buttons
         draw_button(main_menu_btn, "Main Menu", main_menu_btn.collidepoint(*mouse_pos))
         draw_button(modes_btn, "Modes", modes_btn.collidepoint(*mouse_pos))
         draw_button(map_btn, "Map", map_btn.collidepoint(*mouse_pos))
+        draw_button(speed_btn, f"Speed {scheduler.speed_label}", speed_btn.collidepoint(*mouse_pos))
         draw_button(quit_btn, "Quit", quit_btn.collidepoint(*mouse_pos))
         draw_button(logout_btn, "Logout", logout_btn.collidepoint(*mouse_pos))
 
@@ -299,13 +396,11 @@ def run_auto_mode(genomes, config, user_id=None, username="Guest", is_admin=Fals
             draw_button(no_btn, "No", no_btn.collidepoint(*mouse_pos))
 
         pygame.display.flip()
-        clock.tick(simulation_fps)
+        scheduler.end_drawing()
+        clock.tick(RENDER_FPS)
 
 
 def run_selfdriving(generations=1000, user_id=None, username="Guest", is_admin=False):
-    run_auto_mode.global_map_path = None
-    run_auto_mode.starting_position = None
-
     config_path = os.path.join(os.path.dirname(__file__), "config.txt")
     if not os.path.exists(config_path):
         print("Error: config.txt not found")
@@ -322,14 +417,18 @@ def run_selfdriving(generations=1000, user_id=None, username="Guest", is_admin=F
     stats = neat.StatisticsReporter()
     population.add_reporter(stats)
 
-    try:
-        population.run(lambda genomes, config: run_auto_mode(genomes, config, user_id, username, is_admin), generations)
-    except StopIteration:
-        # Mode switch requested
-        pass
-
-    if run_auto_mode.switch_mode:
+    # one generation per run() call so leaving the mode just ends the loop
+    session = TrainingSession(user_id, username, is_admin)
+    for _ in range(generations):
+        population.run(lambda genomes, config: run_auto_mode(genomes, config, session), 1)
+        if not session.running:
+            break
+
+    if session.switch_mode == "menu":
+        from main import main_menu
+        pygame.display.quit()  # Only close the display window
+        main_menu(user_id=user_id, username=username, is_admin=is_admin)
+    elif session.switch_mode:
         from main import run_selected_mode
-        mode_to_run = run_auto_mode.switch_mode
-        run_auto_mode.switch_mode = None
-        run_selected_mode(mode_to_run, user_id=user_id, username=username, generations=generations, is_admin=is_admin)
+        run_selected_mode(session.switch_mode, user_id=user_id, username=username, generations=generations,
+                          is_admin=is_admin)
@@ -0,0 +1,102 @@
+import weakref
+from collections import OrderedDict
+import pygame
+
+# rotated sprites are dropped least recently used first once they take more than this
+MAX_ATLAS_BYTES = 32 * 1024 * 1024
+
+
+class RotationAtlas:
+    # rotated copies of car sprites, shared by every car that uses the same surface.
+    # angles are rounded to whole degrees, so one sprite has at most 360 entries
+    def __init__(self, max_bytes: int = MAX_ATLAS_BYTES) -> None:
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.used_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, surface: pygame.Surface, angle: float) -> pygame.Surface:
+        key = (surface, int(round(angle)) % 360)
+        rotated = self.entries.get(key)
+        if rotated is not None:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return rotated
+
+        self.misses += 1
+        rotated = pygame.transform.rotate(surface, key[1])
+        self.entries[key] = rotated
+        self.used_bytes += rotated.get_pitch() * rotated.get_height()
+        while self.used_bytes > self.max_bytes and len(self.entries) > 1:
+            _, dropped = self.entries.popitem(last=False)
+            self.used_bytes -= dropped.get_pitch() * dropped.get_height()
+        return rotated
+
+    def prebuild(self, surface: pygame.Surface) -> None:
+        # rotate a sprite to every angle up front instead of on first use
+        for angle in range(360):
+            self.get(surface, angle)
+
+    def clear(self) -> None:
+        self.entries.clear()
+        self.used_bytes = 0
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": len(self.entries),
+            "bytes": self.used_bytes,
+        }
+
+
+# the atlas every car draws from
+rotation_atlas = RotationAtlas()
+
+
+class FootprintAtlas:
+    # collision masks of car sprites at every whole degree (the angles RotationAtlas draws),
+    # shared by every car that uses the same surface. each mask is cropped to the pixels the
+    # car covers and stored with its offset from the car's center and its reach: how far (in
+    # chessboard pixels) it extends from the center. a sprite's table goes away with the sprite,
+    # e.g. once assets.clear() drops it from the image cache
+    def __init__(self) -> None:
+        self.footprints = weakref.WeakKeyDictionary()
+
+    def get(self, surface: pygame.Surface, angle: float) -> tuple:
+        # (mask, dx, dy, width, height, reach) for the sprite turned to angle
+        try:
+            table = self.footprints[surface]
+        except KeyError:
+            table = self.footprints[surface] = [_footprint(surface, degree) for degree in range(360)]
+        return table[round(angle) % 360]
+
+    def reaches(self, surface: pygame.Surface) -> list:
+        # the reach of the sprite at every whole degree, indexed like get's angles
+        self.get(surface, 0)
+        return [footprint[5] for footprint in self.footprints[surface]]
+
+    def clear(self) -> None:
+        self.footprints.clear()
+
+
+def _footprint(surface: pygame.Surface, angle: int) -> tuple:
+    rotated = pygame.transform.rotate(surface, angle)
+    mask = pygame.mask.from_surface(rotated)
+    rects = mask.get_bounding_rects()
+    if not rects:
+        # a fully transparent sprite still occupies its center pixel
+        return pygame.mask.Mask((1, 1), fill=True), 0, 0, 1, 1, 0
+    bounds = rects[0].unionall(rects[1:])
+    cropped = pygame.mask.Mask(bounds.size)
+    cropped.draw(mask, (-bounds.x, -bounds.y))
+    # same placement as drawing: the rotated sprite's rect is centered on the car's center
+    dx = bounds.x - rotated.get_width() // 2
+    dy = bounds.y - rotated.get_height() // 2
+    reach = max(-dx, dx + bounds.width - 1, -dy, dy + bounds.height - 1)
+    return cropped, dx, dy, bounds.width, bounds.height, reach
+
+
+# the footprints every car collides with
+car_footprints = FootprintAtlas()
@@ -0,0 +1,150 @@
+import sys
+import time
+import numpy as np
+
+# physics ticks per simulated second in manual and race mode. every speed, acceleration and
+# steering constant was tuned at one tick per 60 fps frame, so this keeps the driving feel
+SIM_HZ = 60
+# frames drawn per second; the physics no longer depends on it
+RENDER_FPS = 60
+# a frame longer than this (window dragged, machine asleep) is not caught up on, so the
+# game slows down for a moment instead of running hundreds of ticks to catch up
+MAX_FRAME_SECONDS = 0.25
+
+
+class FixedTimestep:
+    # turns the wall-clock time between frames into a whole number of fixed physics ticks.
+    # the time left over stays in the accumulator and says how far the frame is between
+    # the last tick and the next one, for drawing cars in between (see blend_pose)
+    def __init__(self, hz: float = SIM_HZ, max_frame: float = MAX_FRAME_SECONDS) -> None:
+        self.hz = hz
+        self.max_frame = max_frame
+        self.accumulator = 0.0
+        self.last = None
+
+    def advance(self) -> int:
+        # ticks to simulate this frame; call once per frame
+        now = time.perf_counter()
+        if self.last is not None:
+            self.accumulator += min(now - self.last, self.max_frame)
+        self.last = now
+        ticks = int(self.accumulator * self.hz)
+        self.accumulator -= ticks / self.hz
+        return ticks
+
+    def reset(self) -> None:
+        # forget the time since the last frame (a pause, a dialog, a restart message)
+        self.accumulator = 0.0
+        self.last = None
+
+    @property
+    def alpha(self) -> float:
+        # 0 at the last tick, approaching 1 just before the next one
+        return min(self.accumulator * self.hz, 1.0)
+
+
+def car_pose(car):
+    # where a Car (or BatchCar) is drawn: its center, unrounded, and its angle
+    surface = car.surface
+    return car.pos[0] + surface.get_width() / 2, car.pos[1] + surface.get_height() / 2, car.angle
+
+
+def blend_pose(previous, current, alpha):
+    # the pose alpha of the way from the previous tick to the current one; poses are car_pose
+    # tuples or CarBatch.poses() arrays. without a previous tick (a new car) it is the current pose
+    if previous is None:
+        return current
+    if isinstance(current, np.ndarray):
+        return previous + (current - previous) * alpha
+    return tuple(a + (b - a) * alpha for a, b in zip(previous, current))
+
+
+# fast-forward settings of the self-driving view, in simulated seconds per real second;
+# None runs as many ticks as fit in the frame
+SPEED_FACTORS = (1, 10, 100, None)
+# the simulation gets what is left of a frame after drawing, less this headroom for events,
+# but never less than the minimum so training keeps moving when drawing alone fills the frame
+FRAME_HEADROOM_SECONDS = 0.1 / RENDER_FPS
+MIN_BUDGET_SECONDS = 0.2 / RENDER_FPS
+# how quickly the drawing time estimate follows the measured one
+DRAWING_SMOOTHING = 0.2
+# how often the measured ticks per second is refreshed
+RATE_WINDOW_SECONDS = 0.5
+
+
+class FrameScheduler:
+    # fixed timestep with fast-forward: each frame runs speed times the ticks that are due, but
+    # only while they fit in the frame next to the drawing (measured every frame), so the window
+    # keeps RENDER_FPS at any speed. ticks that didn't fit are dropped, not carried over, so a
+    # simulation too slow for the chosen speed just runs as fast as it can
+    def __init__(self, hz: float) -> None:
+        self.hz = hz
+        self.timestep = FixedTimestep(hz)
+        self.speed = SPEED_FACTORS[0]
+        self.drawing = 0.0
+        self.frame_start = 0.0
+        self.deadline = 0.0
+        self.ticks_per_second = 0.0
+        self._ticks_end = None
+        self._window_start = None
+        self._window_ticks = 0
+
+    @property
+    def budget(self) -> float:
+        # seconds of simulation that fit in a frame
+        return max(1.0 / RENDER_FPS - self.drawing - FRAME_HEADROOM_SECONDS, MIN_BUDGET_SECONDS)
+
+    def begin_frame(self) -> int:
+        # ticks due this frame at the chosen speed; run at least one, then more while within_budget()
+        due = self.timestep.advance()
+        self.frame_start = time.perf_counter()
+        self.deadline = self.frame_start + self.budget
+        if self.speed is None:
+            return sys.maxsize
+        return due * self.speed
+
+    def within_budget(self, ticks: int) -> bool:
+        # whether one more tick, as long as the ticks run so far this frame took on average, fits
+        now = time.perf_counter()
+        return now + (now - self.frame_start) / ticks < self.deadline
+
+    def end_frame(self, ticks: int) -> None:
+        # count the ticks the frame actually ran, for ticks_per_second
+        now = self._ticks_end = time.perf_counter()
+        if self._window_start is None:
+            self._window_start = now
+        self._window_ticks += ticks
+        if now - self._window_start >= RATE_WINDOW_SECONDS:
+            self.ticks_per_second = self._window_ticks / (now - self._window_start)
+            self._window_start = now
+            self._window_ticks = 0
+
+    def end_drawing(self) -> None:
+        # call once the frame is drawn, before waiting for the next one, to size the next budget
+        if self._ticks_end is not None:
+            self.drawing += (time.perf_counter() - self._ticks_end - self.drawing) * DRAWING_SMOOTHING
+            self._ticks_end = None
+
+    def reset(self) -> None:
+        # forget the time since the last frame, as FixedTimestep.reset does
+        self.timestep.reset()
+        self._ticks_end = None
+        self._window_start = None
+        self._window_ticks = 0
+
+    def next_speed(self) -> None:
+        self.speed = SPEED_FACTORS[(SPEED_FACTORS.index(self.speed) + 1) % len(SPEED_FACTORS)]
+
+    @property
+    def speed_label(self) -> str:
+        return "max" if self.speed is None else f"{self.speed}x"
+
+    @property
+    def speedup(self) -> float:
+        # simulated seconds per real second, as measured
+        return self.ticks_per_second / self.hz
+
+    @property
+    def alpha(self) -> float:
+        # blend factor for drawing; fast-forwarded cars move too far per tick to draw in between
+        return self.timestep.alpha if self.speed == 1 else 1.0
@@ -0,0 +1,330 @@
+import numpy as np
+import pygame
+
+# how many maps keep their derived arrays around at once
+MAX_CACHED_MAPS = 4
+
+# distance field values are capped here so they fit in a byte
+MAX_FIELD_DISTANCE = 255
+
+# occupancy pyramid tiles go from 2x2 up to 2**PYRAMID_LEVELS pixels square
+PYRAMID_LEVELS = 6
+TILE_OFF_TRACK, TILE_ON_TRACK, TILE_MIXED = 0, 1, 2
+
+_track_grids = {}
+_distance_fields = {}
+_packed_tracks = {}
+_pyramids = {}
+_offtrack_masks = {}
+_last_offtrack = (None, None)
+
+
+def mask_to_array(collision_mask: pygame.mask.Mask) -> np.ndarray:
+    # turn a pygame mask into a (width, height) bool array, True = on track
+    surface = collision_mask.to_surface(setcolor=(255, 255, 255, 255), unsetcolor=(0, 0, 0, 255))
+    return pygame.surfarray.array_red(surface) > 0
+
+
+def _cached(cache, collision_mask, build):
+    # masks can't be weak-referenced, so keep the mask next to its value to stop its id being reused
+    entry = cache.get(id(collision_mask))
+    if entry is None or entry[0] is not collision_mask:
+        if len(cache) >= MAX_CACHED_MAPS:
+            cache.pop(next(iter(cache)))
+        entry = (collision_mask, build(collision_mask))
+        cache[id(collision_mask)] = entry
+    return entry[1]
+
+
+def get_track_grid(collision_mask: pygame.mask.Mask) -> np.ndarray:
+    return _cached(_track_grids, collision_mask, mask_to_array)
+
+
+def build_distance_field(grid: np.ndarray) -> np.ndarray:
+    # chessboard distance from every track pixel to the nearest off-track pixel (0 when off track).
+    # the map border counts as off track. it never exceeds the euclidean distance, so a ray
+    # standing on a pixel with value d can skip d - 1 samples without missing a wall.
+    field = np.zeros(grid.shape, dtype=np.uint8)
+    current = grid.copy()
+    level = 0
+    while level < MAX_FIELD_DISTANCE and current.any():
+        field += current
+        level += 1
+        # erode by one pixel in every direction (3x3 min filter, done per axis)
+        eroded = current.copy()
+        eroded[1:, :] &= current[:-1, :]
+        eroded[:-1, :] &= current[1:, :]
+        eroded[0, :] = eroded[-1, :] = False
+        current = eroded.copy()
+        current[:, 1:] &= eroded[:, :-1]
+        current[:, :-1] &= eroded[:, 1:]
+        current[:, 0] = current[:, -1] = False
+    return field
+
+
+class DistanceField:
+    def __init__(self, field: np.ndarray) -> None:
+        self.field = field
+        self.width, self.height = field.shape
+        # flat view so single lookups stay plain python ints; a view, not a copy, so a field
+        # memory-mapped from a map bundle is only read where rays go
+        self.data = memoryview(np.ascontiguousarray(field).reshape(-1))
+
+    def at(self, x, y):
+        # distance at one pixel; everything off the map is off track
+        if x < 0 or x >= self.width or y < 0 or y >= self.height:
+            return 0
+        return self.data[x * self.height + y]
+
+    def at_many(self, x, y):
+        # at for integer arrays of pixels
+        inside = (x >= 0) & (x < self.width) & (y >= 0) & (y < self.height)
+        distance = np.zeros(x.shape, dtype=np.int64)
+        distance[inside] = self.field[x[inside], y[inside]]
+        return distance
+
+    def march(self, cx, cy, cos, sin, max_length):
+        # sphere-trace one ray; returns the same end pixel as stepping one pixel at a time
+        width, height, data = self.width, self.height, self.data
+        ray_length = 0
+        x = int(cx + cos * ray_length)
+        y = int(cy + sin * ray_length)
+        while ray_length < max_length:
+            if x < 0 or x >= width or y < 0 or y >= height:
+                break
+            distance = data[x * height + y]
+            if distance == 0:
+                break
+            # same as min(ray_length + max(distance - 1, 1), max_length), without the builtin calls
+            ray_length += distance - 1 if distance > 1 else 1
+            if ray_length > max_length:
+                ray_length = max_length
+            x = int(cx + cos * ray_length)
+            y = int(cy + sin * ray_length)
+        return x, y
+
+
+class PackedTrack:
+    # the track bits packed eight pixels to a byte along y (np.packbits order, like the map bundle)
+    def __init__(self, bits: np.ndarray, height: int) -> None:
+        self.bits = np.asarray(bits)
+        self.width = self.bits.shape[0]
+        self.height = height
+
+    @classmethod
+    def from_grid(cls, grid: np.ndarray) -> "PackedTrack":
+        return cls(np.packbits(grid, axis=1), grid.shape[1])
+
+    def march(self, cx, cy, step_x, step_y):
+        # walk rays through their precomputed sample offsets (one row per ray, one column per pixel
+        # step) and return the first off-track sample of each; the last column is never tested,
+        # like a ray that reaches full length. x/y are built as int(cx + offset), exactly the
+        # samples a pixel-by-pixel walk visits, so the results match it bit for bit
+        x = (cx + step_x).astype(np.int64)
+        y = (cy + step_y).astype(np.int64)
+        inside = (x >= 0) & (x < self.width) & (y >= 0) & (y < self.height)
+        px = np.where(inside, x, 0)
+        py = np.where(inside, y, 0)
+        on_track = inside & ((self.bits[px, py >> 3] >> (7 - (py & 7))) & 1).astype(bool)
+        on_track[:, -1] = False
+        stop = on_track.argmin(axis=1)
+        rays = np.arange(x.shape[0])
+        return x[rays, stop], y[rays, stop]
+
+
+def build_pyramid_levels(grid: np.ndarray, levels: int = PYRAMID_LEVELS) -> list:
+    # tile states for 2x2, 4x4, ... tiles: all on track, all off track, or mixed.
+    # the map is padded with off-track pixels up to whole tiles
+    states = grid.astype(np.uint8)
+    pyramid = []
+    for _ in range(levels):
+        width, height = states.shape
+        padded = np.zeros((width + width % 2, height + height % 2), dtype=np.uint8)
+        padded[:width, :height] = states
+        corners = (padded[0::2, 0::2], padded[1::2, 0::2], padded[0::2, 1::2], padded[1::2, 1::2])
+        uniform = (corners[0] == corners[1]) & (corners[0] == corners[2]) & (corners[0] == corners[3])
+        states = np.where(uniform, corners[0], TILE_MIXED).astype(np.uint8)
+        pyramid.append(states)
+    return pyramid
+
+
+class OccupancyPyramid:
+    # tile states over the bit-packed track. queries start at the biggest tiles and only go down
+    # to single pixels near the track edge; rays jump across whole on-track tiles at once
+    def __init__(self, packed: PackedTrack, levels: list) -> None:
+        self.packed = packed
+        self.width, self.height = packed.width, packed.height
+        self.levels = [np.asarray(level) for level in levels]
+        self.top = len(levels)
+        # flat copies so single lookups stay plain python ints; entry 0 is the pixel level
+        self.row_bytes = packed.bits.shape[1]
+        self.bits = packed.bits.tobytes()
+        self.data = [None] + [(level.tobytes(), level.shape[1]) for level in self.levels]
+
+    @classmethod
+    def from_grid(cls, grid: np.ndarray) -> "OccupancyPyramid":
+        return cls(PackedTrack.from_grid(grid), build_pyramid_levels(grid))
+
+    def tile(self, x, y, level=None):
+        # level and state of the biggest uniform tile holding pixel (x, y), which must be on the map.
+        # level is where the search starts, when the tiles above it are known to be mixed
+        data = self.data
+        if level is None:
+            level = self.top
+        while level:
+            states, tiles_high = data[level]
+            state = states[(x >> level) * tiles_high + (y >> level)]
+            if state != TILE_MIXED:
+                return level, state
+            level -= 1
+        return 0, self.bits[x * self.row_bytes + (y >> 3)] >> (7 - (y & 7)) & 1
+
+    def on_track(self, x, y):
+        if x < 0 or x >= self.width or y < 0 or y >= self.height:
+            return False
+        return self.tile(x, y)[1] == TILE_ON_TRACK
+
+    def march(self, cx, cy, cos, sin, max_length):
+        # walk one ray, skipping the samples that fall in the on-track tile it is crossing;
+        # returns the same end pixel as stepping one pixel at a time
+        width, height, top = self.width, self.height, self.top
+        # the smallest mixed tile the last sample was in; a sample still inside it starts below it
+        mixed_level, mixed_x, mixed_y = 0, -1, -1
+        ray_length = 0
+        x = int(cx + cos * ray_length)
+        y = int(cy + sin * ray_length)
+        while ray_length < max_length:
+            if x < 0 or x >= width or y < 0 or y >= height:
+                break
+            if x >> mixed_level == mixed_x and y >> mixed_level == mixed_y:
+                level, state = self.tile(x, y, mixed_level - 1)
+            else:
+                level, state = self.tile(x, y)
+            if state != TILE_ON_TRACK:
+                break
+            if level < top:
+                mixed_level = level + 1
+                mixed_x = x >> mixed_level
+                mixed_y = y >> mixed_level
+            next_length = ray_length + 1
+            if level:
+                # every sample before the ray crosses a tile border is inside the tile, so on track
+                x0 = x >> level << level
+                y0 = y >> level << level
+                exit_length = max_length
+                if cos > 0:
+                    exit_length = (x0 + (1 << level) - cx) / cos
+                elif cos < 0:
+                    exit_length = (x0 - cx) / cos
+                if sin > 0:
+                    exit_length = min(exit_length, (y0 + (1 << level) - cy) / sin)
+                elif sin < 0:
+                    exit_length = min(exit_length, (y0 - cy) / sin)
+                if exit_length >= next_length + 1:
+                    next_length = int(exit_length)
+            ray_length = next_length if next_length < max_length else max_length
+            x = int(cx + cos * ray_length)
+            y = int(cy + sin * ray_length)
+        return x, y
+
+    def march_many(self, cx, cy, cos, sin, max_length):
+        # march for arrays of rays at once, dropping rays as they hit
+        width, height = self.width, self.height
+        hit_x = np.empty(cos.size, dtype=np.int64)
+        hit_y = np.empty(cos.size, dtype=np.int64)
+        ray_length = np.zeros(cos.size, dtype=np.int64)
+        active = np.arange(cos.size)
+        while active.size:
+            length = ray_length[active]
+            rx, ry, rc, rs = cx[active], cy[active], cos[active], sin[active]
+            x = np.trunc(rx + rc * length).astype(np.int64)
+            y = np.trunc(ry + rs * length).astype(np.int64)
+            # rays at full length stop without another check
+            stopped = (length >= max_length) | (x < 0) | (x >= width) | (y < 0) | (y >= height)
+
+            # find each sample's biggest uniform tile, coarsest level first
+            level = np.zeros(active.size, dtype=np.int64)
+            state = np.full(active.size, TILE_MIXED, dtype=np.uint8)
+            for depth in range(self.top, 0, -1):
+                open_rows = np.flatnonzero(~stopped & (state == TILE_MIXED))
+                if open_rows.size == 0:
+                    break
+                state[open_rows] = self.levels[depth - 1][x[open_rows] >> depth, y[open_rows] >> depth]
+                level[open_rows] = depth
+            pixel_rows = np.flatnonzero(~stopped & (state == TILE_MIXED))
+            px, py = x[pixel_rows], y[pixel_rows]
+            state[pixel_rows] = (self.packed.bits[px, py >> 3] >> (7 - (py & 7))) & 1
+            level[pixel_rows] = 0
+            stopped |= state != TILE_ON_TRACK
+            hit_x[active[stopped]] = x[stopped]
+            hit_y[active[stopped]] = y[stopped]
+
+            moving = np.flatnonzero(~stopped)
+            size = np.left_shift(1, level[moving])
+            x0 = x[moving] >> level[moving] << level[moving]
+            y0 = y[moving] >> level[moving] << level[moving]
+            rx, ry, rc, rs = rx[moving], ry[moving], rc[moving], rs[moving]
+            with np.errstate(divide="ignore", invalid="ignore"):
+                exit_x = np.where(rc > 0, (x0 + size - rx) / rc, np.where(rc < 0, (x0 - rx) / rc, np.inf))
+                exit_y = np.where(rs > 0, (y0 + size - ry) / rs, np.where(rs < 0, (y0 - ry) / rs, np.inf))
+            exit_length = np.minimum(np.minimum(exit_x, exit_y), max_length)
+            next_length = length[moving] + 1
+            jump = (level[moving] > 0) & (exit_length >= next_length + 1)
+            next_length[jump] = exit_length[jump].astype(np.int64)
+            active = active[moving]
+            ray_length[active] = np.minimum(next_length, max_length)
+        return hit_x, hit_y
+
+    def on_track_many(self, x, y):
+        # on_track for integer arrays of pixels
+        inside = (x >= 0) & (x < self.width) & (y >= 0) & (y < self.height)
+        state = np.full(x.shape, TILE_MIXED, dtype=np.uint8)
+        state[~inside] = TILE_OFF_TRACK
+        for depth in range(self.top, 0, -1):
+            open_cells = state == TILE_MIXED
+            if not open_cells.any():
+                break
+            state[open_cells] = self.levels[depth - 1][x[open_cells] >> depth, y[open_cells] >> depth]
+        open_cells = state == TILE_MIXED
+        px, py = x[open_cells], y[open_cells]
+        state[open_cells] = (self.packed.bits[px, py >> 3] >> (7 - (py & 7))) & 1
+        return state == TILE_ON_TRACK
+
+
+def get_distance_field(collision_mask: pygame.mask.Mask) -> DistanceField:
+    return _cached(_distance_fields, collision_mask,
+                   lambda mask: DistanceField(build_distance_field(get_track_grid(mask))))
+
+
+def get_packed_track(collision_mask: pygame.mask.Mask) -> PackedTrack:
+    return _cached(_packed_tracks, collision_mask, lambda mask: PackedTrack.from_grid(get_track_grid(mask)))
+
+
+def _invert(collision_mask: pygame.mask.Mask) -> pygame.mask.Mask:
+    offtrack = collision_mask.copy()
+    offtrack.invert()
+    return offtrack
+
+
+def get_offtrack_mask(collision_mask: pygame.mask.Mask) -> pygame.mask.Mask:
+    # the inverse of the collision mask: a car footprint overlapping it has left the track.
+    # asked for every car every tick, so the last map's answer is kept at hand
+    global _last_offtrack
+    if _last_offtrack[0] is not collision_mask:
+        _last_offtrack = (collision_mask, _cached(_offtrack_masks, collision_mask, _invert))
+    return _last_offtrack[1]
+
+
+def get_occupancy_pyramid(collision_mask: pygame.mask.Mask) -> OccupancyPyramid:
+    return _cached(_pyramids, collision_mask,
+                   lambda mask: OccupancyPyramid(get_packed_track(mask), build_pyramid_levels(get_track_grid(mask))))
+
+
+def remember_map(collision_mask: pygame.mask.Mask, grid: np.ndarray, field: np.ndarray = None,
+                 packed: np.ndarray = None) -> None:
+    # seed the caches with arrays computed earlier, e.g. read from a map bundle
+    _cached(_track_grids, collision_mask, lambda mask: grid)
+    if field is not None:
+        _cached(_distance_fields, collision_mask, lambda mask: DistanceField(field))
+    if packed is not None:
+        _cached(_packed_tracks, collision_mask, lambda mask: PackedTrack(packed, grid.shape[1]))
@@ -3,6 +3,8 @@ import sys
 import os
 from typing import List
 from car import Car, SCREEN_WIDTH, SCREEN_HEIGHT
+from assets import load_scaled
+from mapbundle import load_map_bundle, read_metadata
 
 # Colors and constants used by the utility functions.
 LightGreen = (144, 238, 144)
@@ -12,6 +14,39 @@ White = (255, 255, 255)
 CONSTANT_SPEED = 5
 TRACK_WIDTH = 80  # Used for finish area drawing
 
+class PagedRows:
+    # rows of a paged db query, fetched a page at a time as they scroll into view.
+    # load_after(last_row or None) returns the rows that follow, load_before(first_row) the ones that precede
+    def __init__(self, load_after, load_before=None):
+        self.load_after = load_after
+        self.load_before = load_before
+        self.reset()
+
+    def reset(self, rows=None, at_start=True):
+        self.rows = list(rows or [])
+        self.at_start = at_start
+        self.at_end = False
+
+    def window(self, offset, count):
+        # load until rows offset .. offset + count exist (or the query runs out)
+        while len(self.rows) < offset + count and not self.at_end:
+            page = self.load_after(self.rows[-1] if self.rows else None)
+            if not page:
+                self.at_end = True
+            self.rows.extend(page)
+        return self.rows
+
+    def load_previous(self):
+        # prepend the page before the first loaded row; returns how many rows were added
+        if self.at_start or not self.rows or self.load_before is None:
+            return 0
+        page = self.load_before(self.rows[0])
+        if not page:
+            self.at_start = True
+        self.rows[:0] = page
+        return len(page)
+
+
 def get_sorted_map_files() -> List[str]:
     maps_folder = "maps"
     files = [f for f in os.listdir(maps_folder) if f.endswith('.png')]
@@ -29,17 +64,14 @@ def get_sorted_map_files() -> List[str]:
 
     return sorted(files, key=sort_key)
 
+def get_map_preview(map_path: str) -> str:
+    # path of the small preview image stored in the map's bundle
+    return load_map_bundle(map_path).preview_path
+
 def load_map_metadata(map_path: str):
-    import json  # Local import to avoid global usage
-    script_dir = os.path.dirname(os.path.abspath(__file__))
-    metadata_dir = os.path.join(script_dir, "startfinish")
-    base = os.path.splitext(os.path.basename(map_path))[0]
-    metadata_filename = base + "_metadata.json"
-    metadata_path = os.path.join(metadata_dir, metadata_filename)
-    if os.path.exists(metadata_path):
-        with open(metadata_path, "r") as f:
-            return json.load(f)
-    return None
+    if not os.path.exists(map_path):
+        return read_metadata(map_path)
+    return load_map_bundle(map_path).metadata
 
 # (All remaining functions like select_map, draw_map_button, dropdown_map_selection,
 #  drag_and_drop_starting_position remain unchanged — no edits required)
@@ -85,8 +117,8 @@ def select_map(screen: pygame.Surface, font: pygame.font.Font) -> str:
             screen.blit(text, text.get_rect(center=rect.center))
         pygame.draw.rect(screen, Black, (preview_x - 5, preview_y - 5, preview_width + 10, preview_height + 10), 2)
         try:
-            preview_image = pygame.image.load(os.path.join("maps", sorted_files[selected_index])).convert_alpha()
-            preview_image = pygame.transform.scale(preview_image, (preview_width, preview_height))
+            preview_image = load_scaled(get_map_preview(os.path.join("maps", sorted_files[selected_index])),
+                                        (preview_width, preview_height), convert="alpha")
             screen.blit(preview_image, (preview_x, preview_y))
         except Exception:
             pass
@@ -117,8 +149,7 @@ def draw_map_button(screen: pygame.Surface, font: pygame.font.Font, current_map:
         current_map = sorted_files[0]
     base, _ = os.path.splitext(current_map)
     label = base.capitalize()
-    img = pygame.image.load("assets/simulate.png")
-    img = pygame.transform.scale(img, (100, 40))
+    img = load_scaled("assets/Simulate.png", (100, 40))
     from button import Button  # Import here if Button is defined elsewhere.
     btn = Button(image=img, pos=(SCREEN_WIDTH - 60, 30),
                  text_input=label, font=font, base_color="#d7fcd4", hovering_color="White")
@@ -126,8 +157,7 @@ def draw_map_button(screen: pygame.Surface, font: pygame.font.Font, current_map:
     return btn.rect
 
 def draw_manual_mode_button(screen: pygame.Surface, font: pygame.font.Font) -> pygame.Rect:
-    img = pygame.image.load("assets/simulate.png")
-    img = pygame.transform.scale(img, (150, 40))
+    img = load_scaled("assets/Simulate.png", (150, 40))
     pos = (10 + 150 // 2, 10 + 40 // 2)
     from button import Button  # Import here if Button is defined elsewhere.
     btn = Button(image=img, pos=pos, text_input="Manual Mode",
@@ -181,8 +211,8 @@ def dropdown_map_selection(screen: pygame.Surface, font: pygame.font.Font) -> st
         preview_box = pygame.Rect(preview_x - 5, preview_y - 5, preview_width + 10, preview_height + 10)
         pygame.draw.rect(screen, Black, preview_box, 2)
         try:
-            preview = pygame.image.load(os.path.join(maps_folder, map_files[selected_index])).convert_alpha()
-            preview = pygame.transform.scale(preview, (preview_width, preview_height))
+            preview = load_scaled(get_map_preview(os.path.join(maps_folder, map_files[selected_index])),
+                                  (preview_width, preview_height), convert="alpha")
             screen.blit(preview, (preview_x, preview_y))
         except Exception:
             pass
@@ -1,35 +1,199 @@
+import os
+import sys
+import csv
+import gzip
+import json
 import sqlite3
+import argparse
+import pathlib
+from datetime import datetime, timezone
+import db
+from db import SCHEMA_VERSION, canonical_map_path
 
-def show_all_users_and_scores():
-    conn = sqlite3.connect("scores.db")
-    cursor = conn.cursor()
+# rows pulled from SQLite per fetchmany call while exporting
+EXPORT_BATCH_SIZE = 5000
+
+# Exportable tables: output columns and the query producing them. Password and
+# security answer hashes are left out of the users export on purpose.
+EXPORT_TABLES = {
+    "users": (
+        ["id", "username", "security_question"],
+        "SELECT u.id, u.username, u.security_question FROM users u",
+    ),
+    "scores": (
+        ["id", "user_id", "username", "map", "time_taken", "collisions", "checkpoints", "played_at"],
+        "SELECT s.id, s.user_id, u.username, m.path, s.time_taken, s.collisions, s.checkpoints, "
+        "strftime('%Y-%m-%dT%H:%M:%SZ', s.played_at, 'unixepoch') "
+        "FROM scores s JOIN users u ON u.id = s.user_id JOIN maps m ON m.id = s.map_id",
+    ),
+    "user_map_stats": (
+        ["user_id", "username", "map", "times_played", "total_collisions", "total_time"],
+        "SELECT s.user_id, u.username, m.path, s.times_played, s.total_collisions, s.total_time "
+        "FROM user_map_stats s JOIN users u ON u.id = s.user_id JOIN maps m ON m.id = s.map_id",
+    ),
+    "user_best_map_scores": (
+        ["user_id", "username", "map", "time_taken"],
+        "SELECT b.user_id, u.username, m.path, b.time_taken "
+        "FROM user_best_map_scores b JOIN users u ON u.id = b.user_id JOIN maps m ON m.id = b.map_id",
+    ),
+}
+
+
+def open_read_only(path):
+    # Open the database without ever writing to it: no migrations, no WAL switch, no new tables.
+    # Databases older than this version of the game are refused rather than upgraded
+    try:
+        conn = sqlite3.connect(pathlib.Path(path).resolve().as_uri() + "?mode=ro", uri=True)
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+    except sqlite3.Error as e:
+        print(f"Error: could not open {path} read-only: {e}")
+        sys.exit(1)
+    if version < SCHEMA_VERSION:
+        print(f"Error: {path} has schema version {version}, older than {SCHEMA_VERSION}; "
+              "run the game on it (or on a copy) once to upgrade it first")
+        sys.exit(1)
+    return conn
+
+
+def show_all_users_and_scores(conn):
 
     print("== USERS TABLE ==")
-    cursor.execute("SELECT id, username, password, security_question, security_answer FROM users")
-    users = cursor.fetchall()
-    for user in users:
+    cursor = conn.execute("SELECT id, username, password, security_question, security_answer FROM users")
+    for user in cursor:
         user_id, username, password, question, answer = user
         print(f"ID: {user_id} | Username: {username} | Password: {password} | Question: {question} | Answer: {answer}")
 
     print("\n== SCORES TABLE (All Runs) ==")
-    cursor.execute("SELECT id, user_id, map_name, time_taken, collisions, checkpoints FROM scores")
-    scores = cursor.fetchall()
-    for score in scores:
+    cursor = conn.execute('''
+        SELECT s.id, s.user_id, m.path, s.time_taken, s.collisions, s.checkpoints
+        FROM scores s JOIN maps m ON m.id = s.map_id
+    ''')
+    for score in cursor:
         print(f"ScoreID: {score[0]} | UserID: {score[1]} | Map: {score[2]} | Time: {score[3]}s | Collisions: {score[4]} | Checkpoints: {score[5]}")
 
     print("\n== USER MAP STATS (Personal Leaderboard) ==")
-    cursor.execute("SELECT user_id, map_name, times_played, total_collisions, total_time FROM user_map_stats")
-    stats = cursor.fetchall()
-    for stat in stats:
+    cursor = conn.execute('''
+        SELECT s.user_id, m.path, s.times_played, s.total_collisions, s.total_time
+        FROM user_map_stats s JOIN maps m ON m.id = s.map_id
+    ''')
+    for stat in cursor:
         print(f"UserID: {stat[0]} | Map: {stat[1]} | Times Played: {stat[2]} | Collisions: {stat[3]} | Total Time: {stat[4]}s")
 
     print("\n== BEST MAP SCORES (Complete Leaderboard) ==")
-    cursor.execute("SELECT user_id, map_name, time_taken FROM user_best_map_scores")
-    best = cursor.fetchall()
-    for entry in best:
+    cursor = conn.execute('''
+        SELECT b.user_id, m.path, b.time_taken
+        FROM user_best_map_scores b JOIN maps m ON m.id = b.map_id
+    ''')
+    for entry in cursor:
         print(f"UserID: {entry[0]} | Map: {entry[1]} | Best Time: {entry[2]}s")
 
-    conn.close()
+
+def _filtered_query(table, user=None, map_name=None, since=None, until=None):
+    # the table's export query with the requested filters; dates only apply to scores
+    columns, sql = EXPORT_TABLES[table]
+    conditions, params = [], []
+    if user is not None:
+        conditions.append("u.username = ?")
+        params.append(user)
+    if map_name is not None and "m.path" in sql:
+        conditions.append("m.path = ?")
+        params.append(canonical_map_path(map_name))
+    if table == "scores":
+        if since is not None:
+            conditions.append("s.played_at >= ?")
+            params.append(since)
+        if until is not None:
+            conditions.append("s.played_at < ?")
+            params.append(until)
+    if conditions:
+        sql += " WHERE " + " AND ".join(conditions)
+    return columns, sql, params
+
+
+def _open_output(path, compress):
+    if compress:
+        return gzip.open(path, "wt", newline="", encoding="utf-8")
+    return open(path, "w", newline="", encoding="utf-8")
+
+
+def export_table(conn, table, path, fmt="csv", compress=False, batch_size=EXPORT_BATCH_SIZE, **filters):
+    # Stream one table to a CSV or JSON Lines file, batch_size rows at a time; returns the row count
+    columns, sql, params = _filtered_query(table, **filters)
+    cursor = conn.execute(sql, params)
+    count = 0
+    with _open_output(path, compress) as out:
+        if fmt == "csv":
+            writer = csv.writer(out)
+            writer.writerow(columns)
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            if fmt == "csv":
+                writer.writerows(rows)
+            else:
+                out.writelines(json.dumps(dict(zip(columns, row))) + "\n" for row in rows)
+            count += len(rows)
+    return count
+
+
+def _parse_date(text):
+    # ISO date or date-time, taken as UTC unless it says otherwise; returns Unix seconds
+    try:
+        moment = datetime.fromisoformat(text)
+    except ValueError:
+        print(f"Error: '{text}' is not a date like 2024-05-31 or 2024-05-31T18:00")
+        sys.exit(1)
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return int(moment.timestamp())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Show or export the contents of the scores database")
+    parser.add_argument('--db', default=db.DB_PATH, help="Database file")
+    commands = parser.add_subparsers(dest="command")
+    commands.add_parser("show", help="Print every table (the default)")
+    export = commands.add_parser("export", help="Stream tables to CSV or JSON Lines files")
+    export.add_argument('tables', nargs='*', help=f"Tables to export: {', '.join(EXPORT_TABLES)} (default: all)")
+    export.add_argument('--format', choices=["csv", "jsonl"], default="csv", help="Output format")
+    export.add_argument('--gzip', action='store_true', help="Compress the output files")
+    export.add_argument('--out', default="export", help="Directory the files are written to")
+    export.add_argument('--user', default=None, help="Only rows of this username")
+    export.add_argument('--map', default=None, help="Only rows of this map, e.g. maps/map1.png")
+    export.add_argument('--since', default=None, help="Only scores played at or after this UTC date")
+    export.add_argument('--until', default=None, help="Only scores played before this UTC date")
+    export.add_argument('--batch-size', type=int, default=EXPORT_BATCH_SIZE, help="Rows fetched per batch")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.db):
+        print(f"Error: {args.db} not found")
+        sys.exit(1)
+    conn = open_read_only(args.db)
+
+    if args.command != "export":
+        show_all_users_and_scores(conn)
+        return
+
+    if args.batch_size < 1:
+        print("Error: --batch-size must be positive")
+        sys.exit(1)
+    for table in args.tables:
+        if table not in EXPORT_TABLES:
+            print(f"Error: unknown table '{table}'")
+            sys.exit(1)
+    filters = {
+        "user": args.user,
+        "map_name": args.map,
+        "since": _parse_date(args.since) if args.since else None,
+        "until": _parse_date(args.until) if args.until else None,
+    }
+    os.makedirs(args.out, exist_ok=True)
+    for table in args.tables or list(EXPORT_TABLES):
+        path = os.path.join(args.out, f"{table}.{args.format}" + (".gz" if args.gzip else ""))
+        count = export_table(conn, table, path, args.format, args.gzip, args.batch_size, **filters)
+        print(f"{table}: {count} rows -> {path}")
+
 
 if __name__ == "__main__":
-    show_all_users_and_scores()
+    main()